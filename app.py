@@ -1,16 +1,29 @@
 import os
 import sqlite3
 import json
+import re
+import codecs
+import hashlib
+import base64
+import random
 import subprocess
 import threading
+import queue
+import heapq
+import itertools
 import time
 import zipfile
 import shutil
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, send_file, abort, redirect, url_for
-from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, render_template, request, jsonify, send_file, abort, redirect, url_for
+from werkzeug.utils import secure_filename, safe_join
+from feed_interleave import interleave_feed
 import uuid
 import urllib.request
+import urllib.parse
 
 # Telegram Bot Imports
 try:
@@ -27,6 +40,7 @@ app.secret_key = 'tiktok_tracker_secret_key_2024'
 DATABASE_PATH = 'data/trackui.db'
 DOWNLOADS_PATH = 'data/downloads'
 AVATARS_PATH = 'data/avatars'
+DOWNLOAD_LOGS_PATH = 'data/logs'
 MAX_RETRIES = 3
 RETRY_DELAY = 5
 
@@ -42,26 +56,34 @@ USER_AGENTS = [
     'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0'
 ]
-REQUEST_DELAY = 2  # seconds between requests
 TIMEOUT_THRESHOLD = 90  # seconds
 DOWNLOAD_TIMEOUT = 600  # seconds per-user download maximum (failsafe)
+DOWNLOAD_IDLE_TIMEOUT = 300  # seconds without gallery-dl output before a download is killed
 
 # Global variables for tracking
 download_progress = {}
-sync_status = {'running': False, 'last_sync': None, 'current_user': None, 'timeout_users': [], 'current_timeout': False}
+sync_status = {'running': False, 'last_sync': None, 'current_user': None, 'timeout_users': [], 'current_timeout': False, 'workers': {}}
+sync_workers_lock = threading.Lock()  # guards sync_status['workers'] (written by pool threads)
 sync_logs = []
 
 # This queue powers the Download Manager UI. We'll also push long-running non-download tasks (like Sync All) here.
-global_download_queue = []  # List of all downloads/tasks with their status
+global_download_queue = OrderedDict()  # download id -> entry, in the order they were queued
 active_downloads = {}  # Currently active downloads/tasks keyed by 'username' label
+_download_queue_lock = threading.RLock()
+DOWNLOAD_LOG_LINES = 200  # log lines kept in memory per entry (the full log goes to DOWNLOAD_LOGS_PATH)
 
 # Track running download processes and controls (pause/resume)
 download_processes = {}   # username -> subprocess.Popen
 _download_controls = {}   # username -> {'pause': bool}
+_username_locks = {}      # username -> Lock held while that handle downloads
+_username_locks_guard = threading.Lock()
 
 # Special label for representing the Sync All task in the Download Manager
 SYNC_QUEUE_USERNAME = 'Sync All'
 
+# Default Sync All workers per platform (overridable via sync_concurrency_<platform> settings)
+SYNC_CONCURRENCY_DEFAULTS = {'tiktok': 4, 'instagram': 2, 'coomer': 6}
+
 # Scheduler
 scheduler_started = False
 scheduler_logs = []  # Store scheduler activity logs
@@ -70,29 +92,26 @@ scheduler_logs = []  # Store scheduler activity logs
 timeout_count = 0
 user_agent_index = 0
 
-def init_database():
-    """Initialize the SQLite database with required tables."""
-    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-    print(f"Initializing database at: {os.path.abspath(DATABASE_PATH)}")
-    
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    # Check if platform column exists, migrate if needed
-    try:
-        cursor.execute("SELECT platform FROM users LIMIT 1")
-    except sqlite3.OperationalError:
-        # Platform column doesn't exist, need to migrate
+# Set by init_database when the users_fts search index is available
+users_fts_enabled = False
+
+# Schema migrations
+# Each step runs once, in order, in its own transaction; schema_version records
+# which steps have been applied. Steps must be safe to run against databases
+# created before schema_version existed (those are brought up to date and stamped).
+
+def _table_columns(cursor, table):
+    """Column names of `table` (empty if the table does not exist)."""
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def _migration_base_tables(cursor):
+    # Databases from before multi-platform support have users without a platform column
+    legacy_users = 'platform' not in _table_columns(cursor, 'users') and bool(_table_columns(cursor, 'users'))
+    if legacy_users:
         print("Migrating users table to add platform support...")
-        
-        # Backup existing data
-        cursor.execute("SELECT * FROM users")
-        existing_users = cursor.fetchall()
-        
-        # Drop and recreate users table with platform
         cursor.execute("DROP TABLE IF EXISTS users_old")
         cursor.execute("ALTER TABLE users RENAME TO users_old")
-        
+
     # Users table with platform support
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -112,27 +131,21 @@ def init_database():
             UNIQUE(username, platform)
         )
     ''')
-    
-    # Migrate existing data if we have backup
-    try:
-        cursor.execute("SELECT COUNT(*) FROM users_old")
-        old_count = cursor.fetchone()[0]
-        if old_count > 0:
-            print(f"Migrating {old_count} existing users to TikTok platform...")
-            cursor.execute('''
-                INSERT INTO users (username, platform, display_name, profile_picture, 
-                                 follower_count, following_count, video_count, is_tracking,
-                                 last_sync, created_at, download_count, last_download)
-                SELECT username, 'tiktok', display_name, profile_picture,
-                       follower_count, following_count, video_count, is_tracking,
-                       last_sync, created_at, download_count, last_download
-                FROM users_old
-            ''')
-        cursor.execute("DROP TABLE users_old")
-    except sqlite3.OperationalError:
-        # No old table, fresh install
-        pass
-    
+
+    if legacy_users:
+        old_count = cursor.execute("SELECT COUNT(*) FROM users_old").fetchone()[0]
+        print(f"Migrating {old_count} existing users to TikTok platform...")
+        # Keep ids so existing tag assignments still point at the right users
+        cursor.execute('''
+            INSERT INTO users (id, username, platform, display_name, profile_picture,
+                             follower_count, following_count, video_count, is_tracking,
+                             last_sync, created_at, download_count, last_download)
+            SELECT id, username, 'tiktok', display_name, profile_picture,
+                   follower_count, following_count, video_count, is_tracking,
+                   last_sync, created_at, download_count, last_download
+            FROM users_old
+        ''')
+
     # Tags table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS tags (
@@ -142,16 +155,19 @@ def init_database():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    # Drop and recreate user_tags table to fix foreign key references
-    try:
-        cursor.execute('DROP TABLE IF EXISTS user_tags')
-    except Exception:
-        pass
-    
-    # User tags junction table with correct foreign key references
+
+    # Renaming users re-points user_tags' foreign key at users_old; rebuild the
+    # junction table in that case, keeping the assignments that are still valid.
+    referenced = {row[2] for row in cursor.execute("PRAGMA foreign_key_list(user_tags)").fetchall()}
+    rebuild_user_tags = bool(referenced) and referenced != {'users', 'tags'}
+    if rebuild_user_tags:
+        print("Rebuilding user_tags with corrected foreign keys...")
+        cursor.execute("DROP TABLE IF EXISTS user_tags_old")
+        cursor.execute("ALTER TABLE user_tags RENAME TO user_tags_old")
+
+    # User tags junction table
     cursor.execute('''
-        CREATE TABLE user_tags (
+        CREATE TABLE IF NOT EXISTS user_tags (
             user_id INTEGER,
             tag_id INTEGER,
             PRIMARY KEY (user_id, tag_id),
@@ -160,6 +176,16 @@ def init_database():
         )
     ''')
 
+    if rebuild_user_tags:
+        cursor.execute('''
+            INSERT OR IGNORE INTO user_tags (user_id, tag_id)
+            SELECT user_id, tag_id FROM user_tags_old
+            WHERE user_id IN (SELECT id FROM users) AND tag_id IN (SELECT id FROM tags)
+        ''')
+        cursor.execute("DROP TABLE user_tags_old")
+    if legacy_users:
+        cursor.execute("DROP TABLE users_old")
+
     # App settings table for persistent configuration
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS settings (
@@ -167,7 +193,7 @@ def init_database():
             value TEXT
         )
     ''')
-    
+
     # Likes table for feed feature
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS likes (
@@ -177,11 +203,211 @@ def init_database():
         )
     ''')
 
+def _migration_media_catalog(cursor):
+    # Media catalog filled by the download pipeline (paths relative to DOWNLOADS_PATH)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL UNIQUE,
+            user_id INTEGER NOT NULL,
+            platform TEXT NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'post',
+            type TEXT NOT NULL,
+            size INTEGER DEFAULT 0,
+            mtime REAL DEFAULT 0,
+            highlight_title TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_user_kind ON media(user_id, kind, mtime)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_platform ON media(platform)')
+
+def _migration_media_reconciler(cursor):
+    # Fingerprint columns used by the filesystem reconciler
+    if 'inode' not in _table_columns(cursor, 'media'):
+        print("Migrating media table to add reconciler fingerprints...")
+        cursor.execute("ALTER TABLE media ADD COLUMN dir TEXT")
+        cursor.execute("ALTER TABLE media ADD COLUMN inode INTEGER DEFAULT 0")
+        # Directory part of the path (everything before the last '/')
+        cursor.execute("UPDATE media SET dir = substr(path, 1, length(rtrim(path, replace(path, '/', ''))) - 1)")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_dir ON media(dir)')
+
+    # Directory mtimes seen by the last reconciler pass (paths relative to DOWNLOADS_PATH)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media_dirs (
+            path TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            parent TEXT,
+            mtime_ns INTEGER DEFAULT 0,
+            scanned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_dirs_user ON media_dirs(user_id)')
+
+def _migration_dashboard_indexes(cursor):
+    # Dashboard ordering/filtering and tag lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_platform_created ON users(platform, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_tags_tag ON user_tags(tag_id, user_id)')
+
+def _migration_users_fts(cursor):
+    # Substring search over username/display_name (trigram FTS5, kept in sync by triggers).
+    # SQLite builds without FTS5/trigram keep the LIKE fallback; init_database retries
+    # the step on every start, so the index appears once SQLite supports it.
+    fts_exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'").fetchone() is not None
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                username, display_name, content='users', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 trigram search unavailable, falling back to LIKE: {e}")
+        return
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts(rowid, username, display_name) VALUES (new.id, new.username, new.display_name);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts(users_fts, rowid, username, display_name) VALUES ('delete', old.id, old.username, old.display_name);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, display_name ON users BEGIN
+            INSERT INTO users_fts(users_fts, rowid, username, display_name) VALUES ('delete', old.id, old.username, old.display_name);
+            INSERT INTO users_fts(rowid, username, display_name) VALUES (new.id, new.username, new.display_name);
+        END
+    ''')
+    if not fts_exists:
+        print("Building user search index...")
+        cursor.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+
+def _migration_jobs(cursor):
+    # Persistent Sync All / download jobs, resumed at startup after a restart
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            username TEXT NOT NULL,
+            platform TEXT NOT NULL,
+            batch TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, kind)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch)')
+
+def _migration_download_checkpoints(cursor):
+    # Where a paused download stopped, so resuming continues from there
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS download_checkpoints (
+            target TEXT PRIMARY KEY,
+            phase TEXT NOT NULL,
+            position INTEGER DEFAULT 0,
+            data TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_download_runs(cursor):
+    # Per-user timing history the download timeouts are derived from
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS download_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            platform TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            duration REAL,
+            files INTEGER DEFAULT 0,
+            bytes INTEGER DEFAULT 0,
+            max_gap REAL,
+            outcome TEXT,
+            finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_download_runs_user ON download_runs(username, platform, phase, id)')
+
+def _migration_avatar_paths(cursor):
+    # Resolved avatar file per user, so serving an avatar does not probe the avatar folder
+    if 'avatar_path' not in _table_columns(cursor, 'users'):
+        cursor.execute('ALTER TABLE users ADD COLUMN avatar_path TEXT')
+    backfill_avatar_paths(cursor)
+
+# Ordered (version, name, step). Append new steps; never renumber or edit applied ones.
+MIGRATIONS = [
+    (1, 'base tables', _migration_base_tables),
+    (2, 'media catalog', _migration_media_catalog),
+    (3, 'media reconciler fingerprints', _migration_media_reconciler),
+    (4, 'dashboard indexes', _migration_dashboard_indexes),
+    (5, 'user search index', _migration_users_fts),
+    (6, 'jobs', _migration_jobs),
+    (7, 'download checkpoints', _migration_download_checkpoints),
+    (8, 'download runs', _migration_download_runs),
+    (9, 'avatar paths', _migration_avatar_paths),
+]
+
+def apply_migrations(conn):
+    """Apply pending MIGRATIONS in order, each in its own transaction.
+    Returns the schema version the database is at afterwards.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    current = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    pending = [m for m in MIGRATIONS if m[0] > current]
+    if not pending:
+        return current
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # explicit BEGIN/COMMIT so DDL is part of the transaction
+    try:
+        for version, name, step in pending:
+            print(f"Applying schema migration {version}: {name}...")
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                step(cursor)
+                cursor.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            current = version
+    finally:
+        conn.isolation_level = isolation_level
+    return current
+
+def init_database():
+    """Initialize the SQLite database: apply schema migrations and seed default settings."""
+    os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+    print(f"Initializing database at: {os.path.abspath(DATABASE_PATH)}")
+    
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.execute('PRAGMA journal_mode=WAL')
+    version = apply_migrations(conn)
+
+    global users_fts_enabled
+    users_fts_enabled = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'").fetchone() is not None
+    if not users_fts_enabled:
+        # Migration 5 is recorded even when this SQLite lacked FTS5/trigram; try again
+        with conn:
+            _migration_users_fts(conn.cursor())
+        users_fts_enabled = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'").fetchone() is not None
+
     # Insert defaults if not present
     def ensure_setting(k, v):
-        cur = conn.execute('SELECT value FROM settings WHERE key = ?', (k,)).fetchone()
-        if not cur:
-            conn.execute('INSERT INTO settings (key, value) VALUES (?, ?)', (k, v))
+        conn.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', (k, v))
 
     ensure_setting('skip_existing', 'true')
     ensure_setting('schedule_enabled', 'false')
@@ -193,10 +419,38 @@ def init_database():
     ensure_setting('instagram_active_cookies', '')  # filename of active IG cookies file
     ensure_setting('profile_feed_videos_only', 'false')  # Hide images in per-profile feeds
     ensure_setting('instagram_following_cookies', '')  # filename of cookies for following feature
+    ensure_setting('media_rescan_interval', '30')       # minutes between media catalog reconciler passes
+    ensure_setting('sync_concurrency_tiktok', '4')      # parallel Sync All workers per platform
+    ensure_setting('sync_concurrency_instagram', '2')
+    ensure_setting('sync_concurrency_coomer', '6')
+    ensure_setting('rate_limit_tiktok', '30')           # requests per minute per platform (token bucket)
+    ensure_setting('rate_limit_instagram', '12')
+    ensure_setting('rate_limit_coomer', '60')
+    ensure_setting('sync_single_pass', '1')             # derive stats from download metadata instead of a second crawl
+    ensure_setting('profile_probe_items', '1')          # items fetched for stats/avatar probes (0 = full listing)
+    ensure_setting('download_history_keep', '10')       # finished entries kept in the Download Manager
+    ensure_setting('download_log_retention_days', '7')  # days to keep per-download log files in data/logs
+    ensure_setting('resume_jobs_on_startup', '1')       # continue interrupted syncs/downloads after a restart
+    ensure_setting('max_concurrent_downloads', '8')     # global cap on concurrent download units (all priorities)
+    ensure_setting('interactive_reserved_slots', '1')   # slots kept free for manual downloads
+    ensure_setting('max_external_processes', '6')       # concurrent gallery-dl/gdown processes; others wait
+    ensure_setting('min_free_memory_percent', '10')     # refuse new downloads below this much free RAM (0 = off)
+    ensure_setting('download_idle_timeout', '300')      # kill a download silent this long (users without history)
+    ensure_setting('download_timeout_factor', '3')      # history-based limits = slowest recent run x this
+    ensure_setting('download_timeout_min', '120')       # bounds for the history-based per-user timeout
+    ensure_setting('download_timeout_max', '14400')
+    ensure_setting('stall_policy', 'restart')           # stalled downloads: 'restart', 'kill' or 'wait'
+    ensure_setting('stall_restarts', '1')               # restarts per run before a stalled download is given up
+    ensure_setting('feed_video_weight', '1')            # relative feed frequency of videos (0 = leave out)
+    ensure_setting('feed_image_weight', '1')            # relative feed frequency of images (0 = leave out)
+    ensure_setting('feed_recency_boost', '1')           # extra weight for the newest media, halving every 30 days
+    ensure_setting('generate_thumbnails', '1')          # make grid thumbnails after each download run
+    ensure_setting('thumbnail_workers', '2')            # concurrent ffmpeg thumbnail jobs
     
     conn.commit()
     conn.close()
-    print("Database initialized successfully with all tables created.")
+    invalidate_settings_cache()
+    print(f"Database initialized successfully (schema version {version}).")
     
 def verify_database():
     """Verify that database tables exist and are accessible."""
@@ -220,43 +474,1018 @@ def verify_database():
         print(f"Database verification failed: {e}")
         return False
 
-def get_db_connection():
-    """Get database connection with row factory for dict-like access."""
-    conn = sqlite3.connect(DATABASE_PATH)
+# Database connection pool
+DB_POOL_SIZE = 8          # idle connections kept for reuse
+DB_BUSY_TIMEOUT_MS = 30000
+
+_db_local = threading.local()
+_db_pool = []
+_db_pool_lock = threading.Lock()
+_db_generation = 0
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection handed out by get_db_connection().
+    Nested get_db_connection() calls on one thread share the connection;
+    close() drops a reference and the last one returns it to the pool
+    (rolling back anything left uncommitted, as a real close would).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refs = 0
+        self.generation = _db_generation
+
+    def close(self):
+        if self.refs <= 0:
+            return
+        self.refs -= 1
+        if self.refs == 0:
+            _release_db_connection(self)
+
+    def discard(self):
+        """Really close the underlying SQLite handle."""
+        try:
+            sqlite3.Connection.close(self)
+        except Exception:
+            pass
+
+def _open_db_connection():
+    conn = sqlite3.connect(DATABASE_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False, factory=PooledConnection)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def _release_db_connection(conn):
+    if getattr(_db_local, 'conn', None) is conn:
+        _db_local.conn = None
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except Exception:
+        conn.discard()
+        return
+    with _db_pool_lock:
+        if conn.generation == _db_generation and len(_db_pool) < DB_POOL_SIZE:
+            _db_pool.append(conn)
+            return
+    conn.discard()
+
+def get_db_connection():
+    """Get the calling thread's pooled database connection (rows support dict-like access)."""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or conn.refs <= 0 or conn.generation != _db_generation:
+        conn = None
+        with _db_pool_lock:
+            while _db_pool and conn is None:
+                candidate = _db_pool.pop()
+                if candidate.generation == _db_generation:
+                    conn = candidate
+                else:
+                    candidate.discard()
+        if conn is None:
+            conn = _open_db_connection()
+        _db_local.conn = conn
+    conn.refs += 1
     return conn
 
+@contextmanager
+def db_connection():
+    """get_db_connection() for a `with` block; the connection is released even if the block raises."""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def release_thread_db_connection():
+    """Roll back and hand back a connection the calling thread forgot to close.
+    Requests get this from teardown_request; background loops call it themselves.
+    """
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None and conn.refs > 0:
+        conn.refs = 1
+        conn.close()
+
+def reset_db_pool():
+    """Close idle pooled connections and retire busy ones (e.g. before the DB file is replaced)."""
+    global _db_generation
+    with _db_pool_lock:
+        _db_generation += 1
+        idle = _db_pool[:]
+        _db_pool.clear()
+    for conn in idle:
+        try:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except Exception:
+            pass
+        conn.discard()
+
+@app.teardown_request
+def release_request_db_connection(exc=None):
+    """Hand back a connection a request forgot to close."""
+    release_thread_db_connection()
+
 # Settings helpers
+# The settings table is loaded once into memory; writes through set_setting
+# update the cache, and bulk writers call invalidate_settings_cache().
+_settings_cache = None
+_settings_generation = 0
+_settings_lock = threading.Lock()
+
+def _load_settings_cache():
+    global _settings_cache
+    with _settings_lock:
+        generation = _settings_generation
+    conn = get_db_connection()
+    try:
+        cache = {row['key']: row['value'] for row in conn.execute('SELECT key, value FROM settings')}
+    finally:
+        conn.close()
+    with _settings_lock:
+        # Don't install a snapshot that a concurrent write has already made stale
+        if generation == _settings_generation:
+            _settings_cache = cache
+    return cache
+
+def invalidate_settings_cache():
+    """Drop the in-memory settings so the next lookup reloads them from the DB."""
+    global _settings_cache, _settings_generation
+    with _settings_lock:
+        _settings_cache = None
+        _settings_generation += 1
 
 def get_setting(key, default=None):
     try:
-        conn = get_db_connection()
-        row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
-        conn.close()
-        if row and row['value'] is not None:
-            return row['value']
+        cache = _settings_cache
+        if cache is None:
+            cache = _load_settings_cache()
+        value = cache.get(key)
+        if value is not None:
+            return value
     except Exception:
         pass
     return default
 
 def set_setting(key, value):
+    global _settings_generation
     conn = get_db_connection()
     conn.execute('INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value', (key, str(value)))
     conn.commit()
     conn.close()
+    with _settings_lock:
+        _settings_generation += 1
+        if _settings_cache is not None:
+            _settings_cache[key] = str(value)
 
 
 def get_bool_setting(key, default=False):
     val = str(get_setting(key, 'true' if default else 'false')).strip().lower()
     return val in ('1', 'true', 'yes', 'on')
 
-def run_gallery_dl_json(username, platform='tiktok', retry_count=0):
-    """Extract metadata from TikTok profile using gallery-dl with rate limiting bypass."""
+def get_int_setting(key, default=0):
+    try:
+        return int(get_setting(key, default) or default)
+    except (TypeError, ValueError):
+        return default
+
+def get_float_setting(key, default=0.0):
+    try:
+        return float(get_setting(key, default) or default)
+    except (TypeError, ValueError):
+        return default
+
+# Media catalog
+
+MEDIA_EXTENSIONS = ('.mp4', '.jpg', '.jpeg', '.png', '.gif')
+
+def classify_media_path(rel_path):
+    """Return (kind, type) for a media path relative to DOWNLOADS_PATH.
+    Paths look like <platform>/<username>/[stories|highlights/]<file>.
+    """
+    parts = rel_path.split('/')
+    kind = 'post'
+    if len(parts) > 3:
+        sub = parts[2].lower()
+        if sub == 'stories':
+            kind = 'story'
+        elif sub == 'highlights':
+            kind = 'highlight'
+    file_type = 'video' if rel_path.lower().endswith('.mp4') else 'image'
+    return kind, file_type
+
+def read_highlight_title(file_path, rel_path):
+    """Resolve the highlight collection name from the gallery-dl JSON sidecar or folder layout."""
+    json_path = file_path + '.json'
+    if os.path.exists(json_path):
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            if metadata.get('highlight_title'):
+                return metadata['highlight_title'].strip()
+        except Exception as e:
+            print(f"Error reading JSON metadata for {rel_path}: {e}")
+
+    # Fallback: try to extract from path structure
+    path_parts = rel_path.split('/')
+    for i, part in enumerate(path_parts):
+        if 'highlights' in part.lower():
+            if i + 1 < len(path_parts) - 1:
+                return path_parts[i + 1]
+            break
+    return None
+
+def reconcile_user_media(conn, user_id, username, platform, full=False):
+    """Bring one user's catalog rows in line with the files on disk.
+    Directories whose mtime matches the last pass are skipped (their stored
+    subdirectories are still visited); changed directories are listed and
+    their files compared by inode/size/mtime fingerprint.
+    Returns (dirs_scanned, dirs_skipped).
+    """
+    root_rel = f"{platform}/{username}"
+    known_dirs = {}
+    children = {}
+    for row in conn.execute('SELECT path, parent, mtime_ns FROM media_dirs WHERE user_id = ?', (user_id,)):
+        known_dirs[row['path']] = row['mtime_ns']
+        children.setdefault(row['parent'], []).append(row['path'])
+
+    scanned = skipped = 0
+    seen_dirs = set()
+    stack = [root_rel]
+    while stack:
+        rel_dir = stack.pop()
+        abs_dir = os.path.join(DOWNLOADS_PATH, *rel_dir.split('/'))
+        try:
+            dir_mtime = os.stat(abs_dir).st_mtime_ns
+        except OSError:
+            continue
+        seen_dirs.add(rel_dir)
+
+        if not full and known_dirs.get(rel_dir) == dir_mtime:
+            skipped += 1
+            stack.extend(children.get(rel_dir, []))
+            continue
+
+        scanned += 1
+        existing = {
+            row['path']: (row['inode'], row['size'], row['mtime'])
+            for row in conn.execute('SELECT path, inode, size, mtime FROM media WHERE dir = ?', (rel_dir,))
+        }
+        seen_files = set()
+        subdirs = []
+        rows = []
+        try:
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(f"{rel_dir}/{entry.name}")
+                        continue
+                    if not entry.name.lower().endswith(MEDIA_EXTENSIONS):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    rel_path = f"{rel_dir}/{entry.name}"
+                    seen_files.add(rel_path)
+                    if existing.get(rel_path) == (st.st_ino, st.st_size, st.st_mtime):
+                        continue
+                    kind, file_type = classify_media_path(rel_path)
+                    highlight_title = read_highlight_title(entry.path, rel_path) if kind == 'highlight' else None
+                    rows.append((rel_path, rel_dir, user_id, platform, kind, file_type,
+                                 st.st_size, st.st_mtime, st.st_ino, highlight_title))
+        except OSError as e:
+            print(f"Media reconciler could not list {rel_dir}: {e}")
+            continue
+
+        if rows:
+            conn.executemany('''
+                INSERT INTO media (path, dir, user_id, platform, kind, type, size, mtime, inode, highlight_title)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    dir=excluded.dir, user_id=excluded.user_id, platform=excluded.platform,
+                    kind=excluded.kind, type=excluded.type, size=excluded.size,
+                    mtime=excluded.mtime, inode=excluded.inode, highlight_title=excluded.highlight_title
+            ''', rows)
+        stale = [(path,) for path in existing if path not in seen_files]
+        if stale:
+            conn.executemany('DELETE FROM media WHERE path = ?', stale)
+
+        # Store the mtime read before listing so changes made mid-scan are picked up next pass
+        conn.execute('''
+            INSERT INTO media_dirs (path, user_id, parent, mtime_ns, scanned_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(path) DO UPDATE SET
+                user_id=excluded.user_id, parent=excluded.parent,
+                mtime_ns=excluded.mtime_ns, scanned_at=excluded.scanned_at
+        ''', (rel_dir, user_id, rel_dir.rsplit('/', 1)[0] if rel_dir != root_rel else None, dir_mtime))
+        stack.extend(subdirs)
+
+    # Directories that disappeared take their catalog rows with them
+    gone = [(path,) for path in known_dirs if path not in seen_dirs]
+    if gone:
+        conn.executemany('DELETE FROM media WHERE dir = ?', gone)
+        conn.executemany('DELETE FROM media_dirs WHERE path = ?', gone)
+    conn.commit()
+    return scanned, skipped
+
+def index_user_media(username, platform='tiktok'):
+    """Refresh the media catalog for one user after a download run.
+    Returns the number of media files cataloged for the user.
+    """
+    with db_connection() as conn:
+        user = conn.execute('SELECT id FROM users WHERE username = ? AND platform = ?', (username, platform)).fetchone()
+        if not user:
+            return 0
+        reconcile_user_media(conn, user['id'], username, platform)
+        count = conn.execute('SELECT COUNT(*) FROM media WHERE user_id = ?', (user['id'],)).fetchone()[0]
+    if get_bool_setting('generate_thumbnails', True):
+        threading.Thread(target=queue_user_thumbnails, args=(user['id'],), daemon=True).start()
+    return count
+
+MEDIA_RESCAN_LABEL = 'Media Rescan'
+_media_reconcile_lock = threading.Lock()
+
+def reconcile_media_catalog(full=False, show_progress=False):
+    """Run one reconciler pass over every tracked user's download folder.
+    Returns False if another pass is already running.
+    """
+    if not _media_reconcile_lock.acquire(blocking=False):
+        return False
+    try:
+        started = time.time()
+        conn = get_db_connection()
+        users = conn.execute('SELECT id, username, platform FROM users ORDER BY username').fetchall()
+
+        # Drop rows left behind by users that no longer exist
+        conn.execute('DELETE FROM media WHERE user_id NOT IN (SELECT id FROM users)')
+        conn.execute('DELETE FROM media_dirs WHERE user_id NOT IN (SELECT id FROM users)')
+        conn.commit()
+
+        if show_progress:
+            add_to_global_queue(MEDIA_RESCAN_LABEL)
+            update_global_queue(MEDIA_RESCAN_LABEL,
+                              status='running',
+                              total_files=len(users),
+                              files_downloaded=0,
+                              current_file='Full rescan...' if full else 'Checking for changes...')
+
+        total_scanned = total_skipped = 0
+        for i, user in enumerate(users):
+            if show_progress:
+                update_global_queue(MEDIA_RESCAN_LABEL, files_downloaded=i, current_file=f"Scanning @{user['username']}")
+            try:
+                scanned, skipped = reconcile_user_media(conn, user['id'], user['username'], user['platform'], full=full)
+                total_scanned += scanned
+                total_skipped += skipped
+            except Exception as e:
+                print(f"Media reconciler error for {user['username']} ({user['platform']}): {e}")
+        conn.close()
+
+        summary = f"{total_scanned} folders rescanned, {total_skipped} unchanged in {time.time() - started:.1f}s"
+        print(f"Media reconciler: {summary}")
+        if show_progress:
+            update_global_queue(MEDIA_RESCAN_LABEL,
+                              status='completed',
+                              files_downloaded=len(users),
+                              current_file=f"Completed ({summary})")
+        return True
+    except Exception as e:
+        print(f"Media reconciler failed: {e}")
+        if show_progress:
+            update_global_queue(MEDIA_RESCAN_LABEL, status='failed', current_file=f"Error: {e}")
+        return True
+    finally:
+        _media_reconcile_lock.release()
+
+def start_media_reconciler_thread():
+    """Reconcile the catalog at startup and then every `media_rescan_interval` minutes."""
+    def reconciler_loop():
+        while True:
+            reconcile_media_catalog()
+            release_thread_db_connection()
+            time.sleep(max(get_int_setting('media_rescan_interval', 30), 1) * 60)
+
+    threading.Thread(target=reconciler_loop, daemon=True).start()
+
+# Thumbnails
+# Grids show small WebP thumbnails (poster frames for videos) made with the
+# ffmpeg CLI. Cache files are named by a hash of the source's path, size and
+# mtime, so a changed file gets a new thumbnail and an unchanged one is never
+# regenerated. They are made in the background after each download run and on
+# demand by /thumbs/<path>. On-demand jobs go ahead of queued background ones,
+# and /thumbs/ answers with a placeholder at once while one is being made.
+THUMBS_PATH = 'data/thumbs'
+THUMB_WIDTH = 480        # pixels; height follows the aspect ratio
+THUMB_QUALITY = 70       # WebP quality
+THUMB_TIMEOUT = 60       # seconds one ffmpeg run may take
+THUMB_ON_DEMAND, THUMB_BACKGROUND = 0, 1  # job priorities (lower runs first)
+# 1x1 transparent GIF served while a thumbnail is pending; pages retry it later
+THUMB_PLACEHOLDER = base64.b64decode('R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+_thumb_queue = queue.PriorityQueue()  # (priority, seq, cache path)
+_thumb_seq = itertools.count()
+_thumb_workers = []
+_thumb_jobs = {}          # cache path -> job dict, while queued or being generated
+_thumb_failed = set()     # cache paths ffmpeg could not produce
+_thumb_lock = threading.Lock()
+
+def thumbnail_cache_path(rel_path, size, mtime):
+    key = hashlib.sha1(f"{rel_path}\0{size}\0{mtime!r}\0{THUMB_WIDTH}".encode('utf-8')).hexdigest()
+    return os.path.join(THUMBS_PATH, key[:2], f"{key}.webp")
+
+def generate_thumbnail(src, dest, is_video, kind='thumbnail'):
+    """Write a WebP thumbnail of `src` to `dest` with ffmpeg. Returns True on success.
+    `kind` is the process admission class ffmpeg waits in.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f"{dest}.{threading.get_ident()}.tmp.webp"
+    scale = f"scale='min({THUMB_WIDTH},iw)':-2"
+    # Skip into the video a little for a representative frame; fall back to the first frame for very short clips
+    attempts = [['-ss', '1'], []] if is_video else [[]]
+    try:
+        for seek in attempts:
+            cmd = ['ffmpeg', '-v', 'error', '-y', *seek, '-i', src, '-frames:v', '1',
+                   '-vf', scale, '-c:v', 'libwebp', '-quality', str(THUMB_QUALITY), tmp]
+            with external_process(kind=kind):
+                result = subprocess.run(cmd, capture_output=True, timeout=THUMB_TIMEOUT)
+            if result.returncode == 0 and os.path.exists(tmp) and os.path.getsize(tmp) > 0:
+                os.replace(tmp, dest)
+                return True
+        print(f"Thumbnail failed for {src}: {result.stderr.decode('utf-8', errors='replace').strip()[:200]}")
+        return False
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Thumbnail failed for {src}: {e}")
+        return False
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _thumbnail_worker():
+    while True:
+        priority, _, dest = _thumb_queue.get()
+        with _thumb_lock:
+            job = _thumb_jobs.get(dest)
+            # A job moved up to on-demand leaves its background entry behind
+            if job is None or job['running'] or job['priority'] != priority:
+                continue
+            job['running'] = True
+        ok = False
+        try:
+            ok = generate_thumbnail(job['src'], dest, job['is_video'],
+                                    kind='sync' if priority == THUMB_ON_DEMAND else 'thumbnail')
+        except Exception as e:
+            print(f"Thumbnail failed for {job['src']}: {e}")
+        finally:
+            with _thumb_lock:
+                _thumb_jobs.pop(dest, None)
+                if not ok:
+                    _thumb_failed.add(dest)
+
+def submit_thumbnail(rel_path, size, mtime, file_type, priority=THUMB_BACKGROUND):
+    """Queue a thumbnail unless it exists or already failed; a queued one is
+    moved up if `priority` is more urgent. Returns (cache path, pending).
+    """
+    dest = thumbnail_cache_path(rel_path, size, mtime)
+    with _thumb_lock:
+        job = _thumb_jobs.get(dest)
+        if job is not None:
+            if priority < job['priority'] and not job['running']:
+                job['priority'] = priority
+                _thumb_queue.put((priority, next(_thumb_seq), dest))
+            return dest, True
+        if dest in _thumb_failed or os.path.exists(dest) or not shutil.which('ffmpeg'):
+            return dest, False
+        if not _thumb_workers:
+            for i in range(max(get_int_setting('thumbnail_workers', 2), 1)):
+                worker = threading.Thread(target=_thumbnail_worker, daemon=True, name=f'thumbs-{i}')
+                worker.start()
+                _thumb_workers.append(worker)
+        _thumb_jobs[dest] = {'src': os.path.join(DOWNLOADS_PATH, *rel_path.split('/')),
+                             'is_video': file_type == 'video', 'priority': priority, 'running': False}
+        _thumb_queue.put((priority, next(_thumb_seq), dest))
+    return dest, True
+
+def queue_user_thumbnails(user_id):
+    """Queue thumbnails for a user's cataloged media that have none yet."""
+    with db_connection() as conn:
+        rows = conn.execute('SELECT path, type, size, mtime FROM media WHERE user_id = ?', (user_id,)).fetchall()
+    queued = 0
+    for row in rows:
+        _, pending = submit_thumbnail(row['path'], row['size'], row['mtime'], row['type'])
+        queued += pending
+    return queued
+
+def media_version(size, mtime):
+    """Token that changes whenever a file is replaced; used as its ETag and ?v= cache key."""
+    return f"{int(size or 0):x}-{int((mtime or 0) * 1000):x}"
+
+def media_row_to_file(row):
+    """Shape a media row like the file dicts the templates expect."""
+    return {
+        'filename': os.path.basename(row['path']),
+        'path': row['path'],
+        'type': row['type'],
+        'size': row['size'],
+        'modified': datetime.fromtimestamp(row['mtime'] or 0),
+        'version': media_version(row['size'], row['mtime'])
+    }
+
+# Rate limiting
+# Requests per minute allowed per platform/host (overridable via rate_limit_<key> settings)
+RATE_LIMIT_DEFAULTS = {'tiktok': 30, 'instagram': 12, 'coomer': 60, 'gdrive': 30}
+# Only gallery-dl's [error]/[warning] log lines are checked: file paths and post
+# ids in the rest of the output often contain "429" by chance.
+RATE_LIMIT_SIGNALS = re.compile(r"\b429\b|too many requests|rate[ -]?limit(ed|ing)?\b", re.IGNORECASE)
+
+class TokenBucket:
+    """Thread-safe token bucket whose refill rate adapts to rate-limit signals.
+    The rate is halved on a 429/"rate limit" response and recovers additively
+    back towards the configured rate on clean runs (AIMD).
+    """
+    def __init__(self, rate_per_minute, burst=3):
+        self.base_rate = rate_per_minute / 60.0
+        self.rate = self.base_rate
+        self.min_rate = self.base_rate / 16
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def penalize(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def reward(self):
+        with self.lock:
+            self._refill()
+            self.rate = min(self.base_rate, self.rate + self.base_rate / 10)
+
+    def retune(self, rate_per_minute):
+        """Apply a new configured rate, keeping any current slowdown proportionally."""
+        with self.lock:
+            self._refill()
+            base_rate = rate_per_minute / 60.0
+            self.rate = max(base_rate / 16, min(base_rate, self.rate * base_rate / self.base_rate))
+            self.base_rate = base_rate
+            self.min_rate = base_rate / 16
+
+rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def rate_limit_key(platform_or_url):
+    """Map a platform name or URL onto the rate limiter that governs it."""
+    value = (platform_or_url or '').lower()
+    if '://' not in value:
+        return value or 'default'
+    host = urllib.parse.urlparse(value).netloc
+    for key, domain in (('tiktok', 'tiktok.com'), ('instagram', 'instagram.com'), ('coomer', 'coomer.'),
+                        ('gdrive', 'drive.google.com')):
+        if domain in host:
+            return key
+    return host or 'default'
+
+def get_rate_limiter(platform_or_url):
+    """The limiter for a platform/host, retuned if its rate_limit_<key> setting changed."""
+    key = rate_limit_key(platform_or_url)
+    per_minute = max(get_float_setting(f'rate_limit_{key}', RATE_LIMIT_DEFAULTS.get(key, 30)), 0.1)
+    with _rate_limiters_lock:
+        limiter = rate_limiters.get(key)
+        if limiter is None:
+            limiter = rate_limiters[key] = TokenBucket(per_minute)
+        elif abs(limiter.base_rate * 60 - per_minute) > 1e-9:
+            limiter.retune(per_minute)
+        return limiter
+
+def acquire_rate_limit(platform_or_url):
+    """Wait for permission to start a request against a platform/host."""
+    waited = get_rate_limiter(platform_or_url).acquire()
+    if waited >= 1:
+        print(f"Rate limiter: waited {waited:.1f}s for {rate_limit_key(platform_or_url)}")
+    return waited
+
+def log_problem_lines(output):
+    """The [error]/[warning] lines of gallery-dl output (a string or a list of lines)."""
+    lines = output.splitlines() if isinstance(output, str) else (output or [])
+    return [line for line in lines if '[error]' in line or '[warning]' in line]
+
+def report_rate_limit(platform_or_url, output, returncode=0):
+    """Feed a finished request's output back into its limiter.
+    Returns True if an error/warning line looked like a rate-limit response.
+    """
+    limiter = get_rate_limiter(platform_or_url)
+    if any(RATE_LIMIT_SIGNALS.search(line) for line in log_problem_lines(output)):
+        limiter.penalize()
+        print(f"Rate limit signal from {rate_limit_key(platform_or_url)}; slowing to {limiter.rate * 60:.1f} req/min")
+        return True
+    if returncode == 0:
+        limiter.reward()
+    return False
+
+# Process admission
+# Every gallery-dl/gdown process is admitted through process_admission: at most
+# `max_external_processes` run at once and the rest wait by download priority,
+# in arrival order within a class (shown in the Download Manager). While free memory is under `min_free_memory_percent`
+# no further process starts until a running one exits, and new download work is
+# refused up front by the API.
+
+def memory_available_percent():
+    """Available RAM as a percentage of total (MemAvailable), or None without /proc/meminfo."""
+    try:
+        info = {}
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                info[key] = int(value.split()[0])
+        return info['MemAvailable'] * 100.0 / info['MemTotal']
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        return None
+
+def memory_pressure_error():
+    """Reason to refuse new download work because memory is low, or None."""
+    threshold = get_float_setting('min_free_memory_percent', 10)
+    available = memory_available_percent()
+    if threshold > 0 and available is not None and available < threshold:
+        return f"Not enough free memory to start new downloads ({available:.0f}% free, {threshold:.0f}% required)"
+    return None
+
+class ProcessAdmission:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, ticket, label)
+        self._tickets = itertools.count()
+        self.running = 0
+
+    def limit(self):
+        return max(1, get_int_setting('max_external_processes', 6))
+
+    def _status(self):
+        return {'running': self.running, 'limit': self.limit(),
+                'waiting': [label for _, _, label in sorted(self._waiting)]}
+
+    def acquire(self, label, kind=None):
+        """Wait for a process slot. Waiters are admitted by DOWNLOAD_PRIORITIES
+        class (FIFO within a class); `kind` defaults to the download_scheduler
+        slot the calling thread holds; work without one ranks with 'sync' and kinds
+        outside DOWNLOAD_PRIORITIES (thumbnails) come last.
+        """
+        kind = kind or download_scheduler.current_kind() or 'sync'
+        entry = (DOWNLOAD_PRIORITIES.get(kind, len(DOWNLOAD_PRIORITIES)), next(self._tickets), label)
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            queued = self._waiting[0] != entry or self.running >= self.limit()
+            status = self._status() if queued else None
+        if queued:
+            self._changed(status)
+            if label in active_downloads:
+                update_global_queue(label, current_file='Waiting for a free process slot...')
+        with self._cond:
+            while (self._waiting[0] != entry or self.running >= self.limit()
+                   or (self.running and memory_pressure_error())):
+                # The timeout re-checks memory and the limit setting
+                self._cond.wait(timeout=5)
+            heapq.heappop(self._waiting)
+            self.running += 1
+            self._cond.notify_all()
+            status = self._status()
+        self._changed(status)
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify_all()
+            status = self._status()
+        self._changed(status)
+
+    def status(self):
+        with self._cond:
+            return self._status()
+
+    def _changed(self, status):
+        publish_download_event('processes', status)
+
+process_admission = ProcessAdmission()
+
+@contextmanager
+def external_process(rate_key=None, label=None, kind=None):
+    """Wait on the rate limiter for `rate_key`, then admit one external process.
+    Waiting on the limiter first keeps a throttled platform from holding a
+    process slot the other platforms could use.
+    """
+    if rate_key:
+        acquire_rate_limit(rate_key)
+    process_admission.acquire(label or rate_key or 'process', kind=kind)
+    try:
+        yield
+    finally:
+        process_admission.release()
+
+# Download scheduler
+# Every unit of download work (a manual download, stories/highlights, one Sync
+# All user, one avatar refresh) holds a slot from download_scheduler while it
+# runs. Freed slots go to the highest-priority waiter first (FIFO within a
+# class), and `interactive_reserved_slots` of the `max_concurrent_downloads`
+# cap are only usable by manual downloads, so those start at once even while
+# a sync has filled everything else.
+DOWNLOAD_PRIORITIES = {'interactive': 0, 'stories': 1, 'sync': 2, 'avatar': 3}
+
+class DownloadScheduler:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._local = threading.local()
+        self.active = {kind: 0 for kind in DOWNLOAD_PRIORITIES}
+
+    def _limit(self, kind):
+        cap = max(1, get_int_setting('max_concurrent_downloads', 8))
+        if kind == 'interactive':
+            return cap
+        return max(1, cap - max(0, get_int_setting('interactive_reserved_slots', 1)))
+
+    def acquire(self, kind):
+        # Nested units on one thread (e.g. stories inside a sync) share the outer slot
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth = depth + 1
+            return
+        ticket = (DOWNLOAD_PRIORITIES[kind], next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            # The timeout re-reads the cap in case the settings change while waiting
+            while self._waiting[0] != ticket or sum(self.active.values()) >= self._limit(kind):
+                self._cond.wait(timeout=5)
+            heapq.heappop(self._waiting)
+            self.active[kind] += 1
+            self._cond.notify_all()
+        self._local.depth = 1
+        self._local.kind = kind
+
+    def current_kind(self):
+        """Kind of the slot the calling thread holds, or None."""
+        return self._local.kind if getattr(self._local, 'depth', 0) else None
+
+    def release(self):
+        self._local.depth -= 1
+        if self._local.depth:
+            return
+        with self._cond:
+            self.active[self._local.kind] -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, kind):
+        self.acquire(kind)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def status(self):
+        with self._cond:
+            waiting = {kind: 0 for kind in DOWNLOAD_PRIORITIES}
+            names = {v: k for k, v in DOWNLOAD_PRIORITIES.items()}
+            for priority, _ in self._waiting:
+                waiting[names[priority]] += 1
+            return {'active': dict(self.active), 'waiting': waiting,
+                    'limit': max(1, get_int_setting('max_concurrent_downloads', 8))}
+
+download_scheduler = DownloadScheduler()
+
+# gallery-dl JSON streaming
+class GalleryDLJsonStream:
+    """Run a gallery-dl --dump-json command and yield records as they arrive.
+    Accepts both a single top-level JSON array and line-delimited JSON, so
+    callers never hold the raw output or parse it twice. Only an array that is
+    the whole stream is unwrapped; arrays that are records of a line-delimited
+    stream are yielded as they are. Iteration raises
+    subprocess.TimeoutExpired if the command runs past `timeout`; `close()`
+    stops the process early. `returncode` and `stderr` are set once done.
+    """
+    CHUNK_SIZE = 64 * 1024
+    STDERR_LINES = 200
+
+    def __init__(self, cmd, timeout=TIMEOUT_THRESHOLD, rate_key=None, label=None):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.rate_key = rate_key
+        self.label = label
+        self._admitted = False
+        self.process = None
+        self.returncode = None
+        self.timed_out = False
+        self.closed = False
+        self._stderr_lines = []
+        self._stderr_thread = None
+        self._timer = None
+
+    @property
+    def stderr(self):
+        return ''.join(self._stderr_lines)
+
+    def _read_stderr(self):
+        try:
+            for line in iter(self.process.stderr.readline, b''):
+                self._stderr_lines.append(line.decode('utf-8', errors='replace'))
+                if len(self._stderr_lines) > self.STDERR_LINES:
+                    del self._stderr_lines[0]
+        except Exception:
+            pass
+
+    def _on_timeout(self):
+        self.timed_out = True
+        self._kill()
+
+    def _kill(self):
+        if self.process and self.process.poll() is None:
+            try:
+                self.process.kill()
+            except Exception:
+                pass
+
+    def _start(self):
+        if self.rate_key:
+            acquire_rate_limit(self.rate_key)
+        process_admission.acquire(self.label or self.rate_key or 'gallery-dl')
+        self._admitted = True
+        self.process = subprocess.Popen(
+            self.cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self._stderr_thread = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr_thread.start()
+        if self.timeout:
+            self._timer = threading.Timer(self.timeout, self._on_timeout)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def __iter__(self):
+        self._start()
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        buf = ''
+        pos = 0
+        depth = 0  # 1 while inside the enclosing top-level array
+        first = True  # no value seen yet; only the first one can be an enclosing array
+        eof = False
+        try:
+            while True:
+                # Decode every complete value currently in the buffer
+                while True:
+                    while pos < len(buf) and (buf[pos].isspace() or (depth and buf[pos] == ',')):
+                        pos += 1
+                    if pos >= len(buf):
+                        break
+                    ch = buf[pos]
+                    if first and ch == '[':
+                        # An array that closes on its own line is a line-delimited record,
+                        # unless nothing follows it (then it is the whole stream)
+                        line_end = buf.find('\n', pos)
+                        if line_end == -1 and not eof:
+                            break
+                        try:
+                            record, end = decoder.raw_decode(buf, pos)
+                        except ValueError:
+                            end = None
+                        if end is None or (line_end != -1 and end > line_end):
+                            first = False
+                            depth = 1
+                            pos += 1
+                            continue
+                        if not buf[end:].strip() and not eof:
+                            break
+                        first = False
+                        pos = end
+                        for item in (record if not buf[end:].strip() else [record]):
+                            yield item
+                            if self.closed:
+                                return
+                        continue
+                    if depth == 1 and ch == ']':
+                        depth = 0
+                        pos += 1
+                        continue
+                    try:
+                        record, end = decoder.raw_decode(buf, pos)
+                    except ValueError:
+                        if not eof and ch in '{["-0123456789tfn':
+                            break  # value is probably still arriving
+                        # Not JSON (a stray log line) - skip to the next line
+                        newline = buf.find('\n', pos)
+                        if newline == -1:
+                            if not eof:
+                                break
+                            pos = len(buf)
+                        else:
+                            pos = newline + 1
+                        continue
+                    first = False
+                    pos = end
+                    yield record
+                    if self.closed:
+                        return
+
+                if eof:
+                    break
+                buf = buf[pos:]
+                pos = 0
+                chunk = self.process.stdout.read1(self.CHUNK_SIZE)
+                if not chunk:
+                    buf += text_decoder.decode(b'', final=True)
+                    eof = True
+                    continue
+                buf += text_decoder.decode(chunk)
+
+            self.process.wait()
+            if self._stderr_thread:
+                self._stderr_thread.join(timeout=5)
+            if self.timed_out:
+                raise subprocess.TimeoutExpired(self.cmd, self.timeout)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the gallery-dl process (if still running) and release its pipes."""
+        self.closed = True
+        if self._timer:
+            self._timer.cancel()
+        if self._admitted:
+            self._admitted = False
+            process_admission.release()
+        if self.process is None:
+            return
+        self._kill()
+        try:
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+        self.returncode = self.process.returncode
+        for pipe in (self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+def read_gallery_dl_json(cmd, reducer=list, timeout=TIMEOUT_THRESHOLD, rate_key=None, label=None):
+    """Stream a gallery-dl --dump-json command through `reducer`.
+    Returns (reducer result, finished stream) so callers can inspect
+    stream.returncode and stream.stderr.
+    """
+    stream = GalleryDLJsonStream(cmd, timeout=timeout, rate_key=rate_key, label=label)
+    try:
+        result = reducer(stream)
+    finally:
+        stream.close()
+    return result, stream
+
+def profile_probe_args():
+    """gallery-dl arguments that limit a profile crawl to its first
+    `profile_probe_items` items; an empty list means a full listing (0).
+    """
+    items = get_int_setting('profile_probe_items', 1)
+    return ['--range', f'1-{items}'] if items > 0 else []
+
+def run_gallery_dl_json(username, platform='tiktok', retry_count=0, reducer=list, probe=False):
+    """Extract metadata from TikTok profile using gallery-dl with rate limiting bypass.
+    Records are streamed through `reducer` (default: collect into a list).
+    With probe=True only the first few items are fetched (see profile_probe_args).
+    """
     global user_agent_index, timeout_count
     
     try:
         url = f"https://www.tiktok.com/@{username}" if platform=='tiktok' else f"https://www.instagram.com/{username}/"
         cmd = ['gallery-dl', '--dump-json', '--no-download']
+        if probe:
+            cmd.extend(profile_probe_args())
         
         # Add rate limiting bypass options if enabled
         if RATELIMIT_BYPASS:
@@ -264,13 +1493,6 @@ def run_gallery_dl_json(username, platform='tiktok', retry_count=0):
             user_agent = USER_AGENTS[user_agent_index % len(USER_AGENTS)]
             cmd.extend(['--option', f'extractor.user-agent={user_agent}'])
             
-            # Add random delays
-            import random
-            delay = random.uniform(REQUEST_DELAY, REQUEST_DELAY + 2)
-            if retry_count > 0:
-                delay *= (retry_count + 1)  # Increase delay on retries
-            cmd.extend(['--option', 'extractor.sleep-request=3-7'])  # Random sleep between 3 and 7 seconds
-            
             # Add headers to mimic browser behavior
             cmd.extend([
                 '--option', 'extractor.headers.Accept=text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -282,16 +1504,13 @@ def run_gallery_dl_json(username, platform='tiktok', retry_count=0):
             ])
             
             user_agent_index += 1
-            
-            # Add delay before request
-            if delay > 0:
-                time.sleep(delay)
         
         cmd.append(url)
         
         # Use longer timeout and track timing
         start_time = time.time()
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=TIMEOUT_THRESHOLD)
+        metadata, stream = read_gallery_dl_json(cmd, reducer, rate_key=platform, label=username)
+        rate_limited = report_rate_limit(platform, stream.stderr, stream.returncode)
         end_time = time.time()
         duration = end_time - start_time
         
@@ -299,40 +1518,13 @@ def run_gallery_dl_json(username, platform='tiktok', retry_count=0):
         if duration > TIMEOUT_THRESHOLD * 0.8:  # 80% of timeout threshold
             print(f"Slow request detected for {username}: {duration:.2f}s")
         
-        if result.returncode != 0:
-            error_msg = result.stderr.lower()
-            # Check for rate limiting indicators
-            if any(indicator in error_msg for indicator in ['rate limit', '429', 'too many requests', 'blocked']):
+        if stream.returncode != 0:
+            # The limiter has already slowed down; the retry waits on it instead of sleeping
+            if rate_limited or 'blocked' in stream.stderr.lower():
                 if retry_count < MAX_RETRIES and RATELIMIT_BYPASS:
                     print(f"Rate limit detected for {username}, retrying with different settings...")
-                    time.sleep(RETRY_DELAY * (retry_count + 1))  # Exponential backoff
-                    return run_gallery_dl_json(username, retry_count + 1)
-            return None, f"gallery-dl error: {result.stderr}"
-            
-        # Parse JSON output - handle both line-by-line and array formats
-        metadata = []
-        out = result.stdout.strip()
-        if not out:
-            return [], None
-        
-        # Try parsing as a single JSON value (array or object)
-        try:
-            data = json.loads(out)
-            if isinstance(data, list):
-                metadata.extend(data)
-            else:
-                metadata.append(data)
-        except json.JSONDecodeError:
-            # Fallback: parse line-by-line JSONL
-            for line in out.split('\n'):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                    metadata.append(data)
-                except json.JSONDecodeError:
-                    continue
+                    return run_gallery_dl_json(username, platform, retry_count + 1, reducer, probe)
+            return None, f"gallery-dl error: {stream.stderr}"
         
         # Reset timeout count on success
         timeout_count = 0
@@ -341,61 +1533,411 @@ def run_gallery_dl_json(username, platform='tiktok', retry_count=0):
     except subprocess.TimeoutExpired:
         timeout_count += 1
         error_msg = f"Request timed out after {TIMEOUT_THRESHOLD}s"
+        # Timeouts are usually throttling in disguise
+        get_rate_limiter(platform).penalize()
         
         # Try retry with different settings if rate limiting bypass is enabled
         if retry_count < MAX_RETRIES and RATELIMIT_BYPASS:
             print(f"Timeout for {username}, attempt {retry_count + 1}/{MAX_RETRIES}, retrying...")
-            time.sleep(RETRY_DELAY * (retry_count + 1))
-            return run_gallery_dl_json(username, retry_count + 1)
+            return run_gallery_dl_json(username, platform, retry_count + 1, reducer, probe)
         
         return None, error_msg
     except Exception as e:
         return None, f"Error: {str(e)}"
 
 
-def run_gallery_dl_json_instagram(username, retry_count=0):
+def run_gallery_dl_json_instagram(username, retry_count=0, reducer=list, probe=False):
     """Extract metadata for Instagram profile using gallery-dl with optional cookies."""
     try:
         url = f"https://www.instagram.com/{username}/"
         cmd = ['gallery-dl', '--dump-json', '--no-download']
+        if probe:
+            cmd.extend(profile_probe_args())
         # Use active cookies if set
         active = get_setting('instagram_active_cookies','') or ''
         cookie_path = os.path.join('data','cookies','instagram', active) if active else ''
         if active and os.path.exists(cookie_path):
             cmd.extend(['--cookies', cookie_path])
-        result = subprocess.run(cmd + [url], capture_output=True, text=True, timeout=TIMEOUT_THRESHOLD)
-        if result.returncode != 0:
-            return None, f"gallery-dl error: {result.stderr}"
-        out = result.stdout.strip()
-        if not out:
-            return [], None
-        metadata = []
-        try:
-            data = json.loads(out)
-            if isinstance(data, list):
-                metadata.extend(data)
-            else:
-                metadata.append(data)
-        except json.JSONDecodeError:
-            for line in out.split('\n'):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                    metadata.append(data)
-                except json.JSONDecodeError:
-                    continue
+        metadata, stream = read_gallery_dl_json(cmd + [url], reducer, rate_key='instagram', label=username)
+        report_rate_limit('instagram', stream.stderr, stream.returncode)
+        if stream.returncode != 0:
+            return None, f"gallery-dl error: {stream.stderr}"
         return metadata, None
     except Exception as e:
         return None, f"Error: {str(e)}"
 
-def run_gallery_dl_download(username, progress_callback=None, platform='tiktok'):
+# Download history
+# Every posts/stories/highlights run is recorded in download_runs. A user's
+# timeout is derived from their slowest recent run, so big profiles get the time
+# they need and stuck small ones are cut off early. The no-output limit can only
+# grow past download_idle_timeout: gallery-dl prints a path once a whole file is
+# done, so quick runs that only skipped archived posts say nothing about how long
+# the next new video may take.
+DOWNLOAD_RUNS_KEEP = 20      # runs kept per user and phase
+DOWNLOAD_RUNS_SAMPLE = 10    # recent runs the limits are derived from
+
+def download_run_outcome(run):
+    if run['paused']:
+        return 'paused'
+    if run['timed_out']:
+        return 'timeout'
+    if run['stalled']:
+        return 'stalled'
+    return 'completed' if run['returncode'] == 0 else 'failed'
+
+def record_download_run(username, platform, phase, run):
+    """Store the timing of one download run and trim the user's history."""
+    with db_connection() as conn:
+        conn.execute('''
+            INSERT INTO download_runs (username, platform, phase, duration, files, bytes, max_gap, outcome)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (username, platform, phase, run['duration'], run['files'], run['bytes'], run['max_gap'],
+              download_run_outcome(run)))
+        conn.execute('''
+            DELETE FROM download_runs WHERE username = ? AND platform = ? AND phase = ? AND id NOT IN (
+                SELECT id FROM download_runs WHERE username = ? AND platform = ? AND phase = ?
+                ORDER BY id DESC LIMIT ?
+            )
+        ''', (username, platform, phase, username, platform, phase, DOWNLOAD_RUNS_KEEP))
+        conn.commit()
+
+def download_timeouts(username, platform, phase='posts'):
+    """(timeout, idle_timeout) in seconds for one user's download phase.
+    Users without completed runs get the download_timeout / download_idle_timeout
+    settings; the idle limit never drops below download_idle_timeout.
+    """
+    timeout = get_int_setting('download_timeout', DOWNLOAD_TIMEOUT)
+    idle_floor = idle_timeout = get_int_setting('download_idle_timeout', DOWNLOAD_IDLE_TIMEOUT)
+    factor = get_float_setting('download_timeout_factor', 3.0)
+
+    with db_connection() as conn:
+        runs = conn.execute('''
+            SELECT duration, files, max_gap, outcome FROM download_runs
+            WHERE username = ? AND platform = ? AND phase = ?
+            ORDER BY id DESC LIMIT ?
+        ''', (username, platform, phase, DOWNLOAD_RUNS_SAMPLE)).fetchall()
+
+    completed = [r for r in runs if r['outcome'] == 'completed']
+    if completed:
+        timeout = max(r['duration'] for r in completed) * factor
+        idle_timeout = max(r['max_gap'] for r in completed) * factor
+    # A run cut off while still downloading needs more time than it got
+    if runs and runs[0]['outcome'] == 'timeout' and runs[0]['files'] > 0:
+        timeout = max(timeout, runs[0]['duration'] * 2)
+
+    timeout = min(max(timeout, get_int_setting('download_timeout_min', 120)),
+                  get_int_setting('download_timeout_max', 14400))
+    idle_timeout = min(max(idle_timeout, idle_floor), timeout)
+    return int(timeout), int(idle_timeout)
+
+# Download watchdog
+# One thread watches every running download process. A download is making
+# progress while gallery-dl prints lines or the .part files anywhere under its
+# destination grow (gallery-dl writes into per-site subfolders of --dest). Once
+# a file has been seen, the idle limit without either marks it 'stalled' and the
+# `stall_policy` setting decides what happens: 'restart' relaunches it (the
+# download archive skips what already finished), 'kill' stops it, 'wait' only
+# flags it until it recovers or hits its overall timeout. A run that has not
+# produced any file yet is left to its overall timeout.
+WATCHDOG_INTERVAL = 5  # seconds between checks
+
+def part_file_bytes(directory):
+    """Total size of the unfinished .part files directly inside `directory`."""
+    total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.part'):
+                    try:
+                        total += entry.stat().st_size
+                    except OSError:
+                        pass
+    except OSError:
+        pass
+    return total
+
+def find_part_files(root):
+    """(total size, set of folders) of the .part files anywhere under `root`."""
+    total = 0
+    folders = set()
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith('.part'):
+                        try:
+                            total += entry.stat().st_size
+                        except OSError:
+                            continue
+                        folders.add(directory)
+        except OSError:
+            pass
+    return total, folders
+
+class DownloadWatchdog:
+    """Registry of running download processes, keyed by their queue label."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watched = {}
+        self._thread = None
+
+    def watch(self, key, process, directory, idle_timeout):
+        now = time.time()
+        part_bytes, part_dirs = find_part_files(directory) if directory else (0, set())
+        with self._lock:
+            self._watched[key] = {
+                'process': process,
+                'directory': directory,
+                'part_dirs': part_dirs,  # folders .part files were last seen in (checked first)
+                'idle_timeout': idle_timeout,
+                'last_progress': now,
+                'part_bytes': part_bytes,
+                'seen_file': False,
+                'stalled': False,
+                'policy': None,
+                'stopped': False,
+            }
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True, name='download-watchdog')
+                self._thread.start()
+
+    def unwatch(self, key):
+        """Stop watching `key`. Returns its record, so callers can see whether it was stopped."""
+        with self._lock:
+            return self._watched.pop(key, None)
+
+    def progress(self, key, path=None):
+        """Record output from `key`'s process; `path` is a file it just wrote."""
+        record = self._watched.get(key)
+        if record is None:
+            return
+        record['last_progress'] = time.time()
+        if path:
+            record['seen_file'] = True
+            record['part_dirs'] = record['part_dirs'] | {os.path.dirname(path)}
+        if record['stalled'] and not record['stopped']:
+            self._recovered(key, record)
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            return {key: {'idle': int(now - r['last_progress']), 'stalled': r['stalled']}
+                    for key, r in self._watched.items()}
+
+    def _recovered(self, key, record):
+        record['stalled'] = False
+        print(f"Download {key} is progressing again")
+        update_global_queue(key, status='downloading', current_file='Progressing again')
+
+    def _loop(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            with self._lock:
+                watched = list(self._watched.items())
+            for key, record in watched:
+                try:
+                    self._check(key, record)
+                except Exception as e:
+                    print(f"Download watchdog error for {key}: {e}")
+                finally:
+                    release_thread_db_connection()
+
+    def _check(self, key, record):
+        process = record['process']
+        if process.poll() is not None:
+            return
+        if record['stopped']:
+            # Still alive a full interval after terminate()
+            process.kill()
+            return
+
+        part_bytes = sum(part_file_bytes(d) for d in record['part_dirs'])
+        if not part_bytes and record['directory']:
+            # Nothing in the known folders; the next file may be in a new subfolder
+            part_bytes, part_dirs = find_part_files(record['directory'])
+            record['part_dirs'] = record['part_dirs'] | part_dirs
+        if part_bytes:
+            record['seen_file'] = True
+        if part_bytes != record['part_bytes']:
+            record['part_bytes'] = part_bytes
+            record['last_progress'] = time.time()
+            if record['stalled']:
+                self._recovered(key, record)
+            return
+
+        idle = time.time() - record['last_progress']
+        if (record['stalled'] or not record['seen_file'] or not record['idle_timeout']
+                or idle < record['idle_timeout']):
+            return
+        policy = get_setting('stall_policy', 'restart') or 'restart'
+        record.update(stalled=True, policy=policy)
+        print(f"⚠️ Download {key} stalled: no progress for {int(idle)}s (policy: {policy})")
+        update_global_queue(key, status='stalled', current_file=f'No progress for {int(idle)}s')
+        if policy in ('restart', 'kill'):
+            record['stopped'] = True
+            process.terminate()
+
+download_watchdog = DownloadWatchdog()
+
+# Resumable downloads
+# A paused download stores a checkpoint: the phase it was in and how many items
+# gallery-dl had got through (the 1-based index its --range option counts). The
+# resumed run skips finished phases and continues that phase with --range N-.
+# Posts added to a profile while paused shift the index; the next full run's
+# archive check picks them up.
+DOWNLOAD_PHASES = ['posts', 'stories', 'highlights']
+
+def save_download_checkpoint(target, phase, position, data=None):
+    with db_connection() as conn:
+        conn.execute('''
+            INSERT INTO download_checkpoints (target, phase, position, data, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(target) DO UPDATE SET
+                phase=excluded.phase, position=excluded.position, data=excluded.data, updated_at=excluded.updated_at
+        ''', (target, phase, position, json.dumps(data) if data is not None else None))
+        conn.commit()
+
+def get_download_checkpoint(target):
+    with db_connection() as conn:
+        row = conn.execute('SELECT phase, position, data FROM download_checkpoints WHERE target = ?', (target,)).fetchone()
+    if not row:
+        return None
+    return {'phase': row['phase'], 'position': row['position'] or 0,
+            'data': json.loads(row['data']) if row['data'] else None}
+
+def clear_download_checkpoint(target):
+    with db_connection() as conn:
+        conn.execute('DELETE FROM download_checkpoints WHERE target = ?', (target,))
+        conn.commit()
+
+def range_args(start_position):
+    """gallery-dl arguments to continue after `start_position` items."""
+    return ['--range', f'{start_position + 1}-'] if start_position > 0 else []
+
+def run_pausable_process(cmd, control_key, rate_key=None, dest=None, on_line=None, timeout=None, idle_timeout=None, cwd=None):
+    """Run a download command that /api/downloads/pause/<control_key> can stop.
+    Each output line goes to `on_line`; lines naming a file under `dest`
+    (downloaded, or '# '-prefixed when skipped) advance `position`. The
+    process is killed after `timeout` seconds; download_watchdog handles it
+    once it has made no progress for `idle_timeout` seconds.
+    Returns a dict with returncode, output (lines), position, files, paths
+    (of the files downloaded), bytes, duration, max_gap, restarts, and the
+    paused / timed_out / stalled flags.
+    """
+    if timeout is None:
+        timeout = get_int_setting('download_timeout', DOWNLOAD_TIMEOUT)
+    if idle_timeout is None:
+        idle_timeout = get_int_setting('download_idle_timeout', DOWNLOAD_IDLE_TIMEOUT)
+    run = {'returncode': None, 'output': [], 'position': 0, 'files': 0, 'paths': [], 'bytes': 0, 'duration': 0.0,
+           'max_gap': 0.0, 'restarts': 0, 'paused': False, 'timed_out': False, 'stalled': False}
+    dest_prefix = os.path.normpath(dest) if dest else None
+    _download_controls.setdefault(control_key, {'pause': False})
+    restarts_left = get_int_setting('stall_restarts', 1)
+    started = time.time()
+
+    # The admission slot is held until the process has exited, restarts included
+    with external_process(rate_key, label=control_key):
+        while True:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                cwd=cwd
+            )
+            download_processes[control_key] = process
+            download_watchdog.watch(control_key, process, os.path.join(cwd or '', dest) if dest else None, idle_timeout)
+            last_line = time.time()
+
+            # Reader thread to avoid blocking readline indefinitely
+            def _reader(process=process):
+                nonlocal last_line
+                try:
+                    for line in iter(process.stdout.readline, ''):
+                        # Check for pause request
+                        if _download_controls.get(control_key, {}).get('pause'):
+                            try:
+                                process.terminate()
+                            except Exception:
+                                pass
+                            break
+                        now = time.time()
+                        run['max_gap'] = max(run['max_gap'], now - last_line)
+                        last_line = now
+                        s = line.strip()
+                        run['output'].append(s)
+                        path = None
+                        if dest_prefix and os.path.normpath(s.lstrip('# ')).startswith(dest_prefix):
+                            run['position'] += 1
+                            path = os.path.join(cwd or '', s.lstrip('# '))
+                            if not s.startswith('#'):
+                                run['files'] += 1
+                                run['paths'].append(path)
+                                try:
+                                    run['bytes'] += os.path.getsize(path)
+                                except OSError:
+                                    pass
+                        download_watchdog.progress(control_key, path)
+                        if on_line:
+                            on_line(s)
+                except Exception:
+                    pass
+            t = threading.Thread(target=_reader, daemon=True)
+            t.start()
+
+            try:
+                process.wait(timeout=max(timeout - (time.time() - started), 1))
+            except subprocess.TimeoutExpired:
+                run['timed_out'] = True
+                try:
+                    process.terminate()
+                    # Give it a moment to terminate, then kill if still alive
+                    time.sleep(2)
+                    if process.poll() is None:
+                        process.kill()
+                    process.wait(timeout=5)
+                except Exception:
+                    pass
+            finally:
+                download_processes.pop(control_key, None)
+                watch = download_watchdog.unwatch(control_key)
+            t.join(timeout=5)
+            run['returncode'] = process.returncode
+            run['max_gap'] = max(run['max_gap'], time.time() - last_line)
+
+            stopped = bool(watch and watch['stopped']) and not run['timed_out']
+            if (stopped and watch['policy'] == 'restart' and restarts_left > 0
+                    and not _download_controls.get(control_key, {}).get('pause')):
+                restarts_left -= 1
+                run['restarts'] += 1
+                # The rerun lists skipped items again, so the position is recounted
+                run['position'] = 0
+                run['output'].append('Download stalled, restarting...')
+                update_global_queue(control_key, status='downloading', current_file='Restarting stalled download...')
+                continue
+            run['stalled'] = stopped
+            break
+    run['duration'] = time.time() - started
+
+    # pause_download() may have terminated the process before the reader saw the flag
+    run['paused'] = (bool(_download_controls.get(control_key, {}).get('pause'))
+                     and not run['timed_out'] and not run['stalled'])
+    return run
+
+def run_gallery_dl_download(username, progress_callback=None, platform='tiktok', start_position=0, downloaded=None):
     """Download content from TikTok profile using gallery-dl.
     Uses a per-user download archive to avoid re-downloading existing media (configurable).
-    Includes a failsafe timeout to avoid getting stuck.
+    Includes a failsafe timeout to avoid getting stuck. `start_position` skips
+    items a paused run already got through. The paths of the files written are
+    appended to the `downloaded` list, if one is given.
 
-    Returns: (success: bool, output: str, file_count: int, paused: bool)
+    Returns: (success: bool, output: str, file_count: int, paused: bool, position: int)
     """
     try:
         if platform == 'tiktok':
@@ -430,105 +1972,65 @@ def run_gallery_dl_download(username, progress_callback=None, platform='tiktok')
         if get_bool_setting('skip_existing', True):
             cmd.extend(['--download-archive', archive_path])
         
+        cmd.extend(range_args(start_position))
         cmd.append(url)
         
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-        download_processes[username] = process
-        _download_controls.setdefault(username, {'pause': False})
-        
-        output_lines = []
         file_count = 0
-        paused_flag = False
         
-        # Reader thread to avoid blocking readline indefinitely
-        # Reader thread to avoid blocking readline indefinitely
-        def _reader():
-            nonlocal file_count, paused_flag
-            try:
-                for line in iter(process.stdout.readline, ''):
-                    if not line:
-                        break
-                    # Check for pause request
-                    if _download_controls.get(username, {}).get('pause'):
-                        paused_flag = True
-                        try:
-                            process.terminate()
-                        except Exception:
-                            pass
-                        break
-                    s = line.strip()
-                    output_lines.append(s)
-                    low = s.lower()
-                    
-                    # Filter for cleaner UI feedback
-                    # Only show actual file downloads or specific status updates
-                    is_download_msg = 'download' in low and any(ext in low for ext in ['.mp4', '.jpg', '.jpeg', '.png', '.gif'])
-                    is_already = 'already downloaded' in low
-                    
-                    if is_download_msg:
-                        file_count += 1
-                        if progress_callback:
-                            # Clean up the message for UI
-                            clean_msg = s
-                            if '[downloader.http]' in s:
-                                clean_msg = s.split(']', 1)[-1].strip()
-                            if '[gallery-dl]' in s:
-                                clean_msg = s.split(']', 1)[-1].strip()
-                            progress_callback(file_count, clean_msg)
-                    elif progress_callback and not any(x in low for x in ['[warning]', '[error]', 'connection', 'redirect']):
-                        # Show other non-warning messages occasionally
-                        pass
-            except Exception:
-                pass
-        t = threading.Thread(target=_reader, daemon=True)
-        t.start()
-        
-        # Resolve timeout from settings (fallback to default)
-        try:
-            timeout_secs = int(get_setting('download_timeout', str(DOWNLOAD_TIMEOUT)) or DOWNLOAD_TIMEOUT)
-        except Exception:
-            timeout_secs = DOWNLOAD_TIMEOUT
-        
-        try:
-            process.wait(timeout=timeout_secs)
-        except subprocess.TimeoutExpired:
-            try:
-                process.terminate()
-            except Exception:
-                pass
-            try:
-                # Give it a moment to terminate, then kill if still alive
-                time.sleep(2)
-                if process.poll() is None:
-                    process.kill()
-            except Exception:
-                pass
+        def on_line(s):
+            nonlocal file_count
+            low = s.lower()
+            
+            # Filter for cleaner UI feedback
+            # Only show actual file downloads or specific status updates
+            is_download_msg = 'download' in low and any(ext in low for ext in ['.mp4', '.jpg', '.jpeg', '.png', '.gif'])
+            
+            if is_download_msg:
+                file_count += 1
+                if progress_callback:
+                    # Clean up the message for UI
+                    clean_msg = s
+                    if '[downloader.http]' in s:
+                        clean_msg = s.split(']', 1)[-1].strip()
+                    if '[gallery-dl]' in s:
+                        clean_msg = s.split(']', 1)[-1].strip()
+                    progress_callback(file_count, clean_msg)
+        
+        # Limits come from this user's run history (settings when there is none)
+        timeout_secs, idle_secs = download_timeouts(username, platform, 'posts')
+        
+        run = run_pausable_process(cmd, username, rate_key=platform, dest=output_dir, on_line=on_line,
+                                   timeout=timeout_secs, idle_timeout=idle_secs)
+        output_lines = run['output']
+        position = start_position + run['position']
+        if downloaded is not None:
+            downloaded.extend(run['paths'])
+        # Ranged (resumed) runs only cover part of the profile, so they are not timed
+        if not start_position:
+            record_download_run(username, platform, 'posts', run)
+        
+        if run['timed_out']:
             output_lines.append(f"Download for @{username} timed out after {timeout_secs}s and was terminated.")
-            del download_processes[username]
-            return False, '\n'.join(output_lines), file_count, False
+            return False, '\n'.join(output_lines), file_count, False, position
+        if run['stalled']:
+            output_lines.append(f"Download for @{username} produced no output for {idle_secs}s and was terminated.")
+            return False, '\n'.join(output_lines), file_count, False, position
         
-        # Clear from registry
-        download_processes.pop(username, None)
+        report_rate_limit(platform, output_lines, run['returncode'])
         
-        if paused_flag:
-            output_lines.append("Download paused by user")
-            return False, '\n'.join(output_lines), file_count, True
+        if run['paused']:
+            output_lines.append(f"Download paused by user after {position} items")
+            return False, '\n'.join(output_lines), file_count, True, position
         
-        return process.returncode == 0, '\n'.join(output_lines), file_count, False
+        return run['returncode'] == 0, '\n'.join(output_lines), file_count, False, position
     except Exception as e:
-        return False, f"Error: {str(e)}", 0
+        return False, f"Error: {str(e)}", 0, False, start_position
 
 
-def perform_download_instagram_aux(username, kind='stories'):
+def perform_download_instagram_aux(username, kind='stories', start_position=0):
     """Download Instagram stories or highlights using gallery-dl with cookies if available.
-    Returns (success: bool, output: str, file_count: int)
+    Pausable like the posts download; `start_position` skips items a paused run got through.
+    Returns (success: bool, output: str, file_count: int, paused: bool, position: int)
     """
     assert kind in ('stories','highlights')
     output_dir = os.path.join(DOWNLOADS_PATH, 'instagram', username, kind)
@@ -565,86 +2067,99 @@ def perform_download_instagram_aux(username, kind='stories'):
     if get_bool_setting('skip_existing', True):
         cmd.extend(['--download-archive', archive_path])
     
+    cmd.extend(range_args(start_position))
     cmd.append(target)
     
     print(f"Running command: {' '.join(cmd)}")
     
+    # Limits come from this user's run history (settings when there is none)
+    timeout_secs, idle_secs = download_timeouts(username, 'instagram', kind)
     try:
-        # Get timeout from settings
-        timeout_secs = int(get_setting('download_timeout', str(DOWNLOAD_TIMEOUT)) or DOWNLOAD_TIMEOUT)
-        
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            timeout=timeout_secs
-        )
+        run = run_pausable_process(cmd, username, rate_key='instagram', dest=output_dir,
+                                   timeout=timeout_secs, idle_timeout=idle_secs)
+        position = start_position + run['position']
+        if not start_position:
+            record_download_run(username, 'instagram', kind, run)
+        if run['timed_out'] or run['stalled']:
+            if run['timed_out']:
+                error_msg = f"Instagram {kind} download for {username} timed out after {timeout_secs}s"
+            else:
+                error_msg = f"Instagram {kind} download for {username} produced no output for {idle_secs}s"
+            print(error_msg)
+            return False, error_msg, 0, False, position
         
-        output = result.stdout + result.stderr
+        output = '\n'.join(run['output'])
+        # A --verbose run prints every path and URL; only its error/warning lines count
+        report_rate_limit('instagram', log_problem_lines(run['output']), run['returncode'])
         print(f"Instagram {kind} download output for {username}:")
         print(output)
         
         # Count downloaded files
         file_count = 0
-        for line in output.split('\n'):
+        for line in run['output']:
             line_lower = line.lower()
             if 'download' in line_lower and any(ext in line_lower for ext in ['.mp4', '.jpg', '.jpeg', '.png', '.gif']):
                 file_count += 1
         
-        success = result.returncode == 0
+        if run['paused']:
+            print(f"Instagram {kind} download paused for {username} after {position} items")
+            return False, output, file_count, True, position
+        
+        success = run['returncode'] == 0
         if not success:
-            print(f"Instagram {kind} download failed for {username}: return code {result.returncode}")
+            print(f"Instagram {kind} download failed for {username}: return code {run['returncode']}")
         else:
             print(f"Instagram {kind} download completed for {username}: {file_count} files")
             
-        return success, output, file_count
+        return success, output, file_count, False, position
         
-    except subprocess.TimeoutExpired:
-        error_msg = f"Instagram {kind} download for {username} timed out after {timeout_secs}s"
-        print(error_msg)
-        return False, error_msg, 0
     except Exception as e:
         error_msg = f"Error downloading Instagram {kind} for {username}: {str(e)}"
         print(error_msg)
-        return False, error_msg, 0
+        return False, error_msg, 0, False, start_position
+
+# Per-user aggregates for dashboard listings, computed in the same query as the users
+USER_SUMMARY_QUERY = '''
+    SELECT u.*,
+           (SELECT COUNT(*) FROM user_tags ut WHERE ut.user_id = u.id) as tag_count,
+           (SELECT COUNT(*) FROM media m WHERE m.user_id = u.id) as downloaded_files,
+           (SELECT json_group_array(json_object('name', t.name, 'color', t.color))
+              FROM user_tags ut JOIN tags t ON t.id = ut.tag_id
+             WHERE ut.user_id = u.id) as tags_json
+    FROM users u
+'''
+
+def user_search_clause(query):
+    """SQL condition on users alias `u` (plus params) matching username or display name containing `query`.
+    Uses the trigram FTS index when possible; it needs at least 3 characters.
+    """
+    if users_fts_enabled and len(query) >= 3:
+        phrase = '"' + query.replace('"', '""') + '"'
+        return 'u.id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)', [phrase]
+    return '(u.username LIKE ? OR u.display_name LIKE ?)', [f'%{query}%', f'%{query}%']
+
+def user_summary_to_dict(row):
+    """Turn a USER_SUMMARY_QUERY row into the dict the templates expect."""
+    user_dict = dict(row)
+    user_dict['tags'] = json.loads(user_dict.pop('tags_json') or '[]')
+    user_dict['avatar_available'] = bool(row['avatar_path'])
+    return user_dict
 
 def list_user_status(platform_filter=None):
     """Get status of all tracked users with download counts."""
     conn = get_db_connection()
     if platform_filter in ('tiktok','instagram'):
-        users = conn.execute('''
-            SELECT u.*, COUNT(DISTINCT ut.tag_id) as tag_count
-            FROM users u
-            LEFT JOIN user_tags ut ON u.id = ut.user_id
+        users = conn.execute(USER_SUMMARY_QUERY + '''
             WHERE u.platform = ?
-            GROUP BY u.id
             ORDER BY u.created_at DESC
         ''', (platform_filter,)).fetchall()
     else:
-        users = conn.execute('''
-            SELECT u.*, COUNT(DISTINCT ut.tag_id) as tag_count
-            FROM users u
-            LEFT JOIN user_tags ut ON u.id = ut.user_id
-            GROUP BY u.id
+        users = conn.execute(USER_SUMMARY_QUERY + '''
             ORDER BY u.created_at DESC
         ''').fetchall()
     conn.close()
     
-    user_list = []
-    for user in users:
-        user_dict = dict(user)
-        
-        # Count downloaded files
-        user_dir = os.path.join(DOWNLOADS_PATH, user['username'])
-        file_count = 0
-        if os.path.exists(user_dir):
-            for root, dirs, files in os.walk(user_dir):
-                file_count += len([f for f in files if f.lower().endswith(('.mp4', '.jpg', '.jpeg', '.png', '.gif'))])
-        
-        user_dict['downloaded_files'] = file_count
-        user_list.append(user_dict)
-    
-    return user_list
+    return [user_summary_to_dict(user) for user in users]
 
 def create_user_zip(username, platform='tiktok'):
     """Create a ZIP file of all downloaded content for a user."""
@@ -673,7 +2188,8 @@ def test_tiktok_access():
         
         # Test basic TikTok access
         test_cmd = ['gallery-dl', '--dump-json', '--no-download', 'https://www.tiktok.com/']
-        result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=30)
+        with external_process('tiktok'):
+            result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=30)
         
         return True, "TikTok access working"
     except Exception as e:
@@ -695,7 +2211,8 @@ def test_instagram_highlights_access(username):
         if active and os.path.exists(cookie_path):
             test_cmd.extend(['--cookies', cookie_path])
         
-        result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=30)
+        with external_process('instagram'):
+            result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=30)
         
         output = result.stdout + result.stderr
         success = result.returncode == 0
@@ -704,76 +2221,304 @@ def test_instagram_highlights_access(username):
     except Exception as e:
         return False, f"Error testing Instagram highlights access: {str(e)}"
 
+# Download event stream
+DOWNLOAD_STREAM_HEARTBEAT = 15   # seconds between keepalive comments
+DOWNLOAD_STREAM_BACKLOG = 500    # queued events per client before it is resynced
+DOWNLOAD_STREAM_LOG_LINES = 50   # log lines carried by a delta (the UI shows the last 50)
+
+_download_subscribers = set()
+_download_subscribers_lock = threading.Lock()
+
+def publish_download_event(event, data=None):
+    """Push an event to every connected /api/downloads/stream client.
+    A client whose backlog is full is sent a fresh snapshot instead.
+    """
+    with _download_subscribers_lock:
+        subscribers = list(_download_subscribers)
+    for q in subscribers:
+        try:
+            q.put_nowait((event, data))
+        except queue.Full:
+            # Drop the backlog; if another publisher refills it first, drop it again
+            while True:
+                try:
+                    while True:
+                        q.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait(('snapshot', None))
+                    break
+                except queue.Full:
+                    continue
+
+def download_entry_summary(entry, fields=None):
+    """Queue entry (or just `fields` of it) for the event stream, with logs trimmed."""
+    keys = entry.keys() if fields is None else set(fields) | {'id', 'username', 'status', 'progress', 'end_time'}
+    summary = {k: entry.get(k) for k in keys if k != 'logs'}
+    if 'logs' in keys and entry.get('logs'):
+        summary['logs'] = list(entry['logs'])[-DOWNLOAD_STREAM_LOG_LINES:]
+    return summary
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def download_log_path(download_id):
+    return os.path.join(DOWNLOAD_LOGS_PATH, f"{secure_filename(download_id) or 'download'}.log")
+
+def append_download_log(entry, lines):
+    """Add lines to an entry's in-memory ring buffer and its on-disk log file."""
+    lines = [line for line in lines if line]
+    if not lines:
+        return
+    entry['logs'].extend(lines)
+    try:
+        os.makedirs(DOWNLOAD_LOGS_PATH, exist_ok=True)
+        with open(download_log_path(entry['id']), 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+    except OSError as e:
+        print(f"Could not write download log for {entry['id']}: {e}")
+
 def add_to_global_queue(username, download_id=None):
     """Add a download to the global queue."""
     if download_id is None:
         download_id = f"{username}_{int(time.time())}"
     
-    download_entry = {
-        'id': download_id,
-        'username': username,
-        'status': 'queued',
-        'start_time': time.time(),
-        'end_time': None,
-        'files_downloaded': 0,
-        'total_files': 0,
-        'current_file': '',
-        'progress': 0,
-        'logs': []
-    }
-    
-    global_download_queue.append(download_entry)
-    active_downloads[username] = download_id
+    with _download_queue_lock:
+        # Ids are per-second; keep a second task started in the same second distinct
+        base_id, n = download_id, 1
+        while download_id in global_download_queue:
+            n += 1
+            download_id = f"{base_id}_{n}"
+
+        download_entry = {
+            'id': download_id,
+            'username': username,
+            'status': 'queued',
+            'start_time': time.time(),
+            'end_time': None,
+            'files_downloaded': 0,
+            'total_files': 0,
+            'current_file': '',
+            'progress': 0,
+            'logs': deque(maxlen=DOWNLOAD_LOG_LINES)
+        }
+        
+        global_download_queue[download_id] = download_entry
+        active_downloads[username] = download_id
+        if username != SYNC_QUEUE_USERNAME:
+            publish_download_event('update', download_entry_summary(download_entry))
     return download_id
 
 def update_global_queue(username, **kwargs):
-    """Update a download in the global queue."""
-    if username not in active_downloads:
+    """Update a download in the global queue.
+    `logs` lines are appended to the entry's log rather than replacing it.
+    """
+    finished = False
+    with _download_queue_lock:
+        download_id = active_downloads.get(username)
+        entry = global_download_queue.get(download_id)
+        if entry is None:
+            return
+
+        logs = kwargs.pop('logs', None)
+        entry.update(kwargs)
+        if logs:
+            append_download_log(entry, logs)
+            kwargs['logs'] = logs
+        
+        # Calculate progress percentage
+        if entry.get('total_files', 0) > 0:
+            entry['progress'] = int((entry.get('files_downloaded', 0) / entry['total_files']) * 100)
+        elif entry.get('files_downloaded', 0) > 0:
+            entry['progress'] = min(entry['files_downloaded'] * 5, 95)  # Estimate
+        
+        # Mark as complete if status changed
+        if kwargs.get('status') in ['completed', 'failed']:
+            entry['end_time'] = time.time()
+            del active_downloads[username]
+            finished = True
+
+        if username != SYNC_QUEUE_USERNAME:
+            publish_download_event('update', download_entry_summary(entry, kwargs))
+
+    if finished:
+        apply_download_retention()
+
+_download_logs_pruned_at = 0
+
+def apply_download_retention():
+    """Retention policy for the Download Manager.
+    Keeps the `download_history_keep` most recently finished entries (running and
+    paused ones are never dropped) and deletes on-disk logs older than
+    `download_log_retention_days` (checked at most hourly).
+    """
+    global _download_logs_pruned_at
+    keep = max(get_int_setting('download_history_keep', 10), 0)
+    with _download_queue_lock:
+        finished = [d for d in global_download_queue.values() if d['status'] in ['completed', 'failed']]
+        finished.sort(key=lambda d: d.get('end_time') or 0, reverse=True)
+        expired = [d['id'] for d in finished[keep:]]
+        for download_id in expired:
+            del global_download_queue[download_id]
+        if expired:
+            publish_download_event('remove', {'ids': expired})
+
+    if time.time() - _download_logs_pruned_at < 3600:
         return
-    
-    download_id = active_downloads[username]
-    for entry in global_download_queue:
-        if entry['id'] == download_id:
-            entry.update(kwargs)
-            
-            # Calculate progress percentage
-            if entry.get('total_files', 0) > 0:
-                entry['progress'] = int((entry.get('files_downloaded', 0) / entry['total_files']) * 100)
-            elif entry.get('files_downloaded', 0) > 0:
-                entry['progress'] = min(entry['files_downloaded'] * 5, 95)  # Estimate
-            
-            # Mark as complete if status changed
-            if kwargs.get('status') in ['completed', 'failed']:
-                entry['end_time'] = time.time()
-                if username in active_downloads:
-                    del active_downloads[username]
-            break
+    _download_logs_pruned_at = time.time()
+    cutoff = time.time() - get_int_setting('download_log_retention_days', 7) * 86400
+    try:
+        with os.scandir(DOWNLOAD_LOGS_PATH) as entries:
+            for entry in entries:
+                if entry.name.endswith('.log') and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+    except OSError:
+        pass
 
 def get_global_download_status():
     """Get status of all downloads (excluding sync operations)."""
-    # Clean up old completed downloads (keep last 20)
-    if len(global_download_queue) > 20:
-        # Remove old completed downloads
-        completed = [d for d in global_download_queue if d['status'] in ['completed', 'failed']]
-        if len(completed) > 10:
-            # Keep only the 10 most recent completed downloads
-            completed.sort(key=lambda x: x.get('end_time', 0), reverse=True)
-            to_remove = completed[10:]
-            for item in to_remove:
-                global_download_queue.remove(item)
-    
-    # Filter out sync operations from the display
-    user_downloads = [d for d in global_download_queue if d['username'] != SYNC_QUEUE_USERNAME]
+    with _download_queue_lock:
+        # Filter out sync operations from the display
+        user_downloads = [dict(d, logs=list(d['logs'])) for d in global_download_queue.values()
+                          if d['username'] != SYNC_QUEUE_USERNAME]
     
     return {
+        'scheduler': download_scheduler.status(),
+        'processes': process_admission.status(),
+        'watchdog': download_watchdog.status(),
         'total_downloads': len(user_downloads),
-        'active_downloads': len([d for d in user_downloads if d['status'] in ['downloading', 'running']]),
+        'active_downloads': len([d for d in user_downloads if d['status'] in ['downloading', 'running', 'stalled']]),
         'completed_downloads': len([d for d in user_downloads if d['status'] == 'completed']),
         'failed_downloads': len([d for d in user_downloads if d['status'] == 'failed']),
         'downloads': sorted(user_downloads, key=lambda x: x['start_time'], reverse=True)
     }
 
 
+# Avatar cache
+# The resolved avatar file lives on the user row (users.avatar_path, a name
+# inside AVATARS_PATH) and is written whenever an avatar is saved or removed.
+# Lookups go through a small LRU keyed by (platform, username), so serving an
+# avatar is one dict hit plus one sendfile instead of probing the folder.
+AVATAR_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+AVATAR_CACHE_SIZE = 2048  # (platform, username) lookups kept in memory
+
+_avatar_cache = OrderedDict()
+_avatar_cache_lock = threading.Lock()
+
+def backfill_avatar_paths(cursor):
+    """Fill users.avatar_path for users without one from a single listing of AVATARS_PATH.
+    Picks up avatars saved before the column existed (and the legacy unprefixed names).
+    """
+    try:
+        avatar_files = set(os.listdir(AVATARS_PATH))
+    except OSError:
+        return
+    rows = cursor.execute('SELECT id, username, platform FROM users WHERE avatar_path IS NULL').fetchall()
+    updates = []
+    for user_id, username, platform in rows:
+        candidates = [f"{platform}_{username}{ext}" for ext in AVATAR_EXTENSIONS]
+        candidates += [f"{username}{ext}" for ext in AVATAR_EXTENSIONS]
+        name = next((name for name in candidates if name in avatar_files), None)
+        if name:
+            updates.append((name, user_id))
+    if updates:
+        cursor.executemany('UPDATE users SET avatar_path = ? WHERE id = ?', updates)
+
+def forget_avatar(username):
+    """Drop cached avatar lookups for a username (any platform)."""
+    with _avatar_cache_lock:
+        for key in [key for key in _avatar_cache if key[1] == username]:
+            del _avatar_cache[key]
+
+def clear_avatar_cache():
+    with _avatar_cache_lock:
+        _avatar_cache.clear()
+
+def set_user_avatar(username, platform, path):
+    """Record `path` (or None once the avatar is removed) as the user's avatar file."""
+    with db_connection() as conn:
+        conn.execute('UPDATE users SET avatar_path = ? WHERE username = ? AND platform = ?',
+                     (os.path.basename(path) if path else None, username, platform))
+        conn.commit()
+    forget_avatar(username)
+
+def resolve_avatar(username, platform=None):
+    """Path of the user's cached avatar file, or None.
+    Without a platform the first user with that name that has an avatar wins.
+    """
+    key = (platform or '', username)
+    with _avatar_cache_lock:
+        if key in _avatar_cache:
+            _avatar_cache.move_to_end(key)
+            return _avatar_cache[key]
+
+    with db_connection() as conn:
+        if platform:
+            row = conn.execute('SELECT avatar_path FROM users WHERE username = ? AND platform = ?',
+                               (username, platform)).fetchone()
+        else:
+            row = conn.execute('''
+                SELECT avatar_path FROM users
+                WHERE username = ? AND avatar_path IS NOT NULL
+                ORDER BY id LIMIT 1
+            ''', (username,)).fetchone()
+    path = os.path.join(AVATARS_PATH, row['avatar_path']) if row and row['avatar_path'] else None
+
+    with _avatar_cache_lock:
+        _avatar_cache[key] = path
+        _avatar_cache.move_to_end(key)
+        while len(_avatar_cache) > AVATAR_CACHE_SIZE:
+            _avatar_cache.popitem(last=False)
+    return path
+
+def remove_avatar_files(username, platform):
+    """Delete a user's cached avatar files (platform-prefixed and legacy names)."""
+    for ext in AVATAR_EXTENSIONS:
+        for name in (f"{platform}_{username}{ext}", f"{username}{ext}"):
+            path = os.path.join(AVATARS_PATH, name)
+            if os.path.exists(path):
+                os.remove(path)
+    set_user_avatar(username, platform, None)
+
+def save_avatar_from_url(username, platform, avatar_url):
+    """Download an avatar image URL into the avatar cache. Returns the local path or None."""
+    try:
+        os.makedirs(AVATARS_PATH, exist_ok=True)
+        
+        # Determine file extension from URL or default to jpg
+        parsed_url = urllib.parse.urlparse(avatar_url)
+        ext = '.jpg'
+        if parsed_url.path:
+            path_ext = os.path.splitext(parsed_url.path)[1].lower()
+            if path_ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
+                ext = path_ext
+        
+        local_path = os.path.join(AVATARS_PATH, f"{platform}_{username}{ext}")
+        
+        acquire_rate_limit(avatar_url)
+        
+        # Add user agent header to avoid blocks
+        if RATELIMIT_BYPASS:
+            user_agent = USER_AGENTS[user_agent_index % len(USER_AGENTS)]
+            req = urllib.request.Request(avatar_url, headers={'User-Agent': user_agent})
+            with urllib.request.urlopen(req, timeout=60) as response:
+                with open(local_path, 'wb') as f:
+                    f.write(response.read())
+        else:
+            urllib.request.urlretrieve(avatar_url, local_path)
+        
+        set_user_avatar(username, platform, local_path)
+        print(f"Avatar cached for {username}: {local_path}")
+        return local_path
+    except Exception as e:
+        print(f"Error saving avatar for {username} from {avatar_url[:100]}: {e}")
+        return None
+
+def find_cached_avatar(username, platform):
+    """Return the path of an already cached avatar for a user, if any."""
+    return resolve_avatar(username, platform)
+
 def download_avatar_with_gallery_dl(username, platform='tiktok'):
     """Download user's avatar using gallery-dl directly or direct URL for Coomer."""
     try:
@@ -802,6 +2547,7 @@ def download_avatar_with_gallery_dl(username, platform='tiktok'):
                     shutil.copyfileobj(response, out_file)
                 
                 if os.path.exists(filename) and os.path.getsize(filename) > 0:
+                     set_user_avatar(username, platform, filename)
                      return filename
             except Exception as e:
                  print(f"Direct Coomer avatar download failed: {e}")
@@ -817,8 +2563,8 @@ def download_avatar_with_gallery_dl(username, platform='tiktok'):
         else:
             url = f"https://www.tiktok.com/@{username}"
         
-        # Use gallery-dl to get avatar information
-        cmd = ['gallery-dl', '--dump-json', '--no-download']
+        # Use gallery-dl to get avatar information (the first few items carry the author block)
+        cmd = ['gallery-dl', '--dump-json', '--no-download'] + profile_probe_args()
         
         # Add Instagram cookies if available
         if platform == 'instagram':
@@ -836,155 +2582,109 @@ def download_avatar_with_gallery_dl(username, platform='tiktok'):
         
         cmd.append(url)
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=TIMEOUT_THRESHOLD)
-        
-        if result.returncode != 0:
-            print(f"Failed to get avatar info for {username} ({platform}): {result.stderr}")
-            if result.stderr:
-                print(f"Gallery-dl stderr: {result.stderr[:500]}")
-            return None
-        
-        if not result.stdout.strip():
-            print(f"No output from gallery-dl for {username}")
-            return None
-        
-        # Parse JSON to find avatar URL
+        stream = GalleryDLJsonStream(cmd, timeout=TIMEOUT_THRESHOLD, rate_key=platform, label=username)
         avatar_url = None
-        out = result.stdout.strip()
-        if out:
-            try:
-                # Try parsing as single JSON first
-                try:
-                    data = json.loads(out)
-                    if isinstance(data, list):
-                        metadata_list = data
-                    else:
-                        metadata_list = [data]
-                except json.JSONDecodeError:
-                    # Parse line by line
-                    metadata_list = []
-                    for line in out.split('\n'):
-                        line = line.strip()
-                        if line:
-                            try:
-                                metadata_list.append(json.loads(line))
-                            except json.JSONDecodeError:
-                                continue
+        records = 0
+        try:
+            # Find avatar URL in metadata, stopping gallery-dl as soon as we have it
+            for item in stream:
+                records += 1
+                avatar_url = None
+                metadata_dict = None
                 
-                # Find avatar URL in metadata
-                for item in metadata_list:
-                    avatar_url = None
-                    metadata_dict = None
-                    
-                    if isinstance(item, list) and len(item) >= 2:
-                        # Handle gallery-dl's array format [type, data, metadata]
-                        if platform == 'instagram' and len(item) >= 3:
-                            # For Instagram avatar extractor, the URL is directly in item[1]
-                            # and metadata is in item[2]
-                            if isinstance(item[1], str) and item[1].startswith('http'):
-                                avatar_url = item[1]  # Direct URL from Instagram avatar extractor
-                                print(f"Found direct avatar URL for {username} ({platform}): {avatar_url[:100]}...")
-                                break
-                            # Also check metadata in item[2]
-                            if isinstance(item[2], dict):
-                                metadata_dict = item[2]
-                        elif len(item) >= 3 and isinstance(item[2], dict):
+                if isinstance(item, list) and len(item) >= 2:
+                    # Handle gallery-dl's array format [type, data, metadata]
+                    if platform == 'instagram' and len(item) >= 3:
+                        # For Instagram avatar extractor, the URL is directly in item[1]
+                        # and metadata is in item[2]
+                        if isinstance(item[1], str) and item[1].startswith('http'):
+                            avatar_url = item[1]  # Direct URL from Instagram avatar extractor
+                            print(f"Found direct avatar URL for {username} ({platform}): {avatar_url[:100]}...")
+                            break
+                        # Also check metadata in item[2]
+                        if isinstance(item[2], dict):
                             metadata_dict = item[2]
-                        elif isinstance(item[1], dict):
-                            metadata_dict = item[1]
-                        else:
-                            continue
-                    elif isinstance(item, dict):
-                        metadata_dict = item
+                    elif len(item) >= 3 and isinstance(item[2], dict):
+                        metadata_dict = item[2]
+                    elif isinstance(item[1], dict):
+                        metadata_dict = item[1]
                     else:
                         continue
-                    
-                    # If we got direct URL, skip metadata parsing
+                elif isinstance(item, dict):
+                    metadata_dict = item
+                else:
+                    continue
+
+                # If we got direct URL, skip metadata parsing
+                if avatar_url:
+                    break
+
+                # Look for avatar URLs in metadata fields based on platform
+                if metadata_dict:
+                    if platform == 'instagram':
+                        # Instagram-specific avatar field names including dedicated extractor fields
+                        avatar_url = (metadata_dict.get('display_url') or  # From Instagram avatar extractor
+                                    metadata_dict.get('uploader_profile_image') or 
+                                    metadata_dict.get('uploader_avatar') or
+                                    metadata_dict.get('avatar_url') or 
+                                    metadata_dict.get('profile_pic_url') or
+                                    metadata_dict.get('profile_pic_url_hd') or
+                                    metadata_dict.get('avatar'))
+
+                        # Try nested owner/user fields for Instagram
+                        if not avatar_url:
+                            for nested_key in ['user', 'owner', 'uploader_info']:
+                                if nested_key in metadata_dict and isinstance(metadata_dict[nested_key], dict):
+                                    nested_data = metadata_dict[nested_key]
+                                    avatar_url = (nested_data.get('profile_pic_url_hd') or 
+                                                nested_data.get('profile_pic_url') or
+                                                nested_data.get('avatar') or
+                                                nested_data.get('profile_picture'))
+                                    if avatar_url:
+                                        break
+                    else:
+                        # TikTok-specific avatar field names
+                        avatar_url = (metadata_dict.get('avatarLarger') or 
+                                    metadata_dict.get('avatarMedium') or 
+                                    metadata_dict.get('avatarThumb') or
+                                    metadata_dict.get('uploader_avatar') or 
+                                    metadata_dict.get('avatar_url') or 
+                                    metadata_dict.get('avatar') or
+                                    metadata_dict.get('uploader_profile_image'))
+
+                        # Try nested author fields for TikTok
+                        if not avatar_url and 'author' in metadata_dict:
+                            author = metadata_dict['author']
+                            if isinstance(author, dict):
+                                avatar_url = (author.get('avatarLarger') or 
+                                             author.get('avatarMedium') or 
+                                             author.get('avatarThumb') or
+                                             author.get('avatar'))
+
                     if avatar_url:
+                        print(f"Found avatar URL for {username} ({platform}): {avatar_url[:100]}...")
                         break
-                    
-                    # Look for avatar URLs in metadata fields based on platform
-                    if metadata_dict:
-                        if platform == 'instagram':
-                            # Instagram-specific avatar field names including dedicated extractor fields
-                            avatar_url = (metadata_dict.get('display_url') or  # From Instagram avatar extractor
-                                        metadata_dict.get('uploader_profile_image') or 
-                                        metadata_dict.get('uploader_avatar') or
-                                        metadata_dict.get('avatar_url') or 
-                                        metadata_dict.get('profile_pic_url') or
-                                        metadata_dict.get('profile_pic_url_hd') or
-                                        metadata_dict.get('avatar'))
-                            
-                            # Try nested owner/user fields for Instagram
-                            if not avatar_url:
-                                for nested_key in ['user', 'owner', 'uploader_info']:
-                                    if nested_key in metadata_dict and isinstance(metadata_dict[nested_key], dict):
-                                        nested_data = metadata_dict[nested_key]
-                                        avatar_url = (nested_data.get('profile_pic_url_hd') or 
-                                                    nested_data.get('profile_pic_url') or
-                                                    nested_data.get('avatar') or
-                                                    nested_data.get('profile_picture'))
-                                        if avatar_url:
-                                            break
-                        else:
-                            # TikTok-specific avatar field names
-                            avatar_url = (metadata_dict.get('avatarLarger') or 
-                                        metadata_dict.get('avatarMedium') or 
-                                        metadata_dict.get('avatarThumb') or
-                                        metadata_dict.get('uploader_avatar') or 
-                                        metadata_dict.get('avatar_url') or 
-                                        metadata_dict.get('avatar') or
-                                        metadata_dict.get('uploader_profile_image'))
-                            
-                            # Try nested author fields for TikTok
-                            if not avatar_url and 'author' in metadata_dict:
-                                author = metadata_dict['author']
-                                if isinstance(author, dict):
-                                    avatar_url = (author.get('avatarLarger') or 
-                                                 author.get('avatarMedium') or 
-                                                 author.get('avatarThumb') or
-                                                 author.get('avatar'))
-                        
-                        if avatar_url:
-                            print(f"Found avatar URL for {username} ({platform}): {avatar_url[:100]}...")
-                            break
-                
-                if not avatar_url:
-                    print(f"No avatar URL found for {username}")
-                    return None
-                
-                # Download the avatar
-                import urllib.request
-                import urllib.parse
-                
-                # Determine file extension from URL or default to jpg
-                parsed_url = urllib.parse.urlparse(avatar_url)
-                ext = '.jpg'
-                if parsed_url.path:
-                    path_ext = os.path.splitext(parsed_url.path)[1].lower()
-                    if path_ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
-                        ext = path_ext
-                
-                local_path = os.path.join(AVATARS_PATH, f"{platform}_{username}{ext}")
-                
-                # Add user agent header to avoid blocks
-                if RATELIMIT_BYPASS:
-                    user_agent = USER_AGENTS[user_agent_index % len(USER_AGENTS)]
-                    req = urllib.request.Request(avatar_url, headers={'User-Agent': user_agent})
-                    with urllib.request.urlopen(req, timeout=60) as response:
-                        with open(local_path, 'wb') as f:
-                            f.write(response.read())
-                else:
-                    urllib.request.urlretrieve(avatar_url, local_path)
-                
-                print(f"Avatar cached for {username}: {local_path}")
-                return local_path
-                
-            except Exception as e:
-                print(f"Error parsing avatar data for {username}: {e}")
-                return None
+        except subprocess.TimeoutExpired:
+            raise
+        except Exception as e:
+            print(f"Error parsing avatar data for {username}: {e}")
+            return None
+        finally:
+            stream.close()
+        report_rate_limit(platform, stream.stderr, 0 if avatar_url else stream.returncode)
+        
+        if not avatar_url:
+            if stream.returncode != 0:
+                print(f"Failed to get avatar info for {username} ({platform}): {stream.stderr}")
+                if stream.stderr:
+                    print(f"Gallery-dl stderr: {stream.stderr[:500]}")
+            elif not records:
+                print(f"No output from gallery-dl for {username}")
+            else:
+                print(f"No avatar URL found for {username}")
+            return None
         
-        return None
+        return save_avatar_from_url(username, platform, avatar_url)
         
     except subprocess.TimeoutExpired:
         print(f"Avatar download timeout for {username}")
@@ -1012,14 +2712,89 @@ def try_get(d, keys, default=None):
                 return d[k]
     return default
 
+def extract_profile_stats(username, metadata):
+    """Build the profile fields stored on a user from gallery-dl metadata records.
+    `metadata` can be any iterable (e.g. a GalleryDLJsonStream) and is consumed
+    in one pass. Returns None if it yielded no records.
+    """
+    profile_data = {}
+    video_count = 0
+    seen = False
+    for it in metadata:
+        seen = True
+        # Flatten any nested lists in metadata
+        for item in (it if isinstance(it, list) else [it]):
+            if not isinstance(item, dict):
+                continue
+            if 'url' in item:
+                video_count += 1
+            if profile_data:
+                continue
+            if 'uploader' in item or 'author' in item or 'tiktok' in (item.get('extractor'), item.get('category')):
+                display_name = item.get('uploader') or try_get(item, [('author','nickname'), 'author', 'creator'], username)
+                # Try multiple keys for avatar URL, nested too
+                avatar_url = (try_get(item, ['uploader_avatar', 'avatar_url', 'avatar', 'uploader_profile_image']) or
+                              try_get(item, [('author','avatarLarger'), ('author','avatarThumb'), ('author','avatarMedium')]) or '')
+                follower_count = (item.get('uploader_follower_count') or
+                                  try_get(item, [('authorStats','followerCount')]) or 0)
+                following_count = (item.get('uploader_following_count') or
+                                   try_get(item, [('authorStats','followingCount')]) or 0)
+                
+                profile_data = {
+                    'display_name': display_name if isinstance(display_name, str) and display_name else username,
+                    'profile_picture': avatar_url if isinstance(avatar_url, str) else '',
+                    'follower_count': int(follower_count or 0),
+                    'following_count': int(following_count or 0)
+                }
+    
+    if not seen:
+        return None
+    
+    # Fallback when nothing parsed
+    if not profile_data:
+        profile_data = {
+            'display_name': username,
+            'profile_picture': '',
+            'follower_count': 0,
+            'following_count': 0
+        }
+    profile_data['video_count'] = video_count
+    return profile_data
+
+def save_user_stats(username, platform, profile_data, local_avatar=None):
+    """Write profile stats (and the cached avatar filename) to the users table."""
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE users SET
+                display_name = ?,
+                profile_picture = ?,
+                follower_count = ?,
+                following_count = ?,
+                video_count = ?,
+                last_sync = CURRENT_TIMESTAMP
+            WHERE username = ? AND platform = ?
+        ''', (
+            profile_data.get('display_name', username),
+            (os.path.basename(local_avatar) if local_avatar else ''),
+            profile_data.get('follower_count', 0),
+            profile_data.get('following_count', 0),
+            profile_data.get('video_count', 0),
+            username,
+            platform
+        ))
+        conn.commit()
+
 def update_user_stats(username, platform='tiktok'):
     """Update user statistics from a profile for specified platform."""
+    # Stream records straight into the stats extractor instead of buffering the listing
+    # Only the first items are fetched (profile probe); they carry the author block
+    reducer = lambda records: extract_profile_stats(username, records)
     if platform == 'instagram':
-        metadata, error = run_gallery_dl_json_instagram(username)
+        profile_data, error = run_gallery_dl_json_instagram(username, reducer=reducer, probe=True)
     elif platform == 'coomer':
-        metadata, error = run_gallery_dl_json_coomer(username)
+        profile_data, error = run_gallery_dl_json_coomer(username, reducer=reducer, probe=True)
     else:
-        metadata, error = run_gallery_dl_json(username, platform)
+        profile_data, error = run_gallery_dl_json(username, platform, reducer=reducer, probe=True)
     
     # Handle timeout specifically
     if error and "timed out" in error.lower():
@@ -1029,48 +2804,12 @@ def update_user_stats(username, platform='tiktok'):
         sync_status['current_timeout'] = True
         return False, f"⏱️ {error} (retried {MAX_RETRIES} times)"
     
-    if error or not metadata:
+    if error or not profile_data:
         return False, error or "No metadata retrieved"
     
-    # Extract profile information from metadata
-    profile_data = {}
-    avatar_url = ''
-    # Flatten any nested lists in metadata
-    flat_meta = []
-    for it in metadata:
-        if isinstance(it, list):
-            flat_meta.extend(it)
-        else:
-            flat_meta.append(it)
-    for item in flat_meta:
-        if isinstance(item, dict) and ('uploader' in item or 'author' in item or item.get('extractor') == 'tiktok'):
-            display_name = item.get('uploader') or try_get(item, [('author','nickname'), 'author', 'creator'], username)
-            # Try multiple keys for avatar URL, nested too
-            avatar_url = (try_get(item, ['uploader_avatar', 'avatar_url', 'avatar', 'uploader_profile_image']) or
-                          try_get(item, [('author','avatarLarger'), ('author','avatarThumb'), ('author','avatarMedium')]) or '')
-            follower_count = (item.get('uploader_follower_count') or
-                              try_get(item, [('authorStats','followerCount')]) or 0)
-            following_count = (item.get('uploader_following_count') or
-                               try_get(item, [('authorStats','followingCount')]) or 0)
-            
-            profile_data = {
-                'display_name': display_name or username,
-                'profile_picture': avatar_url or '',
-                'follower_count': int(follower_count or 0),
-                'following_count': int(following_count or 0),
-'video_count': len([i for i in flat_meta if isinstance(i, dict) and 'url' in i])
-            }
-            break
-    
-    # Fallback when nothing parsed
-    if not profile_data:
-        profile_data = {
-            'display_name': username,
-            'profile_picture': '',
-            'follower_count': 0,
-            'following_count': 0,
-            'video_count': len([i for i in flat_meta if isinstance(i, dict) and 'url' in i])
-        }
+    # A probe only sees a handful of items, so count posts from what we have downloaded
+    if profile_probe_args():
+        profile_data['video_count'] = count_user_posts(username, platform)
     
     # Try to download and cache avatar using gallery-dl directly
     local_avatar = None
@@ -1083,31 +2822,82 @@ def update_user_stats(username, platform='tiktok'):
     except Exception as e:
         print(f"⚠️ Avatar download error for {username}: {e}")
     
-    # Update database
-    conn = get_db_connection()
-    conn.execute('''
-        UPDATE users SET
-            display_name = ?,
-            profile_picture = ?,
-            follower_count = ?,
-            following_count = ?,
-            video_count = ?,
-            last_sync = CURRENT_TIMESTAMP
-        WHERE username = ? AND platform = ?
-    ''', (
-        profile_data.get('display_name', username),
-        (os.path.basename(local_avatar) if local_avatar else ''),
-        profile_data.get('follower_count', 0),
-        profile_data.get('following_count', 0),
-        profile_data.get('video_count', 0),
-        username,
-        platform
-    ))
-    conn.commit()
-    conn.close()
+    save_user_stats(username, platform, profile_data, local_avatar)
     
     return True, "Stats updated successfully"
 
+def collect_download_metadata(paths, limit=25):
+    """Load the metadata sidecars gallery-dl wrote next to the posts at `paths`
+    (--write-metadata / --write-info-json), newest first.
+    """
+    candidates = {}
+    for path in paths:
+        for sidecar in (path + '.json', os.path.join(os.path.dirname(path), 'info.json')):
+            try:
+                candidates[sidecar] = os.path.getmtime(sidecar)
+            except OSError:
+                continue
+    
+    records = []
+    for path in sorted(candidates, key=candidates.get, reverse=True)[:limit]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(data, dict):
+            records.append(data)
+    return records
+
+def count_archive_entries(username, platform):
+    """Number of posts recorded in a user's gallery-dl download archive."""
+    archive_path = os.path.join(DOWNLOADS_PATH, platform, username, 'download-archive.txt')
+    try:
+        with open(archive_path, 'rb') as f:
+            return sum(1 for line in f if line.strip())
+    except OSError:
+        return 0
+
+def count_user_posts(username, platform):
+    """Posts known for a user: the download archive or the media catalog, whichever is larger."""
+    with db_connection() as conn:
+        row = conn.execute('''
+            SELECT COUNT(*) FROM media m JOIN users u ON u.id = m.user_id
+            WHERE u.username = ? AND u.platform = ? AND m.kind = 'post'
+        ''', (username, platform)).fetchone()
+    return max(count_archive_entries(username, platform), row[0] if row else 0)
+
+def update_user_stats_from_download(username, platform, downloaded):
+    """Single-pass sync: refresh profile stats from the metadata written next to
+    the posts a download run just fetched (`downloaded` paths) instead of
+    crawling the profile a second time. Older sidecars are never read, as their
+    counters are stale. Returns (success, message); success is False when the
+    run fetched nothing to read.
+    """
+    records = collect_download_metadata(downloaded)
+    if not records:
+        return False, "No new download metadata"
+    
+    profile_data = extract_profile_stats(username, records)
+    
+    profile_data['video_count'] = count_user_posts(username, platform)
+    
+    # Avatar straight from the (fresh) metadata URL; only crawl for it when nothing is cached yet
+    local_avatar = None
+    if profile_data.get('profile_picture'):
+        local_avatar = save_avatar_from_url(username, platform, profile_data['profile_picture'])
+    if not local_avatar:
+        local_avatar = find_cached_avatar(username, platform)
+    if not local_avatar:
+        try:
+            local_avatar = download_avatar_with_gallery_dl(username, platform)
+        except Exception as e:
+            print(f"⚠️ Avatar download error for {username}: {e}")
+    
+    save_user_stats(username, platform, profile_data, local_avatar)
+    
+    return True, "Stats updated from download metadata"
+
 # --- Setup Routes ---
 @app.route('/setup')
 def setup_page():
@@ -1143,8 +2933,8 @@ def complete_setup():
              try:
                  # We reuse the logic from import_database essentially:
                  # But we must close DB first? DB is per-request in Flask mostly.
-                 conn = get_db_connection() # Just to be safe? No, let's close it if open.
-                 conn.close()
+                 # Pooled connections must not outlive the file they were opened on
+                 reset_db_pool()
                  
                  # Using the existing import_settings logic would be better if we could, 
                  # but we are in a route. Let's direct call the logic from import_settings 
@@ -1154,6 +2944,11 @@ def complete_setup():
                     # 1. Restore DB
                     if 'trackui.db' in zf.namelist():
                         zf.extract('trackui.db', 'data')
+                        for suffix in ('-wal', '-shm'):
+                            if os.path.exists(DATABASE_PATH + suffix):
+                                os.remove(DATABASE_PATH + suffix)
+                        reset_db_pool()
+                        invalidate_settings_cache()
                     
                     # 2. Restore JSON (settings) - careful not to overwrite our new token
                     # We should restore DB *then* re-apply our new token setting.
@@ -1204,85 +2999,35 @@ def index():
     tags = conn.execute('SELECT * FROM tags ORDER BY name').fetchall()
     
     # Build query with optional tag/platform filter
-    base_query = '''
-        SELECT DISTINCT u.*, COUNT(DISTINCT ut.tag_id) as tag_count
-        FROM users u
-        LEFT JOIN user_tags ut ON u.id = ut.user_id
-    '''
-    
     params = []
     where_clauses = []
     if tag_filter:
-        base_query += '''
-            INNER JOIN user_tags ut2 ON u.id = ut2.user_id
-            INNER JOIN tags t ON ut2.tag_id = t.id
-        '''
-        where_clauses.append('t.name = ?')
+        where_clauses.append('''EXISTS (
+            SELECT 1 FROM user_tags ut2 JOIN tags t ON ut2.tag_id = t.id
+            WHERE ut2.user_id = u.id AND t.name = ?
+        )''')
         params.append(tag_filter)
     if platform_filter in ('tiktok','instagram', 'coomer'):
         where_clauses.append('u.platform = ?')
         params.append(platform_filter)
     if search_query:
-        where_clauses.append('(u.username LIKE ? OR u.display_name LIKE ?)')
-        params.extend([f'%{search_query}%', f'%{search_query}%'])
+        clause, clause_params = user_search_clause(search_query)
+        where_clauses.append(clause)
+        params.extend(clause_params)
         
-    if where_clauses:
-        base_query += ' WHERE ' + ' AND '.join(where_clauses)
-    
-    base_query += ' GROUP BY u.id ORDER BY u.created_at DESC'
+    where_sql = (' WHERE ' + ' AND '.join(where_clauses)) if where_clauses else ''
     
     # Get total count
-    if where_clauses:
-        count_query = 'SELECT COUNT(DISTINCT u.id) FROM users u '
-        if tag_filter:
-            count_query += 'INNER JOIN user_tags ut ON u.id = ut.user_id INNER JOIN tags t ON ut.tag_id = t.id '
-        count_query += 'WHERE ' + ' AND '.join(where_clauses)
-        total = conn.execute(count_query, params).fetchone()[0]
-    else:
-        total = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    total = conn.execute('SELECT COUNT(*) FROM users u' + where_sql, params).fetchone()[0]
     
-    # Get paginated results
+    # Get paginated results with tags, counts and avatar info in one pass
     offset = (page - 1) * per_page
-    paginated_query = f"{base_query} LIMIT ? OFFSET ?"
+    paginated_query = f"{USER_SUMMARY_QUERY}{where_sql} ORDER BY u.created_at DESC LIMIT ? OFFSET ?"
     users = conn.execute(paginated_query, params + [per_page, offset]).fetchall()
     
     conn.close()
     
-    # Add download counts and user tags
-    user_list = []
-    for user in users:
-        user_dict = dict(user)
-        
-        # Count downloaded files
-        platform = user.get('platform','tiktok') if isinstance(user, dict) else user['platform']
-        user_dir = os.path.join(DOWNLOADS_PATH, platform, user['username'])
-        file_count = 0
-        if os.path.exists(user_dir):
-            for root, dirs, files in os.walk(user_dir):
-                file_count += len([f for f in files if f.lower().endswith(('.mp4', '.jpg', '.jpeg', '.png', '.gif'))])
-        
-        user_dict['downloaded_files'] = file_count
-        
-        # Avatar availability
-        avatar_available = False
-        for ext in ['.jpg', '.jpeg', '.png', '.webp']:
-            candidate = os.path.join(AVATARS_PATH, f"{user['platform']}_{user['username']}{ext}")
-            if os.path.exists(candidate):
-                avatar_available = True
-                break
-        user_dict['avatar_available'] = avatar_available
-        
-        # Get user tags
-        conn = get_db_connection()
-        user_tags = conn.execute('''
-            SELECT t.name, t.color FROM tags t
-            JOIN user_tags ut ON t.id = ut.tag_id
-            WHERE ut.user_id = ?
-        ''', (user['id'],)).fetchall()
-        conn.close()
-        
-        user_dict['tags'] = [dict(tag) for tag in user_tags]
-        user_list.append(user_dict)
+    user_list = [user_summary_to_dict(user) for user in users]
     
     # Pagination info
     has_prev = page > 1
@@ -1322,117 +3067,43 @@ def user_profile(username):
         WHERE ut.user_id = ?
     ''', (user['id'],)).fetchall()
     
-    conn.close()
-    
     # Get the user's actual platform from the database
     user_platform = user['platform'] if 'platform' in user.keys() else 'tiktok'
     # Allow URL parameter to override for backward compatibility, but prefer database value
     platform = user_platform if user_platform else request.args.get('platform', 'tiktok')
-    user_dir = os.path.join(DOWNLOADS_PATH, platform, username)
-    media_files = []
-    
-    if os.path.exists(user_dir):
-        for root, dirs, files in os.walk(user_dir):
-            for file in files:
-                if file.lower().endswith(('.mp4', '.jpg', '.jpeg', '.png', '.gif')):
-                    file_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(file_path, DOWNLOADS_PATH)
-                    file_type = 'video' if file.lower().endswith('.mp4') else 'image'
-                    
-                    media_files.append({
-                        'filename': file,
-                        'path': rel_path.replace('\\', '/'),  # Ensure forward slashes for URLs
-                        'type': file_type,
-                        'size': os.path.getsize(file_path),
-                        'modified': datetime.fromtimestamp(os.path.getmtime(file_path))
-                    })
     
-    # Apply videos-only filter if enabled
+    # Media comes from the catalog; videos first, then images, then by date
     videos_only = get_bool_setting('profile_feed_videos_only', False)
-    if videos_only:
-        media_files = [m for m in media_files if m['type'] == 'video']
-    
-    # Sort files - videos first, then images, then by date
-    media_files.sort(key=lambda x: (x['type'] != 'video', -x['modified'].timestamp()))
+    media_rows = conn.execute('''
+        SELECT path, type, size, mtime FROM media
+        WHERE user_id = ? AND (? = 0 OR type = 'video')
+        ORDER BY type != 'video', mtime DESC
+    ''', (user['id'], 1 if videos_only else 0)).fetchall()
+    media_files = [media_row_to_file(row) for row in media_rows]
     
     # For Instagram users, also get stories and highlights
     stories_files = []
     highlights_files = []
     if platform == 'instagram':
-        # Get stories
-        stories_dir = os.path.join(DOWNLOADS_PATH, platform, username, 'stories')
-        if os.path.exists(stories_dir):
-            for root, dirs, files in os.walk(stories_dir):
-                for file in files:
-                    if file.lower().endswith(('.mp4', '.jpg', '.jpeg', '.png', '.gif')):
-                        file_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(file_path, DOWNLOADS_PATH)
-                        file_type = 'video' if file.lower().endswith('.mp4') else 'image'
-                        
-                        stories_files.append({
-                            'filename': file,
-                            'path': rel_path.replace('\\', '/'),
-                            'type': file_type,
-                            'size': os.path.getsize(file_path),
-                            'modified': datetime.fromtimestamp(os.path.getmtime(file_path))
-                        })
-        
-        # Get highlights
-        highlights_dir = os.path.join(DOWNLOADS_PATH, platform, username, 'highlights')
-        if os.path.exists(highlights_dir):
-            for root, dirs, files in os.walk(highlights_dir):
-                for file in files:
-                    if file.lower().endswith(('.mp4', '.jpg', '.jpeg', '.png', '.gif')):
-                        file_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(file_path, DOWNLOADS_PATH)
-                        file_type = 'video' if file.lower().endswith('.mp4') else 'image'
-                        
-                        highlights_files.append({
-                            'filename': file,
-                            'path': rel_path.replace('\\', '/'),
-                            'type': file_type,
-                            'size': os.path.getsize(file_path),
-                            'modified': datetime.fromtimestamp(os.path.getmtime(file_path))
-                        })
+        stories_rows = conn.execute('''
+            SELECT path, type, size, mtime FROM media
+            WHERE user_id = ? AND kind = 'story'
+            ORDER BY mtime DESC
+        ''', (user['id'],)).fetchall()
+        stories_files = [media_row_to_file(row) for row in stories_rows]
         
-        # Sort stories and highlights by date
-        stories_files.sort(key=lambda x: -x['modified'].timestamp())
-        highlights_files.sort(key=lambda x: -x['modified'].timestamp())
+        highlights_rows = conn.execute('''
+            SELECT path, type, size, mtime, highlight_title FROM media
+            WHERE user_id = ? AND kind = 'highlight'
+            ORDER BY mtime DESC
+        ''', (user['id'],)).fetchall()
         
-        # Group highlights by collection using JSON metadata
+        # Group highlights by collection (title resolved when the file was indexed)
         highlights_by_folder = {}
-        import json
-        
-        for file in highlights_files:
-            folder_name = 'General'
-            
-            # Try to read JSON metadata to get highlight collection name
-            json_path = os.path.join(DOWNLOADS_PATH, file['path'] + '.json')
-            if os.path.exists(json_path):
-                try:
-                    with open(json_path, 'r', encoding='utf-8') as f:
-                        metadata = json.load(f)
-                        if 'highlight_title' in metadata and metadata['highlight_title']:
-                            folder_name = metadata['highlight_title'].strip()
-                            print(f"Found highlight collection '{folder_name}' for {file['filename']}")
-                        else:
-                            print(f"No highlight_title found in metadata for {file['filename']}")
-                except Exception as e:
-                    print(f"Error reading JSON metadata for {file['filename']}: {e}")
-            else:
-                print(f"No JSON metadata found for {file['filename']} at {json_path}")
-            
-            # Fallback: try to extract from path structure
-            if folder_name == 'General':
-                path_parts = file['path'].split('/')
-                for i, part in enumerate(path_parts):
-                    if 'highlights' in part.lower():
-                        if i + 1 < len(path_parts) - 1:
-                            folder_name = path_parts[i + 1]
-                            break
-            
-            print(f"Grouping highlight file {file['filename']} into collection: {folder_name}")
-            
+        for row in highlights_rows:
+            file = media_row_to_file(row)
+            highlights_files.append(file)
+            folder_name = row['highlight_title'] or 'General'
             if folder_name not in highlights_by_folder:
                 highlights_by_folder[folder_name] = []
             highlights_by_folder[folder_name].append(file)
@@ -1449,6 +3120,8 @@ def user_profile(username):
                 print(f"    - {f['filename']}")
         print(f"=====================================\n")
     
+    conn.close()
+    
     # Compute counts and avatar url
     videos_count = len([m for m in media_files if m['type'] == 'video'])
     images_count = len([m for m in media_files if m['type'] == 'image'])
@@ -1456,18 +3129,8 @@ def user_profile(username):
     highlights_count = len(highlights_files)
     
     avatar_url = None
-    # Check cached avatar (try platform-prefixed format first, then legacy format)
-    for ext in ['.jpg', '.jpeg', '.png', '.webp']:
-        # Try new format with platform prefix first
-        candidate = os.path.join(AVATARS_PATH, f"{platform}_{username}{ext}")
-        if os.path.exists(candidate):
-            avatar_url = f"/avatar/{username}"
-            break
-        # Try legacy format without platform prefix for backward compatibility
-        candidate_legacy = os.path.join(AVATARS_PATH, f"{username}{ext}")
-        if os.path.exists(candidate_legacy):
-            avatar_url = f"/avatar/{username}"
-            break
+    if user['avatar_path']:
+        avatar_url = url_for('get_avatar', username=username, platform=platform)
     
     # Fallback to first image
     if not avatar_url:
@@ -1497,7 +3160,7 @@ def user_profile(username):
 
 
 
-def run_gallery_dl_json_coomer(username, retry_count=0):
+def run_gallery_dl_json_coomer(username, retry_count=0, reducer=list, probe=False):
     """Extract metadata for Coomer.su profile using gallery-dl."""
     try:
         url = f"https://coomer.su/onlyfans/user/{username}"
@@ -1526,39 +3189,21 @@ def run_gallery_dl_json_coomer(username, retry_count=0):
         # OnlyFans is the most popular, so `https://coomer.su/onlyfans/user/{username}`.
         url = f"https://coomer.su/onlyfans/user/{username}"
         
-        cmd = ['gallery-dl', '--dump-json', '--no-download', url]
+        probe_args = profile_probe_args() if probe else []
+        cmd = ['gallery-dl', '--dump-json', '--no-download'] + probe_args + [url]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=TIMEOUT_THRESHOLD)
-        if result.returncode != 0:
+        metadata, stream = read_gallery_dl_json(cmd, reducer, rate_key='coomer', label=username)
+        report_rate_limit('coomer', stream.stderr, stream.returncode)
+        if stream.returncode != 0:
             # Try patreon as fallback?
             url_patreon = f"https://coomer.su/patreon/user/{username}"
-            cmd = ['gallery-dl', '--dump-json', '--no-download', url_patreon]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=TIMEOUT_THRESHOLD)
+            cmd = ['gallery-dl', '--dump-json', '--no-download'] + probe_args + [url_patreon]
+            metadata, stream = read_gallery_dl_json(cmd, reducer, rate_key='coomer', label=username)
+            report_rate_limit('coomer', stream.stderr, stream.returncode)
             
-            if result.returncode != 0:
-                return None, f"gallery-dl error: {result.stderr}"
-                
-        out = result.stdout.strip()
-        if not out:
-            return [], None
+            if stream.returncode != 0:
+                return None, f"gallery-dl error: {stream.stderr}"
         
-        metadata = []
-        try:
-            data = json.loads(out)
-            if isinstance(data, list):
-                metadata.extend(data)
-            else:
-                metadata.append(data)
-        except json.JSONDecodeError:
-            for line in out.split('\n'):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                    metadata.append(data)
-                except json.JSONDecodeError:
-                    continue
         return metadata, None
     except Exception as e:
         return None, f"Error: {str(e)}"
@@ -1594,7 +3239,12 @@ def add_user():
         # Try to get initial stats (run in background to avoid blocking)
         import threading
         def sync_new_user():
-            success, message = update_user_stats(username, platform)
+            memory_error = memory_pressure_error()
+            if memory_error:
+                print(f"Initial sync for {username} ({platform}) skipped: {memory_error}")
+                return
+            with download_scheduler.slot('interactive'):
+                success, message = update_user_stats(username, platform)
             if message and isinstance(message, str) and "timed out" in message.lower():
                 print(f"Initial sync for {username} ({platform}): ⏱️ {message} - Consider using manual sync later")
             else:
@@ -1627,8 +3277,10 @@ def remove_user(username):
         return jsonify({'success': False, 'error': 'User not found'})
     
     try:
-        # Remove user tags
+        # Remove user tags and catalog entries
         conn.execute('DELETE FROM user_tags WHERE user_id = ?', (user['id'],))
+        conn.execute('DELETE FROM media WHERE user_id = ?', (user['id'],))
+        conn.execute('DELETE FROM media_dirs WHERE user_id = ?', (user['id'],))
         
         # Remove user - filter by both username AND platform
         conn.execute('DELETE FROM users WHERE username = ? AND platform = ?', (username, platform))
@@ -1641,10 +3293,11 @@ def remove_user(username):
             if os.path.exists(user_dir):
                 shutil.rmtree(user_dir)
             # Also clean up avatar files
-            for ext in ['.jpg', '.jpeg', '.png', '.webp']:
+            for ext in AVATAR_EXTENSIONS:
                 avatar_file = os.path.join(AVATARS_PATH, f"{platform}_{username}{ext}")
                 if os.path.exists(avatar_file):
                     os.remove(avatar_file)
+        forget_avatar(username)
         
         return jsonify({'success': True, 'message': 'User removed successfully'})
         
@@ -1779,6 +3432,8 @@ def import_settings():
                         u.get('created_at')
                     ))
                     count += 1
+                # Avatars already on disk for imported users
+                backfill_avatar_paths(conn)
                 print(f"Imported/Updated {count} users")
 
             # 2. Restore Tags
@@ -1835,6 +3490,10 @@ def import_settings():
 
         conn.commit()
         conn.close()
+        invalidate_settings_cache()
+        
+        # Catalog any existing download folders of imported users
+        threading.Thread(target=reconcile_media_catalog, kwargs={'show_progress': True}, daemon=True).start()
         return jsonify({'success': True, 'message': 'Import completed successfully'})
 
     except Exception as e:
@@ -1854,7 +3513,7 @@ def factory_reset():
         conn.execute('PRAGMA foreign_keys = OFF')
         
         # Clear all tables
-        tables = ['users', 'tags', 'user_tags', 'likes', 'settings']
+        tables = ['users', 'tags', 'user_tags', 'likes', 'settings', 'media', 'media_dirs']
         for table in tables:
             conn.execute(f'DELETE FROM {table}')
             # Reset auto-increment counters
@@ -1863,6 +3522,8 @@ def factory_reset():
         conn.execute('PRAGMA foreign_keys = ON')
         conn.commit()
         conn.close()
+        invalidate_settings_cache()
+        clear_avatar_cache()
         
         # Re-initialize default settings
         init_database()
@@ -1879,12 +3540,20 @@ def factory_reset():
                 shutil.rmtree(AVATARS_PATH)
                 os.makedirs(AVATARS_PATH, exist_ok=True)
                 
+            # Clear thumbnails
+            if os.path.exists(THUMBS_PATH):
+                shutil.rmtree(THUMBS_PATH)
+            with _thumb_lock:
+                _thumb_failed.clear()
+                
             # Clear logs
-            global download_progress, global_download_queue, active_downloads, scheduler_logs
+            global download_progress, active_downloads, scheduler_logs
             download_progress = {}
-            global_download_queue = []
+            with _download_queue_lock:
+                global_download_queue.clear()
             active_downloads = {}
             scheduler_logs = []
+            publish_download_event('snapshot')
             
         return jsonify({'success': True, 'message': 'Factory reset completed successfully'})
         
@@ -1910,10 +3579,34 @@ def update_settings():
         print(f"Error updating settings: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def perform_download(username, reuse_existing=False, platform='tiktok'):
+@contextmanager
+def username_download_lock(username):
+    """Hold while downloading for `username`. Progress, process handles, pause
+    controls and queue entries are keyed by bare username, so one handle
+    tracked on two platforms must not download on both at once.
+    """
+    with _username_locks_guard:
+        lock = _username_locks.setdefault(username, threading.Lock())
+    with lock:
+        yield
+
+def perform_download(username, reuse_existing=False, platform='tiktok', resume=False, downloaded=None):
     """Perform a synchronous download for a user, updating queues and DB.
-    Returns (success: bool, file_count: int).
+    With `resume`, continues from the checkpoint left by a pause instead of
+    starting over. Waits while the same username downloads on another platform.
+    Paths of the posts written are appended to the `downloaded` list, if given.
+    Returns (success: bool, file_count: int, paused: bool).
     """
+    with username_download_lock(username):
+        return _perform_download(username, reuse_existing, platform, resume, downloaded)
+
+def _perform_download(username, reuse_existing, platform, resume, downloaded):
+    target = f"{platform}/{username}"
+    checkpoint = get_download_checkpoint(target) if resume else None
+    if not checkpoint:
+        clear_download_checkpoint(target)
+    _download_controls.setdefault(username, {})['pause'] = False
+    
     # Add to global queue (unless we are resuming an existing entry)
     if not (reuse_existing and username in active_downloads):
         add_to_global_queue(username)
@@ -1939,6 +3632,35 @@ def perform_download(username, reuse_existing=False, platform='tiktok'):
                           files_downloaded=file_count,
                           current_file=current_file)
     
+    # Phases before the checkpointed one already finished; a standalone
+    # stories/highlights run only resumes its own phase
+    phases = DOWNLOAD_PHASES
+    if checkpoint:
+        phases = DOWNLOAD_PHASES[DOWNLOAD_PHASES.index(checkpoint['phase']):]
+        if (checkpoint['data'] or {}).get('only'):
+            phases = [checkpoint['phase']]
+        print(f"Resuming {target} at {checkpoint['phase']} item {checkpoint['position'] + 1}")
+    
+    def start_position(phase):
+        return checkpoint['position'] if checkpoint and checkpoint['phase'] == phase else 0
+    
+    def pause_at(phase, position, file_count, output):
+        save_download_checkpoint(target, phase, position, checkpoint['data'] if checkpoint else None)
+        download_progress[username].update({
+            'status': 'paused',
+            'total_files': file_count,
+            'end_time': time.time(),
+            'logs': output.split('\n') if output else []
+        })
+        # Update global queue without removing from active list
+        update_global_queue(username,
+                          status='paused',
+                          total_files=file_count,
+                          current_file=f'Paused during {phase} after {position} items',
+                          logs=output.split('\n') if output else [])
+        index_user_media(username, platform)
+        return False, file_count, True
+    
     # Check granular settings
     sync_posts = get_bool_setting('sync_posts', True)
     sync_stories = get_bool_setting('sync_stories', True)
@@ -1949,22 +3671,14 @@ def perform_download(username, reuse_existing=False, platform='tiktok'):
     output = ''
     
     # Platform-specific "posts" download
-    if sync_posts:
-        success, output, file_count, paused = run_gallery_dl_download(username, progress_callback, platform)
+    if 'posts' not in phases:
+        update_global_queue(username, current_file="Posts already downloaded, resuming")
+    elif sync_posts:
+        success, output, file_count, paused, position = run_gallery_dl_download(
+            username, progress_callback, platform, start_position=start_position('posts'), downloaded=downloaded)
         
         if paused:
-            download_progress[username].update({
-                'status': 'paused',
-                'total_files': file_count,
-                'end_time': time.time(),
-                'logs': output.split('\n') if output else []
-            })
-            # Update global queue without removing from active list
-            update_global_queue(username,
-                              status='paused',
-                              total_files=file_count,
-                              logs=output.split('\n') if output else [])
-            return False, file_count
+            return pause_at('posts', position, file_count, output)
     else:
         print(f"Skipping posts download for {username} (sync_posts=False)")
         update_global_queue(username, current_file="Skipping posts (disabled)")
@@ -1981,6 +3695,34 @@ def perform_download(username, reuse_existing=False, platform='tiktok'):
     conn.commit()
     conn.close()
 
+    # For Instagram users, automatically download stories and highlights if enabled
+    if platform == 'instagram' and success:
+        try:
+            for kind, enabled in (('stories', sync_stories), ('highlights', sync_highlights)):
+                if kind not in phases:
+                    continue
+                if not enabled:
+                    print(f"Skipping {kind} for {username} (sync_{kind}=False)")
+                    continue
+                update_global_queue(username, current_file=f'Downloading @{username} {kind}...')
+                aux_success, aux_output, aux_count, paused, position = perform_download_instagram_aux(
+                    username, kind=kind, start_position=start_position(kind))
+                if paused:
+                    return pause_at(kind, position, file_count + aux_count, aux_output)
+                if aux_success and aux_count > 0:
+                    update_global_queue(username, current_file=f'{kind.title()} completed: {aux_count} files')
+                    print(f"{kind.title()} downloaded for {username}: {aux_count} files")
+                elif aux_count == 0:
+                    print(f"No new {kind} found for {username}")
+                else:
+                    print(f"{kind.title()} download failed for {username}: {aux_output[:100]}...")
+            
+        except Exception as e:
+            print(f"Error downloading stories/highlights for {username}: {e}")
+            update_global_queue(username, current_file=f'Stories/highlights error: {str(e)}')
+    
+    clear_download_checkpoint(target)
+    
     final_status = 'completed' if success else 'failed'
     download_progress[username].update({
         'status': final_status,
@@ -2014,42 +3756,13 @@ def perform_download(username, reuse_existing=False, platform='tiktok'):
         except Exception as e:
             print(f"Failed to send failure notification: {e}")
     
-    # For Instagram users, automatically download stories and highlights if enabled
-    if platform == 'instagram' and success:
-        try:
-            # Download stories (if enabled)
-            if sync_stories:
-                update_global_queue(username, current_file=f'Downloading @{username} stories...')
-                stories_success, stories_output, stories_count = perform_download_instagram_aux(username, kind='stories')
-                if stories_success and stories_count > 0:
-                    update_global_queue(username, current_file=f'Stories completed: {stories_count} files')
-                    print(f"Stories downloaded for {username}: {stories_count} files")
-                elif stories_count == 0:
-                    print(f"No new stories found for {username}")
-                else:
-                    print(f"Stories download failed for {username}: {stories_output[:100]}...")
-            else:
-                print(f"Skipping stories for {username} (sync_stories=False)")
-            
-            # Download highlights (if enabled)
-            if sync_highlights:
-                update_global_queue(username, current_file=f'Downloading @{username} highlights...')
-                highlights_success, highlights_output, highlights_count = perform_download_instagram_aux(username, kind='highlights')
-                if highlights_success and highlights_count > 0:
-                    update_global_queue(username, current_file=f'Highlights completed: {highlights_count} files')
-                    print(f"Highlights downloaded for {username}: {highlights_count} files")
-                elif highlights_count == 0:
-                    print(f"No new highlights found for {username}")
-                else:
-                    print(f"Highlights download failed for {username}: {highlights_output[:100]}...")
-            else:
-                 print(f"Skipping highlights for {username} (sync_highlights=False)")
-            
-        except Exception as e:
-            print(f"Error downloading stories/highlights for {username}: {e}")
-            update_global_queue(username, current_file=f'Stories/highlights error: {str(e)}')
+    # Refresh the media catalog with whatever landed on disk
+    try:
+        index_user_media(username, platform)
+    except Exception as e:
+        print(f"Error indexing media for {username}: {e}")
     
-    return success, file_count
+    return success, file_count, False
 
 @app.route('/api/download_user/<username>', methods=['POST'])
 def download_user_content(username):
@@ -2067,8 +3780,12 @@ def download_user_content(username):
     if username in download_progress and download_progress[username].get('status') == 'downloading':
         return jsonify({'success': False, 'error': 'Download already in progress'})
     
+    memory_error = memory_pressure_error()
+    if memory_error:
+        return jsonify({'success': False, 'error': memory_error}), 503
+    
     def download_thread():
-        perform_download(username, platform=platform)
+        run_download_job(username, platform)
     
     thread = threading.Thread(target=download_thread)
     thread.start()
@@ -2101,17 +3818,31 @@ def resume_download(username):
     user = conn.execute('SELECT platform FROM users WHERE username = ?', (username,)).fetchone()
     conn.close()
     
-    if not user:
+    # External downloads are paused under their download id
+    checkpoint = get_download_checkpoint(username) if not user else None
+    if not user and not (checkpoint and checkpoint['phase'] == 'external'):
         return jsonify({'success': False, 'error': 'User not found'})
     
-    platform = user['platform']
+    memory_error = memory_pressure_error()
+    if memory_error:
+        return jsonify({'success': False, 'error': memory_error}), 503
+
+    if not user:
+        if username not in active_downloads:
+            add_to_global_queue(username, username)
+        threading.Thread(target=run_external_download,
+                         args=(username, checkpoint['data']['url'], checkpoint['data']['destination']),
+                         kwargs={'resume': True}).start()
+        return jsonify({'success': True, 'message': 'Resume started'})
     
+    platform = user['platform']
+
     _download_controls.setdefault(username, {'pause': False})
     _download_controls[username]['pause'] = False
 
     def resume_thread():
         # Reuse existing queue entry if present
-        perform_download(username, reuse_existing=True, platform=platform)
+        resume_download_job(username, platform)
     threading.Thread(target=resume_thread).start()
     return jsonify({'success': True, 'message': 'Resume started'})
 
@@ -2129,12 +3860,75 @@ def get_downloads_status():
 @app.route('/api/downloads/clear_completed', methods=['POST'])
 def clear_completed_downloads():
     """Clear completed downloads from the queue (excluding sync operations)."""
-    global global_download_queue
-    # Keep sync operations and non-completed downloads
-    global_download_queue = [d for d in global_download_queue 
-                           if d['status'] not in ['completed', 'failed'] or d['username'] == SYNC_QUEUE_USERNAME]
+    with _download_queue_lock:
+        # Keep sync operations and non-completed downloads
+        cleared = [d['id'] for d in global_download_queue.values()
+                   if d['status'] in ['completed', 'failed'] and d['username'] != SYNC_QUEUE_USERNAME]
+        for download_id in cleared:
+            del global_download_queue[download_id]
+    publish_download_event('remove', {'ids': cleared})
     return jsonify({'success': True, 'message': 'Completed downloads cleared'})
 
+@app.route('/api/downloads/<download_id>/log')
+def get_download_log(download_id):
+    """Full log of a download (the queue entry only keeps the last lines)."""
+    path = download_log_path(download_id)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype='text/plain')
+
+@app.route('/api/downloads/stream')
+def download_event_stream():
+    """Server-Sent Events feed for the Download Manager.
+    Sends a snapshot on connect, then queue deltas as update_global_queue applies
+    them, sync status changes and keepalive comments.
+    """
+    q = queue.Queue(maxsize=DOWNLOAD_STREAM_BACKLOG)
+    with _download_subscribers_lock:
+        _download_subscribers.add(q)
+
+    def snapshot():
+        status = get_global_download_status()
+        status['downloads'] = [download_entry_summary(d) for d in status['downloads']]
+        return status
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            yield format_sse('snapshot', snapshot())
+            last_sync = None
+            last_sync_check = 0
+            last_write = time.time()
+            while True:
+                try:
+                    event, data = q.get(timeout=1)
+                except queue.Empty:
+                    event = None
+                if event == 'snapshot':
+                    yield format_sse('snapshot', snapshot())
+                    last_write = time.time()
+                elif event:
+                    yield format_sse(event, data)
+                    last_write = time.time()
+
+                now = time.time()
+                if now - last_sync_check >= 1:
+                    last_sync_check = now
+                    sync = get_sync_status_snapshot(include_logs=False)
+                    if sync != last_sync:
+                        last_sync = sync
+                        yield format_sse('sync', sync)
+                        last_write = now
+                if now - last_write >= DOWNLOAD_STREAM_HEARTBEAT:
+                    yield ': keepalive\n\n'
+                    last_write = now
+        finally:
+            with _download_subscribers_lock:
+                _download_subscribers.discard(q)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/downloads/instagram/stories/<username>', methods=['POST'])
 def download_instagram_stories(username):
     """Download Instagram stories for a specific user."""
@@ -2150,24 +3944,38 @@ def download_instagram_stories(username):
         if user['platform'] != 'instagram':
             return jsonify({'success': False, 'error': 'Stories are only available for Instagram users'})
         
+        memory_error = memory_pressure_error()
+        if memory_error:
+            return jsonify({'success': False, 'error': memory_error}), 503
+        
         # Create download ID
         download_id = f"{username}_stories_{int(time.time())}"
         
         def download_thread():
-            update_global_queue(download_id, status='downloading', current_file=f'Downloading @{username} stories')
+            _download_controls.setdefault(username, {})['pause'] = False
+            update_global_queue(username, status='downloading', current_file=f'Downloading @{username} stories')
             try:
-                success, output, file_count = perform_download_instagram_aux(username, kind='stories')
-                if success:
-                    update_global_queue(download_id, status='completed', 
+                with download_scheduler.slot('stories'), username_download_lock(username):
+                    success, output, file_count, paused, position = perform_download_instagram_aux(username, kind='stories')
+                index_user_media(username, 'instagram')
+                if paused:
+                    # Resuming goes through perform_download(), limited to this phase
+                    save_download_checkpoint(f"instagram/{username}", 'stories', position, {'only': True})
+                    update_global_queue(username, status='paused',
+                                      current_file=f'Stories download paused after {position} items',
+                                      files_downloaded=file_count,
+                                      logs=output.split('\n') if output else [])
+                elif success:
+                    update_global_queue(username, status='completed', 
                                       current_file=f'Stories download completed: {file_count} files',
                                       files_downloaded=file_count, total_files=file_count,
                                       logs=output.split('\n') if output else [])
                 else:
-                    update_global_queue(download_id, status='failed', 
+                    update_global_queue(username, status='failed', 
                                       current_file=f'Stories download failed',
                                       logs=output.split('\n') if output else ['No output available'])
             except Exception as e:
-                update_global_queue(download_id, status='failed', 
+                update_global_queue(username, status='failed', 
                                   current_file=f'Stories download failed: {str(e)}',
                                   logs=[str(e)])
         
@@ -2198,106 +4006,349 @@ def download_instagram_highlights(username):
         if user['platform'] != 'instagram':
             return jsonify({'success': False, 'error': 'Highlights are only available for Instagram users'})
         
+        memory_error = memory_pressure_error()
+        if memory_error:
+            return jsonify({'success': False, 'error': memory_error}), 503
+        
         # Create download ID
         download_id = f"{username}_highlights_{int(time.time())}"
         
         def download_thread():
-            update_global_queue(download_id, status='downloading', current_file=f'Downloading @{username} highlights')
+            _download_controls.setdefault(username, {})['pause'] = False
+            update_global_queue(username, status='downloading', current_file=f'Downloading @{username} highlights')
+            try:
+                with download_scheduler.slot('stories'), username_download_lock(username):
+                    success, output, file_count, paused, position = perform_download_instagram_aux(username, kind='highlights')
+                index_user_media(username, 'instagram')
+                if paused:
+                    # Resuming goes through perform_download(), limited to this phase
+                    save_download_checkpoint(f"instagram/{username}", 'highlights', position, {'only': True})
+                    update_global_queue(username, status='paused',
+                                      current_file=f'Highlights download paused after {position} items',
+                                      files_downloaded=file_count,
+                                      logs=output.split('\n') if output else [])
+                elif success:
+                    update_global_queue(username, status='completed', 
+                                      current_file=f'Highlights download completed: {file_count} files',
+                                      files_downloaded=file_count, total_files=file_count,
+                                      logs=output.split('\n') if output else [])
+                else:
+                    update_global_queue(username, status='failed', 
+                                      current_file=f'Highlights download failed',
+                                      logs=output.split('\n') if output else ['No output available'])
+            except Exception as e:
+                update_global_queue(username, status='failed', 
+                                  current_file=f'Highlights download failed: {str(e)}',
+                                  logs=[str(e)])
+        
+        # Add to queue
+        add_to_global_queue(username, download_id)
+        
+        # Start download in background
+        thread = threading.Thread(target=download_thread)
+        thread.start()
+        
+        return jsonify({'success': True, 'message': 'Highlights download started', 'download_id': download_id})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Failed to start highlights download: {str(e)}'})
+
+# Persistent jobs
+# Sync All users and single-user downloads are recorded in the jobs table so
+# work interrupted by a restart can be picked up again at startup.
+JOB_MAX_ATTEMPTS = 3       # interrupted jobs are retried this many times before being marked failed
+JOB_HISTORY_DAYS = 30      # finished jobs older than this are deleted at startup
+
+def create_jobs(kind, users, batch=None):
+    """Queue one job per (username, platform). Returns the new job rows."""
+    with db_connection() as conn:
+        conn.executemany('INSERT INTO jobs (kind, username, platform, batch) VALUES (?, ?, ?, ?)',
+                         [(kind, username, platform, batch) for username, platform in users])
+        conn.commit()
+        if batch is not None:
+            jobs = conn.execute('SELECT id, username, platform FROM jobs WHERE batch = ? ORDER BY id', (batch,)).fetchall()
+        else:
+            jobs = conn.execute('SELECT id, username, platform FROM jobs WHERE id = last_insert_rowid()').fetchall()
+    return jobs
+
+def start_job(job_id):
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = CURRENT_TIMESTAMP, error = NULL
+            WHERE id = ?
+        ''', (job_id,))
+        conn.commit()
+
+def finish_job(job_id, status, error=None):
+    """Record a job's outcome: 'completed', 'failed' or 'paused'."""
+    with db_connection() as conn:
+        conn.execute('UPDATE jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?',
+                     (status, error, job_id))
+        conn.commit()
+
+def run_download_job(username, platform):
+    """perform_download() tracked by a 'download' job."""
+    job = create_jobs('download', [(username, platform)])[0]
+    with download_scheduler.slot('interactive'):
+        return _run_job(job['id'], lambda: perform_download(username, platform=platform))
+
+def resume_download_job(username, platform):
+    """Resume a paused download, continuing its job if it has one."""
+    conn = get_db_connection()
+    job = conn.execute('''
+        SELECT id FROM jobs WHERE username = ? AND platform = ? AND status = 'paused' ORDER BY id DESC LIMIT 1
+    ''', (username, platform)).fetchone()
+    conn.close()
+    job_id = job['id'] if job else create_jobs('download', [(username, platform)])[0]['id']
+    with download_scheduler.slot('interactive'):
+        return _run_job(job_id, lambda: perform_download(username, reuse_existing=True, platform=platform, resume=True))
+
+def _run_job(job_id, work):
+    """Run `work` as a job; it returns (success, file_count, paused). Returns success."""
+    start_job(job_id)
+    try:
+        success, _, paused = work()
+    except Exception as e:
+        finish_job(job_id, 'failed', str(e))
+        raise
+    if paused:
+        finish_job(job_id, 'paused')
+    else:
+        finish_job(job_id, 'completed' if success else 'failed')
+    return success
+
+def resume_interrupted_jobs():
+    """Startup dispatcher: requeue jobs left running by the last process and resume them.
+    An unfinished Sync All batch continues with the users it had not reached;
+    single-user downloads are re-run one after another; paused downloads are
+    put back in the Download Manager so they can be resumed by hand.
+    With resume_jobs_on_startup off, interrupted jobs are marked failed instead.
+    """
+    resume = get_bool_setting('resume_jobs_on_startup', True)
+    conn = get_db_connection()
+    conn.execute('''
+        DELETE FROM jobs WHERE status IN ('completed', 'failed')
+        AND finished_at < datetime('now', ?)
+    ''', (f'-{JOB_HISTORY_DAYS} days',))
+    if not resume:
+        # Don't leave them queued for a later start to pick up
+        conn.execute('''
+            UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart', finished_at = CURRENT_TIMESTAMP
+            WHERE status IN ('running', 'queued')
+        ''')
+        conn.commit()
+        conn.close()
+        return
+    # Anything still 'running' was cut off by the restart
+    conn.execute('''
+        UPDATE jobs SET status = 'failed', error = 'Interrupted too many times', finished_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND attempts >= ?
+    ''', (JOB_MAX_ATTEMPTS,))
+    conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+    conn.commit()
+
+    batch = conn.execute('''
+        SELECT batch FROM jobs WHERE kind = 'sync_user' AND status = 'queued'
+        ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+    downloads = conn.execute('''
+        SELECT id, username, platform FROM jobs WHERE kind = 'download' AND status = 'queued' ORDER BY id
+    ''').fetchall()
+    paused = [row['username'] for row in conn.execute('''
+        SELECT DISTINCT username FROM jobs WHERE status = 'paused'
+    ''')]
+    # Checkpoints also cover paused stories/highlights and external downloads, which have no job
+    for row in conn.execute('SELECT target, phase FROM download_checkpoints'):
+        label = row['target'] if row['phase'] == 'external' else row['target'].split('/', 1)[-1]
+        if label not in paused:
+            paused.append(label)
+    conn.close()
+
+    for label in paused:
+        if label not in active_downloads:
+            add_to_global_queue(label)
+            update_global_queue(label, status='paused', current_file='Paused before restart')
+            download_progress[label] = {'status': 'paused'}
+
+    if batch:
+        print(f"Resuming interrupted sync ({batch['batch']})...")
+        sync_status['running'] = True  # keep the scheduler from starting a second run meanwhile
+        threading.Thread(target=run_sync_all_process, kwargs={'resume_batch': batch['batch']}, daemon=True).start()
+
+    if downloads:
+        print(f"Resuming {len(downloads)} interrupted download(s)...")
+
+        def download_loop():
+            for job in downloads:
+                try:
+                    with download_scheduler.slot('sync'):
+                        _run_job(job['id'], lambda job=job: perform_download(job['username'], platform=job['platform']))
+                except Exception as e:
+                    print(f"Resumed download failed for {job['username']}: {e}")
+                finally:
+                    release_thread_db_connection()
+
+        threading.Thread(target=download_loop, daemon=True).start()
+
+def get_sync_concurrency(platform):
+    """Number of Sync All workers allowed for a platform."""
+    return max(1, get_int_setting(f'sync_concurrency_{platform}', SYNC_CONCURRENCY_DEFAULTS.get(platform, 1)))
+
+def _update_sync_all_entry():
+    """Summarise the active workers on the single Sync All Download Manager entry."""
+    workers = list(sync_status.get('workers', {}).values())
+    busy = [w for w in workers if w.get('user')]
+    if not busy:
+        return
+    label = ', '.join(f"@{w['user']} [{w['platform']}]" for w in busy[:3])
+    if len(busy) > 3:
+        label += f" +{len(busy) - 3} more"
+    update_global_queue(SYNC_QUEUE_USERNAME, current_file=f"{busy[0]['phase'] if len(busy) == 1 else 'Syncing'} {label}")
+
+def _log_stats_result(username, platform, success, message):
+    sync_logs.append(f"{username} ({platform}): {message}")
+    if not success:
+        if message and "timed out" in message.lower():
+            sync_logs.append(f"⏱️ Timeout: {username} - {message}")
+        else:
+            sync_logs.append(f"Failed to sync {username}: {message}")
+    elif username in sync_status.get('timeout_users', []):
+        # Remove from timeout users if sync was successful
+        sync_status['timeout_users'].remove(username)
+
+def sync_single_user(username, platform):
+    """Sync worker: refresh a user's stats and download their new media.
+    In single-pass mode the download runs first and the stats are read from
+    the metadata it wrote; otherwise the profile is crawled before downloading.
+    Returns (stats refreshed, files downloaded, download paused).
+    """
+    file_count, paused = 0, False
+    with sync_workers_lock:
+        worker = sync_status['workers'].setdefault(threading.current_thread().name, {'platform': platform, 'user': None, 'phase': None, 'started': None, 'completed': 0})
+        worker.update({'user': username, 'phase': 'Waiting', 'started': time.time()})
+    _update_sync_all_entry()
+    download_scheduler.acquire('sync')
+
+    worker.update({'phase': 'Syncing', 'started': time.time()})
+    sync_status['current_user'] = f"{username} ({platform})"
+    sync_status['current_timeout'] = False  # Reset for each user
+    sync_logs.append(f"Syncing {username} ({platform})...")
+    _update_sync_all_entry()
+
+    try:
+        if get_bool_setting('sync_single_pass', True):
+            worker['phase'] = 'Downloading'
+            _update_sync_all_entry()
+            downloaded = []
             try:
-                success, output, file_count = perform_download_instagram_aux(username, kind='highlights')
-                if success:
-                    update_global_queue(download_id, status='completed', 
-                                      current_file=f'Highlights download completed: {file_count} files',
-                                      files_downloaded=file_count, total_files=file_count,
-                                      logs=output.split('\n') if output else [])
-                else:
-                    update_global_queue(download_id, status='failed', 
-                                      current_file=f'Highlights download failed',
-                                      logs=output.split('\n') if output else ['No output available'])
+                _, file_count, paused = perform_download(username, platform=platform, reuse_existing=True, downloaded=downloaded)
             except Exception as e:
-                update_global_queue(download_id, status='failed', 
-                                  current_file=f'Highlights download failed: {str(e)}',
-                                  logs=[str(e)])
-        
-        # Add to queue
-        add_to_global_queue(username, download_id)
-        
-        # Start download in background
-        thread = threading.Thread(target=download_thread)
-        thread.start()
-        
-        return jsonify({'success': True, 'message': 'Highlights download started', 'download_id': download_id})
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': f'Failed to start highlights download: {str(e)}'})
+                sync_logs.append(f"Download error for {username} ({platform}): {e}")
+
+            success, message = update_user_stats_from_download(username, platform, downloaded)
+            if not success:
+                # No new posts (or a failed run) to read - fall back to a profile probe
+                worker['phase'] = 'Syncing'
+                _update_sync_all_entry()
+                success, message = update_user_stats(username, platform)
+            _log_stats_result(username, platform, success, message)
+        else:
+            success, message = update_user_stats(username, platform)
+            _log_stats_result(username, platform, success, message)
+
+            if success:
+                # After a successful metadata sync, download media for this user
+                worker['phase'] = 'Downloading'
+                _update_sync_all_entry()
+                try:
+                    _, file_count, paused = perform_download(username, platform=platform, reuse_existing=True)
+                except Exception as e:
+                    sync_logs.append(f"Download error for {username} ({platform}): {e}")
 
-def run_sync_all_process():
-    """Internal: perform sync-all and per-user downloads, updating queues and status."""
+        # For Instagram/Coomer already handled in perform_download (granular sync)
+        return success, file_count, paused
+    except Exception as e:
+        sync_logs.append(f"Critical error syncing {username}: {str(e)}")
+        print(f"Error syncing {username}: {e}")
+        return False, file_count, paused
+    finally:
+        download_scheduler.release()
+        # Pool threads outlive the user; don't let a leaked connection carry over
+        release_thread_db_connection()
+        worker.update({'user': None, 'phase': 'Idle', 'started': None})
+        worker['completed'] += 1
+
+def run_sync_all_process(resume_batch=None):
+    """Internal: perform sync-all and per-user downloads, updating queues and status.
+    Users are spread over one worker pool per platform so each platform's
+    concurrency limit is respected independently. Each user is a 'sync_user'
+    job; `resume_batch` continues an interrupted run with its unfinished jobs.
+    """
     sync_status['running'] = True
     sync_status['last_sync'] = datetime.now()
     sync_status['timeout_users'] = []
     sync_status['current_timeout'] = False
+    with sync_workers_lock:
+        sync_status['workers'] = {}
     sync_logs.clear()
     
-    # Notify Telegram (Start)
-    send_telegram_message(f"📅 Scheduled Sync Started at {datetime.now().strftime('%H:%M')}")
-    
+    executors = {}
     try:
         conn = get_db_connection()
-        users = conn.execute('SELECT username, platform FROM users WHERE is_tracking = 1').fetchall()
-        conn.close()
+        if resume_batch:
+            batch = resume_batch
+            jobs = conn.execute('''
+                SELECT id, username, platform FROM jobs
+                WHERE batch = ? AND status IN ('queued', 'running') ORDER BY id
+            ''', (batch,)).fetchall()
+            total_users = conn.execute('SELECT COUNT(*) FROM jobs WHERE batch = ?', (batch,)).fetchone()[0]
+            conn.close()
+            sync_logs.append(f"Resuming interrupted sync: {len(jobs)} of {total_users} users left")
+            send_telegram_message(f"🔁 Resuming interrupted sync ({len(jobs)}/{total_users} users left)")
+        else:
+            batch = f"sync_{int(time.time())}"
+            # A new run replaces whatever an earlier, interrupted run left queued
+            conn.execute('''
+                UPDATE jobs SET status = 'failed', error = 'Superseded by a newer sync', finished_at = CURRENT_TIMESTAMP
+                WHERE kind = 'sync_user' AND status IN ('queued', 'running')
+            ''')
+            conn.commit()
+            users = conn.execute('SELECT username, platform FROM users WHERE is_tracking = 1').fetchall()
+            conn.close()
+            jobs = create_jobs('sync_user', [(u['username'], u['platform'] or 'tiktok') for u in users], batch=batch)
+            total_users = len(jobs)
+            # Notify Telegram (Start)
+            send_telegram_message(f"📅 Scheduled Sync Started at {datetime.now().strftime('%H:%M')}")
         
-        total_users = len(users)
-        processed = 0
+        processed = total_users - len(jobs)
+        progress_lock = threading.Lock()
         
         # Push a synthetic task into the Download Manager queue so progress shows up there
         add_to_global_queue(SYNC_QUEUE_USERNAME)
-        update_global_queue(SYNC_QUEUE_USERNAME, status='downloading', total_files=total_users, files_downloaded=0, current_file='Preparing...')
-        
-        for user in users:
-            username = user['username']
-            platform = user.get('platform','tiktok') if isinstance(user, dict) else user['platform']
-            sync_status['current_user'] = f"{username} ({platform})"
-            sync_status['current_timeout'] = False  # Reset for each user
-            sync_logs.append(f"Syncing {username} ({platform})...")
-            
-            # Update the Download Manager entry to reflect current user being synced
-            update_global_queue(SYNC_QUEUE_USERNAME, current_file=f"Syncing @{username} [{platform}]")
-            
+        update_global_queue(SYNC_QUEUE_USERNAME, status='downloading', total_files=total_users, files_downloaded=processed, current_file='Preparing...')
+        
+        futures = []
+        for job in jobs:
+            username = job['username']
+            platform = job['platform']
+            if platform not in executors:
+                workers = get_sync_concurrency(platform)
+                executors[platform] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"sync-{platform}")
+                sync_logs.append(f"Using {workers} worker(s) for {platform}")
+            futures.append(executors[platform].submit(
+                _run_job, job['id'], lambda username=username, platform=platform: sync_single_user(username, platform)))
+        
+        for future in as_completed(futures):
             try:
-                success, message = update_user_stats(username, platform)
-                sync_logs.append(f"{username} ({platform}): {message}")
-                
-                if not success:
-                    if message and "timed out" in message.lower():
-                        sync_logs.append(f"⏱️ Timeout: {username} - {message}")
-                    else:
-                        sync_logs.append(f"Failed to sync {username}: {message}")
-                else:
-                    # Remove from timeout users if sync was successful
-                    if username in sync_status.get('timeout_users', []):
-                        sync_status['timeout_users'].remove(username)
-                    
-                    # After a successful metadata sync, download media for this user
-                    update_global_queue(SYNC_QUEUE_USERNAME, current_file=f"Downloading @{username} [{platform}]")
-                    try:
-                        perform_download(username, platform=platform, reuse_existing=True)
-                    except Exception as e:
-                        sync_logs.append(f"Download error for {username} ({platform}): {e}")
-                        
-                    # For Instagram/Coomer already handled in perform_download (granular sync)
+                future.result()
             except Exception as e:
-                sync_logs.append(f"Critical error syncing {username}: {str(e)}")
-                print(f"Error syncing {username}: {e}")
-            
-            processed += 1
-            update_global_queue(SYNC_QUEUE_USERNAME, files_downloaded=processed, total_files=total_users)
-            
-            # Add delay between requests for rate limiting
-            time.sleep(REQUEST_DELAY)
+                sync_logs.append(f"Sync worker error: {e}")
+            with progress_lock:
+                processed += 1
+                update_global_queue(SYNC_QUEUE_USERNAME, files_downloaded=processed, total_files=total_users)
         
         # Mark the synthetic task as completed and attach last logs
-        update_global_queue(SYNC_QUEUE_USERNAME, status='completed', logs=sync_logs[-50:])
+        update_global_queue(SYNC_QUEUE_USERNAME, status='completed', current_file=f"Completed ({processed}/{total_users} users)", logs=sync_logs[-50:])
         sync_logs.append("Sync completed")
         
         # Notify Telegram (End)
@@ -2310,30 +4361,57 @@ def run_sync_all_process():
         send_telegram_message(f"⚠️ Sync Process Crashed: {str(e)}")
         
     finally:
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        release_thread_db_connection()
         sync_status['running'] = False
         sync_status['current_user'] = None
+        with sync_workers_lock:
+            sync_status['workers'] = {}
 
 @app.route('/api/sync_all', methods=['POST'])
 def sync_all_users():
     """Sync all tracked users and reflect progress in the Download Manager."""
     if sync_status['running']:
         return jsonify({'success': False, 'error': 'Sync already in progress'})
+    memory_error = memory_pressure_error()
+    if memory_error:
+        return jsonify({'success': False, 'error': memory_error}), 503
     t = threading.Thread(target=run_sync_all_process)
     t.start()
     return jsonify({'success': True, 'message': 'Sync started'})
 
-@app.route('/api/sync_status')
-def get_sync_status():
-    """Get current sync status and logs."""
-    return jsonify({
+def get_sync_status_snapshot(include_logs=True):
+    """Current sync status as a JSON-ready dict (shared by /api/sync_status and the event stream)."""
+    with sync_workers_lock:
+        workers = [dict(w, name=name) for name, w in sorted(sync_status.get('workers', {}).items())]
+    snapshot = {
         'running': sync_status['running'],
         'current_user': sync_status['current_user'],
         'current_timeout': sync_status.get('current_timeout', False),
-        'timeout_users': sync_status.get('timeout_users', []),
+        'timeout_users': list(sync_status.get('timeout_users', [])),
         'timeout_count': timeout_count,
         'last_sync': sync_status['last_sync'].isoformat() if sync_status['last_sync'] else None,
-        'logs': sync_logs[-50:]  # Last 50 log entries
-    })
+        'workers': [
+            {
+                'name': w['name'],
+                'platform': w['platform'],
+                'user': w['user'],
+                'phase': w['phase'],
+                'started': w['started'],  # epoch seconds; clients derive the elapsed time
+                'completed': w['completed']
+            }
+            for w in workers
+        ]
+    }
+    if include_logs:
+        snapshot['logs'] = sync_logs[-50:]  # Last 50 log entries
+    return snapshot
+
+@app.route('/api/sync_status')
+def get_sync_status():
+    """Get current sync status and logs."""
+    return jsonify(get_sync_status_snapshot())
 
 # Feed routes
 
@@ -2342,101 +4420,184 @@ def feed():
     """TikTok-like scrolling feed with all downloaded media."""
     return render_template('feed.html')
 
+# Feed ordering
+# The feed order is generated once per (seed, filters) and cached, so infinite
+# scroll pages through one fixed sequence instead of a fresh shuffle per
+# request. Each order covers a snapshot of the catalog: the media ids up to the
+# highest one when its first page was served (carried in the cursor). Media
+# downloaded later stays out of that order, so an expired or evicted entry is
+# rebuilt identically unless media in the snapshot was removed.
+# Orders are produced lazily: a page only advances the generator as far as it
+# needs, so the first page of a large catalog does not pay for the whole order.
+FEED_ORDER_CACHE_SIZE = 32  # feed orders (sessions x filter combinations) kept in memory
+FEED_ORDER_TTL = 3600       # seconds an unused feed order is kept
+FEED_PAGE_MAX = 100         # largest page /api/feed/media returns
+FEED_RECENCY_HALF_LIFE = 30 * 86400  # seconds for the recency boost to halve
+
+_feed_orders = OrderedDict()
+_feed_orders_lock = threading.Lock()
+
+def build_feed_order(seed, media_type=None, platform=None, max_id=None):
+    """(total, generator of media ids) in feed order for one seed and catalog snapshot.
+    Items are weighted by the feed_video_weight / feed_image_weight settings
+    and boosted by recency (feed_recency_boost, relative to the newest item so
+    the order stays reproducible). Each user's media is weighted-shuffled, then
+    users are interleaved by interleave_feed(). A weight of 0 leaves a type out.
+    Only media with ids up to `max_id` (when given) is included.
+    """
+    query = 'SELECT m.id, m.type, m.mtime, u.username FROM media m JOIN users u ON u.id = m.user_id'
+    conditions, params = [], []
+    if max_id is not None:
+        conditions.append('m.id <= ?')
+        params.append(max_id)
+    if media_type:
+        conditions.append('m.type = ?')
+        params.append(media_type)
+    if platform:
+        conditions.append('m.platform = ?')
+        params.append(platform)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY m.id'
+    
+    conn = get_db_connection()
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    
+    type_weights = {
+        'video': get_float_setting('feed_video_weight', 1.0),
+        'image': get_float_setting('feed_image_weight', 1.0),
+    }
+    recency_boost = get_float_setting('feed_recency_boost', 1.0)
+    newest = max((row['mtime'] or 0 for row in rows), default=0)
+    
+    rng = random.Random(f"{seed}:{media_type or ''}:{platform or ''}")
+    user_media = {}
+    total = 0
+    for row in rows:
+        w = type_weights.get(row['type'], 1.0)
+        if w <= 0:
+            continue
+        age = max(newest - (row['mtime'] or 0), 0)
+        w *= 1 + recency_boost * 0.5 ** (age / FEED_RECENCY_HALF_LIFE)
+        # Weighted shuffle key (Efraimidis-Spirakis): heavier items tend to come first
+        user_media.setdefault(row['username'], []).append((rng.random() ** (1 / w), w, row['id']))
+        total += 1
+    for items in user_media.values():
+        items.sort(reverse=True)
+    
+    order = interleave_feed(user_media, rng, weight=lambda item: item[1])
+    return total, (item[2] for item in order)
+
+def get_feed_page(seed, media_type, platform, max_id, start, limit):
+    """(media ids at start:start+limit, total) for one feed order, generating only as far as needed."""
+    key = (seed, media_type, platform, max_id)
+    now = time.time()
+    with _feed_orders_lock:
+        # Least recently used first, so expired orders are all at the front
+        while _feed_orders and now - next(iter(_feed_orders.values()))['used'] > FEED_ORDER_TTL:
+            _feed_orders.popitem(last=False)
+        order = _feed_orders.get(key)
+        if order is not None:
+            order['used'] = now
+            _feed_orders.move_to_end(key)
+    if order is None:
+        total, ids = build_feed_order(seed, media_type, platform, max_id)
+        order = {'total': total, 'ids': [], 'pending': ids, 'used': now}
+        with _feed_orders_lock:
+            order = _feed_orders.setdefault(key, order)
+            while len(_feed_orders) > FEED_ORDER_CACHE_SIZE:
+                _feed_orders.popitem(last=False)
+    
+    # Generators are not thread-safe; extend the prefix under the lock
+    with _feed_orders_lock:
+        missing = start + limit - len(order['ids'])
+        if missing > 0 and order['pending'] is not None:
+            order['ids'].extend(itertools.islice(order['pending'], missing))
+            if len(order['ids']) >= order['total']:
+                order['pending'] = None
+        return order['ids'][start:start + limit], order['total']
+
+def encode_feed_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_feed_cursor(cursor):
+    """Cursor state dict, or None if the cursor is malformed."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if (isinstance(state, dict) and isinstance(state.get('seed'), str)
+                and type(state.get('pos')) is int and state['pos'] >= 0
+                and (state.get('max') is None or type(state['max']) is int)):
+            return state
+    except (ValueError, TypeError):
+        pass
+    return None
+
 @app.route('/api/feed/media')
 def get_feed_media():
-    """Get random mixed media from all downloaded profiles."""
+    """Get mixed media from all downloaded profiles, one page of a seeded feed order.
+    The first request passes `seed` (and optional `type` / `platform` filters);
+    later pages pass the returned `next_cursor` instead.
+    """
     try:
-        limit = request.args.get('limit', 20, type=int)
-        offset = request.args.get('offset', 0, type=int)
-        
-        # Collect all media files from all users
-        media_items = []
-        
-        conn = get_db_connection()
-        users = conn.execute('SELECT username, platform, display_name FROM users').fetchall()
-        conn.close()
+        limit = max(1, min(request.args.get('limit', 20, type=int), FEED_PAGE_MAX))
+        cursor = request.args.get('cursor')
         
-        for user in users:
-            username = user['username']
-            platform = user['platform']
-            display_name = user['display_name'] or username
-            
-            # Main downloads directory
-            user_dir = os.path.join(DOWNLOADS_PATH, platform, username)
-            
-            if os.path.exists(user_dir):
-                for root, dirs, files in os.walk(user_dir):
-                    for file in files:
-                        if file.lower().endswith(('.mp4', '.jpg', '.jpeg', '.png', '.gif')):
-                            file_path = os.path.join(root, file)
-                            rel_path = os.path.relpath(file_path, DOWNLOADS_PATH)
-                            file_type = 'video' if file.lower().endswith('.mp4') else 'image'
-                            
-                            # Determine content type (post, story, highlight)
-                            content_type = 'post'
-                            if 'stories' in rel_path.lower():
-                                content_type = 'story'
-                            elif 'highlights' in rel_path.lower():
-                                content_type = 'highlight'
-                            
-                            media_items.append({
-                                'path': rel_path.replace('\\', '/'),
-                                'type': file_type,
-                                'username': username,
-                                'display_name': display_name,
-                                'platform': platform,
-                                'content_type': content_type,
-                                'size': os.path.getsize(file_path),
-                                'modified': os.path.getmtime(file_path)
-                            })
-        
-        # Smart shuffle to prevent consecutive posts from same user
-        import random
-        
-        # Group media by user
-        user_media = {}
-        for item in media_items:
-            username = item['username']
-            if username not in user_media:
-                user_media[username] = []
-            user_media[username].append(item)
-        
-        # Shuffle each user's media
-        for username in user_media:
-            random.shuffle(user_media[username])
-        
-        # Interleave posts from different users
-        shuffled_media = []
-        user_indices = {username: 0 for username in user_media}
-        last_username = None
-        
-        while len(shuffled_media) < len(media_items):
-            # Get list of users who still have media
-            available_users = [u for u in user_media if user_indices[u] < len(user_media[u])]
-            
-            if not available_users:
-                break
-            
-            # Remove last used user from options if possible
-            if last_username and last_username in available_users and len(available_users) > 1:
-                available_users = [u for u in available_users if u != last_username]
-            
-            # Pick a random user from available
-            username = random.choice(available_users)
-            
-            # Add one item from this user
-            shuffled_media.append(user_media[username][user_indices[username]])
-            user_indices[username] += 1
-            last_username = username
+        if cursor:
+            state = decode_feed_cursor(cursor)
+            if state is None:
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        else:
+            media_type = request.args.get('type')
+            platform = request.args.get('platform')
+            state = {
+                'seed': request.args.get('seed') or uuid.uuid4().hex,
+                'type': media_type if media_type and media_type != 'all' else None,
+                'platform': platform if platform and platform != 'all' else None,
+                'pos': max(request.args.get('offset', 0, type=int), 0)
+            }
+            conn = get_db_connection()
+            state['max'] = conn.execute('SELECT MAX(id) FROM media').fetchone()[0] or 0
+            conn.close()
         
-        # Apply pagination
-        paginated_items = shuffled_media[offset:offset + limit]
+        start = state['pos']
+        page_ids, total = get_feed_page(state['seed'], state.get('type'), state.get('platform'), state.get('max'),
+                                        start, limit)
         
+        rows = []
+        if page_ids:
+            conn = get_db_connection()
+            rows = conn.execute(f'''
+                SELECT m.id, m.path, m.type, m.kind, m.size, m.mtime,
+                       u.username, u.platform, u.display_name
+                FROM media m
+                JOIN users u ON u.id = m.user_id
+                WHERE m.id IN ({','.join('?' * len(page_ids))})
+            ''', page_ids).fetchall()
+            conn.close()
+        by_id = {row['id']: row for row in rows}
+        
+        # Items removed from the catalog since the order was built are skipped
+        paginated_items = [{
+            'path': row['path'],
+            'type': row['type'],
+            'username': row['username'],
+            'display_name': row['display_name'] or row['username'],
+            'platform': row['platform'],
+            'content_type': row['kind'],
+            'size': row['size'],
+            'modified': row['mtime'],
+            'version': media_version(row['size'], row['mtime'])
+        } for row in (by_id.get(media_id) for media_id in page_ids) if row is not None]
+        
+        has_more = start + limit < total
         return jsonify({
             'success': True,
             'media': paginated_items,
-            'total': len(shuffled_media),
-            'has_more': (offset + limit) < len(shuffled_media)
+            'total': total,
+            'seed': state['seed'],
+            'has_more': has_more,
+            'next_cursor': encode_feed_cursor(dict(state, pos=start + limit)) if has_more else None
         })
         
     except Exception as e:
@@ -2697,7 +4858,8 @@ def test_access():
         cmd = ['gallery-dl', '--dump-json', '--no-download']
         if active and os.path.exists(cookie_path):
             cmd.extend(['--cookies', cookie_path])
-        ig_result = subprocess.run(cmd + ['https://www.instagram.com/'], capture_output=True, text=True, timeout=30)
+        with external_process('instagram'):
+            ig_result = subprocess.run(cmd + ['https://www.instagram.com/'], capture_output=True, text=True, timeout=30)
         ig_success = ig_result.returncode == 0
         ig_msg = 'Instagram access working' if ig_success else 'Instagram access failed'
     except Exception as e:
@@ -2734,7 +4896,8 @@ def test_instagram_stories_endpoint(username):
         if active and os.path.exists(cookie_path):
             test_cmd.extend(['--cookies', cookie_path])
         
-        result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=30)
+        with external_process('instagram'):
+            result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=30)
         
         output = result.stdout + result.stderr
         success = result.returncode == 0
@@ -2758,32 +4921,10 @@ def test_instagram_stories_endpoint(username):
 @app.route('/avatar/<username>')
 def get_avatar(username):
     """Serve user avatar."""
-    platform = request.args.get('platform')
-    
-    # Try with platform prefix if platform provided
-    if platform:
-        for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
-            filename = f"{platform}_{username}{ext}"
-            path = os.path.join(AVATARS_PATH, filename)
-            if os.path.exists(path):
-                return send_file(path)
-
-    # Try all prefixes if no platform specific found or platform not provided
-    for prefix_plat in ['tiktok', 'instagram', 'coomer']:
-        for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
-            filename = f"{prefix_plat}_{username}{ext}"
-            path = os.path.join(AVATARS_PATH, filename)
-            if os.path.exists(path):
-                return send_file(path)
-                
-    # Legacy fallback (no prefix)
-    for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
-        filename = f"{username}{ext}"
-        path = os.path.join(AVATARS_PATH, filename)
-        if os.path.exists(path):
-            return send_file(path)
-            
-    return abort(404)
+    path = resolve_avatar(username, request.args.get('platform'))
+    if not path:
+        abort(404)
+    return send_media_file(path)
 
 @app.route('/api/refresh_avatar/<username>', methods=['POST'])
 def refresh_user_avatar(username):
@@ -2803,14 +4944,7 @@ def refresh_user_avatar(username):
         platform = user['platform']
         
         # Remove existing avatar files
-        for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
-            old_path = os.path.join(AVATARS_PATH, f"{platform}_{username}{ext}")
-            if os.path.exists(old_path):
-                os.remove(old_path)
-            # Also remove old format without platform prefix for backwards compatibility
-            old_path_legacy = os.path.join(AVATARS_PATH, f"{username}{ext}")
-            if os.path.exists(old_path_legacy):
-                os.remove(old_path_legacy)
+        remove_avatar_files(username, platform)
         
         # Download new avatar
         local_avatar = download_avatar_with_gallery_dl(username, platform)
@@ -2958,13 +5092,14 @@ def upload_instagram_following_cookie():
         
         # Optional: Test Instagram access (but don't fail if it doesn't work)
         try:
-            test_result = subprocess.run([
-                'gallery-dl', 
-                '--cookies', file_path,
-                '--dump-json',
-                '--no-download', 
-                'https://www.instagram.com/'
-            ], capture_output=True, text=True, timeout=15)
+            with external_process('instagram'):
+                test_result = subprocess.run([
+                    'gallery-dl', 
+                    '--cookies', file_path,
+                    '--dump-json',
+                    '--no-download', 
+                    'https://www.instagram.com/'
+                ], capture_output=True, text=True, timeout=15)
             
             if test_result.returncode == 0:
                 print(f"Cookie file Instagram access test passed: {filename}")
@@ -3027,7 +5162,8 @@ def fetch_instagram_following():
         ]
         
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+            with external_process('instagram'):
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
             
             if result.returncode != 0:
                 error_output = result.stderr or result.stdout
@@ -3449,6 +5585,10 @@ def add_selected_instagram_profiles():
             def background_sync():
                 for username in usernames:
                     clean_username = username.strip().replace('@', '')
+                    memory_error = memory_pressure_error()
+                    if memory_error:
+                        print(f"Stopping stats refresh for added profiles: {memory_error}")
+                        break
                     if clean_username:
                         try:
                             success, message = update_user_stats(clean_username, 'instagram')
@@ -3783,7 +5923,7 @@ def get_scheduler_status():
                     next_run_time += timedelta(days=1)
                 next_run = next_run_time.strftime('%Y-%m-%d %H:%M:%S')
             else:  # weekly
-                target_day = int(get_setting('schedule_day', '0') or 0)
+                target_day = get_int_setting('schedule_day', 0)
                 days_ahead = target_day - now.weekday()
                 if days_ahead <= 0:  # Target day already passed this week
                     days_ahead += 7
@@ -3797,7 +5937,7 @@ def get_scheduler_status():
         'running': scheduler_started,
         'frequency': get_setting('schedule_frequency', 'daily'),
         'time': get_setting('schedule_time', '03:00'),
-        'day': int(get_setting('schedule_day', '0') or 0),
+        'day': get_int_setting('schedule_day', 0),
         'last_run': last_run,
         'next_run': next_run,
         'recent_logs': scheduler_logs[-20:] if scheduler_logs else []
@@ -3880,7 +6020,7 @@ def start_scheduler_thread():
                     else:
                         reason = f"Waiting for {time_str} (now: {now.strftime('%H:%M')})"
                 else:  # weekly
-                    target_day = int(get_setting('schedule_day', '0') or 0)
+                    target_day = get_int_setting('schedule_day', 0)
                     day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
                     is_day = now.weekday() == target_day
                     
@@ -3897,7 +6037,10 @@ def start_scheduler_thread():
                         else:
                             reason = f"Waiting for {time_str} (now: {now.strftime('%H:%M')})"
                 
-                if should_run:
+                memory_error = memory_pressure_error() if should_run else None
+                if memory_error:
+                    log_scheduler(f"⏸️ Postponing scheduled sync - {memory_error}")
+                elif should_run:
                     log_scheduler(f"🚀 Starting scheduled sync - {reason}")
                     # Start sync in background
                     threading.Thread(target=run_sync_all_process, daemon=True).start()
@@ -3908,6 +6051,8 @@ def start_scheduler_thread():
                 log_scheduler(f"❌ Error in scheduler: {str(e)}")
                 # Never crash scheduler
                 time.sleep(60)
+            finally:
+                release_thread_db_connection()
 
     t = threading.Thread(target=scheduler_loop, daemon=True)
     t.start()
@@ -3940,12 +6085,13 @@ def get_all_google_drive_files_from_folder(folder_url, max_files=500):
             ]
             
             # Run with longer timeout for large folders
-            result = subprocess.run(
-                list_cmd,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout for large folders
-            )
+            with external_process('gdrive'):
+                result = subprocess.run(
+                    list_cmd,
+                    capture_output=True,
+                    text=True,
+                    timeout=300  # 5 minute timeout for large folders
+                )
             
             file_info = []
             if result.stdout:
@@ -4027,12 +6173,13 @@ def get_additional_drive_files(folder_id, temp_dir):
             direct_url
         ]
         
-        result = subprocess.run(
-            alt_cmd,
-            capture_output=True,
-            text=True,
-            timeout=180
-        )
+        with external_process('gdrive'):
+            result = subprocess.run(
+                alt_cmd,
+                capture_output=True,
+                text=True,
+                timeout=180
+            )
         
         if result.stdout:
             lines = result.stdout.split('\n')
@@ -4089,12 +6236,13 @@ def download_google_drive_files_in_batches(file_info_list, output_dir, progress_
                     file_url
                 ]
                 
-                file_result = subprocess.run(
-                    file_cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=180  # 3 minute timeout per file for batch mode
-                )
+                with external_process('gdrive'):
+                    file_result = subprocess.run(
+                        file_cmd,
+                        capture_output=True,
+                        text=True,
+                        timeout=180  # 3 minute timeout per file for batch mode
+                    )
                 
                 if file_result.returncode == 0 and os.path.exists(os.path.join(output_dir, filename)):
                     success_count += 1
@@ -4109,12 +6257,13 @@ def download_google_drive_files_in_batches(file_info_list, output_dir, progress_
                         file_url
                     ]
                     
-                    retry_result = subprocess.run(
-                        retry_cmd,
-                        capture_output=True,
-                        text=True,
-                        timeout=120
-                    )
+                    with external_process('gdrive'):
+                        retry_result = subprocess.run(
+                            retry_cmd,
+                            capture_output=True,
+                            text=True,
+                            timeout=120
+                        )
                     
                     if retry_result.returncode == 0 and os.path.exists(os.path.join(output_dir, filename)):
                         success_count += 1
@@ -4124,16 +6273,9 @@ def download_google_drive_files_in_batches(file_info_list, output_dir, progress_
                         
             except Exception as e:
                 print(f"Error downloading {filename}: {e}")
-            
-            # Brief pause between downloads to avoid rate limiting
-            import time
-            time.sleep(0.5)  # Shorter delay for batch mode
         
-        # Longer pause between batches
         if batch_end < total_files:  # Not the last batch
-            print(f"Batch {batch_num} completed. Pausing before next batch...")
-            import time
-            time.sleep(2)  # 2 second pause between batches
+            print(f"Batch {batch_num} completed.")
     
     print(f"Batch download completed: {success_count}/{total_files} files successful")
     return success_count, total_files
@@ -4168,12 +6310,13 @@ def download_google_drive_files_individually(file_info_list, output_dir, progres
                 file_url
             ]
             
-            file_result = subprocess.run(
-                file_cmd,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout per file
-            )
+            with external_process('gdrive'):
+                file_result = subprocess.run(
+                    file_cmd,
+                    capture_output=True,
+                    text=True,
+                    timeout=300  # 5 minute timeout per file
+                )
             
             if file_result.returncode == 0 and os.path.exists(os.path.join(output_dir, filename)):
                 success_count += 1
@@ -4183,17 +6326,19 @@ def download_google_drive_files_individually(file_info_list, output_dir, progres
                 
         except Exception as e:
             print(f"Error downloading {filename}: {e}")
-        
-        # Brief pause between downloads to avoid rate limiting
-        import time
-        time.sleep(1)
     
     return success_count, total_files
 
-def perform_external_download(url, destination_folder=None, progress_callback=None):
+def perform_external_download(url, destination_folder=None, progress_callback=None, control_key=None, start_position=0):
     """Perform external download using appropriate tool (gdown for Google Drive, gallery-dl for others).
-    Returns (success: bool, output: str, file_count: int, service_name: str)
+    `control_key` is the name /api/downloads/pause/ stops it by; gallery-dl
+    downloads continue after `start_position` items, gdown relies on --continue.
+    Returns (success: bool, output: str, file_count: int, service_name: str, paused: bool, position: int)
     """
+    control_key = control_key or url
+    _download_controls.setdefault(control_key, {'pause': False})
+    paused = False
+    position = start_position
     try:
         # Detect service type from URL
         service_name = 'unknown'
@@ -4287,67 +6432,75 @@ def perform_external_download(url, destination_folder=None, progress_callback=No
                     cmd.append(url)
             
                 # Run gdown with real-time output capture for progress tracking
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1,
-                    universal_newlines=True,
-                    cwd=output_dir
-                )
+                with external_process('gdrive', label=control_key):
+                    process = subprocess.Popen(
+                        cmd,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        text=True,
+                        bufsize=1,
+                        universal_newlines=True,
+                        cwd=output_dir
+                    )
+                    download_processes[control_key] = process
                 
-                output_lines = []
-                files_processed = 0
+                    output_lines = []
+                    files_processed = 0
                 
-                # Track permission errors and other issues
-                permission_errors = []
-                processing_files = []
-                download_errors = []
+                    # Track permission errors and other issues
+                    permission_errors = []
+                    processing_files = []
+                    download_errors = []
                 
-                # Real-time output processing for progress tracking
-                for line in iter(process.stdout.readline, ''):
-                    if not line:
-                        break
-                    line = line.strip()
-                    output_lines.append(line)
+                    # Real-time output processing for progress tracking
+                    for line in iter(process.stdout.readline, ''):
+                        if not line:
+                            break
+                        line = line.strip()
+                        output_lines.append(line)
                     
-                    # Track permission errors
-                    if 'Cannot retrieve the public link' in line or 'You may need to change the permission' in line:
-                        permission_errors.append(line)
-                    elif 'Processing file' in line and ('.JPG' in line or '.jpg' in line or '.png' in line or '.mp4' in line):
-                        # Extract filename from "Processing file 1P6SOQjehpb3NFMCKI9gONP8gIt06bm-F IMG_0671.JPG"
-                        parts = line.split(' ')
-                        if len(parts) >= 4:
-                            filename = parts[-1]  # Get the last part (filename)
-                            processing_files.append(filename)
-                            print(f"Processing file: {filename}")
-                            if progress_callback:
-                                progress_callback(len(processing_files), f"Processing: {filename}")
-                    elif 'Failed to retrieve file url' in line or 'Gdown can\'t' in line:
-                        download_errors.append(line)
+                        # Track permission errors
+                        if 'Cannot retrieve the public link' in line or 'You may need to change the permission' in line:
+                            permission_errors.append(line)
+                        elif 'Processing file' in line and ('.JPG' in line or '.jpg' in line or '.png' in line or '.mp4' in line):
+                            # Extract filename from "Processing file 1P6SOQjehpb3NFMCKI9gONP8gIt06bm-F IMG_0671.JPG"
+                            parts = line.split(' ')
+                            if len(parts) >= 4:
+                                filename = parts[-1]  # Get the last part (filename)
+                                processing_files.append(filename)
+                                print(f"Processing file: {filename}")
+                                if progress_callback:
+                                    progress_callback(len(processing_files), f"Processing: {filename}")
+                        elif 'Failed to retrieve file url' in line or 'Gdown can\'t' in line:
+                            download_errors.append(line)
                     
-                    # Track progress indicators from gdown
-                    if 'Downloading' in line or 'From:' in line:
-                        files_processed += 1
-                        print(f"Google Drive progress: {line}")
-                        if progress_callback:
-                            progress_callback(files_processed, f"Downloading file {files_processed}")
-                    elif '%' in line and ('|' in line or 'B/s' in line):
-                        # Progress bar line
-                        print(f"Google Drive progress: {line}")
-                        if progress_callback:
-                            # Extract current file info from progress line if possible
-                            current_info = line[:50] + '...' if len(line) > 50 else line
-                            progress_callback(files_processed, current_info)
-                    elif 'Done' in line or 'Download completed' in line:
-                        files_processed += 1
-                        print(f"Google Drive: {line}")
-                        if progress_callback:
-                            progress_callback(files_processed, f"Completed file {files_processed}")
+                        # Track progress indicators from gdown
+                        if 'Downloading' in line or 'From:' in line:
+                            files_processed += 1
+                            print(f"Google Drive progress: {line}")
+                            if progress_callback:
+                                progress_callback(files_processed, f"Downloading file {files_processed}")
+                        elif '%' in line and ('|' in line or 'B/s' in line):
+                            # Progress bar line
+                            print(f"Google Drive progress: {line}")
+                            if progress_callback:
+                                # Extract current file info from progress line if possible
+                                current_info = line[:50] + '...' if len(line) > 50 else line
+                                progress_callback(files_processed, current_info)
+                        elif 'Done' in line or 'Download completed' in line:
+                            files_processed += 1
+                            print(f"Google Drive: {line}")
+                            if progress_callback:
+                                progress_callback(files_processed, f"Completed file {files_processed}")
                 
-                process.stdout.close()
-                return_code = process.wait()
+                    process.stdout.close()
+                    return_code = process.wait()
+                    download_processes.pop(control_key, None)
+                
+                # pause_download() terminates gdown; --continue picks the files up on resume
+                if _download_controls.get(control_key, {}).get('pause'):
+                    paused = True
+                    break
                 
                 # Check if this attempt was successful
                 files_downloaded = 0
@@ -4373,6 +6526,10 @@ def perform_external_download(url, destination_folder=None, progress_callback=No
                         # Final attempt failed
                         break
             
+            if paused:
+                output_lines.append("Download paused by user")
+                return False, '\n'.join(output_lines), 0, service_name, True, position
+            
             # Create result object to match subprocess.run format
             class MockResult:
                 def __init__(self, returncode, stdout, stderr=''):
@@ -4465,12 +6622,13 @@ def perform_external_download(url, destination_folder=None, progress_callback=No
                                 url
                             ]
                             
-                            gallery_result = subprocess.run(
-                                gallery_cmd,
-                                capture_output=True,
-                                text=True,
-                                timeout=DOWNLOAD_TIMEOUT
-                            )
+                            with external_process(url):
+                                gallery_result = subprocess.run(
+                                    gallery_cmd,
+                                    capture_output=True,
+                                    text=True,
+                                    timeout=DOWNLOAD_TIMEOUT
+                                )
                             
                             # Check if gallery-dl worked
                             gallery_file_count = 0
@@ -4510,12 +6668,13 @@ def perform_external_download(url, destination_folder=None, progress_callback=No
                             url
                         ]
                         
-                        gallery_result = subprocess.run(
-                            gallery_cmd,
-                            capture_output=True,
-                            text=True,
-                            timeout=DOWNLOAD_TIMEOUT
-                        )
+                        with external_process(url):
+                            gallery_result = subprocess.run(
+                                gallery_cmd,
+                                capture_output=True,
+                                text=True,
+                                timeout=DOWNLOAD_TIMEOUT
+                            )
                         
                         # Check if gallery-dl worked
                         gallery_file_count = 0
@@ -4554,15 +6713,18 @@ def perform_external_download(url, destination_folder=None, progress_callback=No
                 '--dest', output_dir,
                 '--write-metadata',
                 '--write-info-json',
-                url
             ]
+            cmd.extend(range_args(start_position))
+            cmd.append(url)
             
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=DOWNLOAD_TIMEOUT
-            )
+            run = run_pausable_process(cmd, control_key, rate_key=url, dest=output_dir, timeout=DOWNLOAD_TIMEOUT)
+            if run['timed_out']:
+                raise subprocess.TimeoutExpired(cmd, DOWNLOAD_TIMEOUT)
+            if run['stalled']:
+                run['output'].append(f"No output for {get_int_setting('download_idle_timeout', DOWNLOAD_IDLE_TIMEOUT)}s, download terminated")
+            paused = run['paused']
+            position = start_position + run['position']
+            result = subprocess.CompletedProcess(cmd, run['returncode'], '\n'.join(run['output']), '')
         
         # Count downloaded files
         file_count = 0
@@ -4570,15 +6732,71 @@ def perform_external_download(url, destination_folder=None, progress_callback=No
             for root, dirs, files in os.walk(output_dir):
                 file_count += len([f for f in files if f.lower().endswith(('.mp4', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.wav', '.pdf', '.txt', '.doc', '.docx', '.zip', '.rar', '.pptx', '.xlsx'))])
         
-        success = result.returncode == 0
+        success = result.returncode == 0 and not paused
         output = result.stdout + "\n" + result.stderr if result.stderr else result.stdout
         
-        return success, output, file_count, service_name
+        return success, output, file_count, service_name, paused, position
         
     except subprocess.TimeoutExpired:
-        return False, f"Download timed out after {DOWNLOAD_TIMEOUT} seconds", 0, service_name
+        return False, f"Download timed out after {DOWNLOAD_TIMEOUT} seconds", 0, service_name, False, position
+    except Exception as e:
+        return False, f"Error: {str(e)}", 0, service_name, False, position
+
+def run_external_download(download_id, url, destination=None, resume=False):
+    """Run an external download under its queue entry `download_id`.
+    A pause saves a checkpoint that resume=True continues from.
+    """
+    checkpoint = get_download_checkpoint(download_id) if resume else None
+    if not checkpoint:
+        clear_download_checkpoint(download_id)
+    # Pin the timestamp folder now so a resumed run writes to the same place
+    destination = destination or datetime.now().strftime('%Y%m%d_%H%M%S')
+    _download_controls.setdefault(download_id, {})['pause'] = False
+    update_global_queue(download_id, status='downloading', current_file='Preparing external download...')
+    
+    # Create a progress callback function
+    def progress_callback(files_processed, current_file_info):
+        update_global_queue(download_id,
+                          status='downloading',
+                          files_downloaded=files_processed,
+                          current_file=current_file_info)
+    
+    try:
+        with download_scheduler.slot('interactive'):
+            success, output, file_count, service_name, paused, position = perform_external_download(
+                url, destination, progress_callback, control_key=download_id,
+                start_position=checkpoint['position'] if checkpoint else 0)
+        
+        if paused:
+            save_download_checkpoint(download_id, 'external', position, {'url': url, 'destination': destination})
+            update_global_queue(download_id,
+                              status='paused',
+                              files_downloaded=file_count,
+                              current_file=f'Paused after {position} items from {service_name}',
+                              logs=output.split('\n') if output else [])
+            print(f"External download paused: {service_name}, {position} items")
+            return
+        
+        clear_download_checkpoint(download_id)
+        final_status = 'completed' if success else 'failed'
+        update_global_queue(download_id,
+                          status=final_status,
+                          total_files=file_count,
+                          files_downloaded=file_count,
+                          current_file=f'Downloaded {file_count} files from {service_name}',
+                          logs=output.split('\n') if output else [])
+        
+        if success:
+            print(f"External download completed: {service_name}, {file_count} files")
+        else:
+            print(f"External download failed: {service_name}, {output}")
+            
     except Exception as e:
-        return False, f"Error: {str(e)}", 0, service_name
+        update_global_queue(download_id,
+                          status='failed',
+                          current_file=f'Error: {str(e)}',
+                          logs=[str(e)])
+        print(f"External download error: {e}")
 
 @app.route('/api/external_download', methods=['POST'])
 def external_download():
@@ -4598,6 +6816,10 @@ def external_download():
         if not (url.startswith('http://') or url.startswith('https://')):
             return jsonify({'success': False, 'error': 'Invalid URL format'})
         
+        memory_error = memory_pressure_error()
+        if memory_error:
+            return jsonify({'success': False, 'error': memory_error}), 503
+        
         # Check if URL is from supported services
         supported_domains = [
             'drive.google.com', 'docs.google.com',  # Google Drive (gdown)
@@ -4619,37 +6841,7 @@ def external_download():
         def download_thread():
             # Add to global queue
             add_to_global_queue(download_id)
-            update_global_queue(download_id, status='downloading', current_file='Preparing external download...')
-            
-            # Create a progress callback function
-            def progress_callback(files_processed, current_file_info):
-                update_global_queue(download_id,
-                                  status='downloading',
-                                  files_downloaded=files_processed,
-                                  current_file=current_file_info)
-            
-            try:
-                success, output, file_count, service_name = perform_external_download(url, destination, progress_callback)
-                
-                final_status = 'completed' if success else 'failed'
-                update_global_queue(download_id,
-                                  status=final_status,
-                                  total_files=file_count,
-                                  files_downloaded=file_count,
-                                  current_file=f'Downloaded {file_count} files from {service_name}',
-                                  logs=output.split('\n') if output else [])
-                
-                if success:
-                    print(f"External download completed: {service_name}, {file_count} files")
-                else:
-                    print(f"External download failed: {service_name}, {output}")
-                    
-            except Exception as e:
-                update_global_queue(download_id,
-                                  status='failed',
-                                  current_file=f'Error: {str(e)}',
-                                  logs=[str(e)])
-                print(f"External download error: {e}")
+            run_external_download(download_id, url, destination)
         
         # Start download in background
         thread = threading.Thread(target=download_thread)
@@ -4703,18 +6895,11 @@ def refresh_all_avatars():
             
             try:
                 # Remove existing avatar files (both new format and legacy format)
-                for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
-                    # New format with platform prefix
-                    old_path = os.path.join(AVATARS_PATH, f"{platform}_{username}{ext}")
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                    # Legacy format without platform prefix
-                    old_path_legacy = os.path.join(AVATARS_PATH, f"{username}{ext}")
-                    if os.path.exists(old_path_legacy):
-                        os.remove(old_path_legacy)
+                remove_avatar_files(username, platform)
                 
-                # Download new avatar
-                local_avatar = download_avatar_with_gallery_dl(username, platform)
+                # Download new avatar (lowest priority; yields to downloads and syncs between users)
+                with download_scheduler.slot('avatar'):
+                    local_avatar = download_avatar_with_gallery_dl(username, platform)
                 
                 if local_avatar:
                     success_count += 1
@@ -4722,9 +6907,6 @@ def refresh_all_avatars():
                 else:
                     print(f"Failed to refresh avatar for {username} ({platform}) ({success_count}/{total_count})")
                 
-                # Add delay between requests to avoid rate limiting
-                time.sleep(REQUEST_DELAY)
-                
             except Exception as e:
                 print(f"Error refreshing avatar for {username} ({platform}): {e}")
         
@@ -4744,34 +6926,76 @@ def refresh_all_avatars():
         'message': 'Avatar refresh started for all users'
     })
 
+@app.route('/api/media/rescan', methods=['POST'])
+def rescan_media():
+    """Reconcile the media catalog with the downloads folder."""
+    data = request.get_json(silent=True) or {}
+    full = bool(data.get('full', False))
+
+    if _media_reconcile_lock.locked():
+        return jsonify({'success': False, 'error': 'A media rescan is already running'})
+
+    thread = threading.Thread(target=reconcile_media_catalog, kwargs={'full': full, 'show_progress': True}, daemon=True)
+    thread.start()
+
+    return jsonify({
+        'success': True,
+        'message': 'Full media rescan started' if full else 'Media rescan started'
+    })
+
+# Media serving
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 86400  # seconds; versioned URLs never change
+
+def send_media_file(path, mimetype=None, version=None):
+    """send_file() with Range and conditional-GET support and a strong size+mtime ETag.
+    A request whose ?v= matches the file's current version is cacheable
+    forever (a replaced file gets a new version, hence a new URL); other
+    requests are revalidated, which costs a 304 when nothing changed.
+    `version` defaults to the file's own; thumbnails pass their source's.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        abort(404)
+    if version is None:
+        version = media_version(st.st_size, st.st_mtime)
+    immutable = request.args.get('v') == version
+    response = send_file(os.path.abspath(path), mimetype=mimetype, conditional=True, etag=version,
+                         last_modified=st.st_mtime, max_age=MEDIA_IMMUTABLE_MAX_AGE if immutable else None)
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
 @app.route('/downloads/<path:filename>')
 def download_file(filename):
     """Serve downloaded files."""
-    file_path = os.path.join(DOWNLOADS_PATH, filename)
-    if os.path.exists(file_path):
-        return send_file(file_path)
-    abort(404)
+    file_path = safe_join(DOWNLOADS_PATH, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    return send_media_file(file_path)
 
-@app.route('/avatar/<username>')
-def avatar(username):
-    """Serve cached avatar for a user or 404 if not available."""
-    # Get optional platform parameter
-    platform = request.args.get('platform', '').lower()
+@app.route('/thumbs/<path:filename>')
+def thumbnail(filename):
+    """Serve a WebP thumbnail (poster frame for videos) of a downloaded file.
+    A missing one is queued ahead of background work and a placeholder is
+    returned meanwhile; images fall back to the original file if ffmpeg fails.
+    """
+    file_path = safe_join(DOWNLOADS_PATH, filename)
+    if file_path is None:
+        abort(404)
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        abort(404)
+    file_type = 'video' if filename.lower().endswith('.mp4') else 'image'
     
-    # Determine file by checking common extensions and platform-prefixed filenames
-    for ext in ['.jpg', '.jpeg', '.png', '.webp']:
-        # If platform is specified, prioritize that platform's avatar
-        if platform in ('tiktok', 'instagram'):
-            candidate = os.path.join(AVATARS_PATH, f"{platform}_{username}{ext}")
-            if os.path.exists(candidate):
-                return send_file(candidate)
-        
-        # Check all platform prefixes as fallback (for backward compatibility)
-        for name in [f"{username}{ext}", f"tiktok_{username}{ext}", f"instagram_{username}{ext}"]:
-            candidate = os.path.join(AVATARS_PATH, name)
-            if os.path.exists(candidate):
-                return send_file(candidate)
-    abort(404)
+    dest, pending = submit_thumbnail(filename, st.st_size, st.st_mtime, file_type, priority=THUMB_ON_DEMAND)
+    if os.path.exists(dest):
+        return send_media_file(dest, mimetype='image/webp', version=media_version(st.st_size, st.st_mtime))
+    if file_type == 'image' and not pending:
+        return redirect(url_for('download_file', filename=filename, **request.args))
+    # Pending, or a video ffmpeg could not read: a blank image rather than a broken one
+    return Response(THUMB_PLACEHOLDER, mimetype='image/gif', headers={'Cache-Control': 'no-store'})
 
 @app.route('/api/download_zip/<username>')
 def download_user_zip(username):
@@ -4902,10 +7126,15 @@ def start_telegram_bot():
                 conn.commit()
                 conn.close()
                 
+                memory_error = memory_pressure_error()
+                if memory_error:
+                    bot.reply_to(message, f"✅ Added {username} ({platform}). ⚠️ Metadata sync skipped: {memory_error}")
+                    return
                 bot.reply_to(message, f"✅ Added {username} ({platform}). Syncing metadata...")
                 
                 def sync_new():
-                    update_user_stats(username, platform)
+                    with download_scheduler.slot('interactive'):
+                        update_user_stats(username, platform)
                 threading.Thread(target=sync_new).start()
                 
             except Exception as e:
@@ -4930,8 +7159,10 @@ def start_telegram_bot():
                     bot.reply_to(message, f"❌ User {username} ({platform}) not found.")
                     return
                 
-                # Delete from user_tags and users
+                # Delete from user_tags, media and users
                 conn.execute('DELETE FROM user_tags WHERE user_id = ?', (user['id'],))
+                conn.execute('DELETE FROM media WHERE user_id = ?', (user['id'],))
+                conn.execute('DELETE FROM media_dirs WHERE user_id = ?', (user['id'],))
                 conn.execute('DELETE FROM users WHERE id = ?', (user['id'],))
                 conn.commit()
                 conn.close()
@@ -4950,10 +7181,10 @@ def start_telegram_bot():
                     return
                 
                 query = parts[1].strip()
-                match = f"%{query}%"
+                clause, params = user_search_clause(query)
                 
                 conn = get_db_connection()
-                users = conn.execute('SELECT username, platform FROM users WHERE username LIKE ? ORDER BY id DESC LIMIT 20', (match,)).fetchall()
+                users = conn.execute(f'SELECT u.username, u.platform FROM users u WHERE {clause} ORDER BY u.id DESC LIMIT 20', params).fetchall()
                 conn.close()
                 
                 if not users:
@@ -5093,22 +7324,9 @@ def start_telegram_bot():
                         pass
                     
                     # Try to find avatar
-                    found_path = None
-                    for ext in ['.jpg', '.jpeg', '.png', '.webp']:
-                        # Try platform specific first
-                        candidates = [
-                            f"{platform}_{username}{ext}",
-                            f"{username}{ext}",
-                            f"tiktok_{username}{ext}",
-                            f"instagram_{username}{ext}"
-                        ]
-                        
-                        for candidate in candidates:
-                            full_path = os.path.join(AVATARS_PATH, candidate)
-                            if os.path.exists(full_path):
-                                found_path = full_path
-                                break
-                        if found_path: break
+                    found_path = resolve_avatar(username, platform)
+                    if found_path and not os.path.exists(found_path):
+                        found_path = None
                     
                     # Back button markup
                     markup = telebot.types.InlineKeyboardMarkup()
@@ -5192,6 +7410,12 @@ if __name__ == '__main__':
     os.makedirs(DOWNLOADS_PATH, exist_ok=True)
     os.makedirs(AVATARS_PATH, exist_ok=True)
     
+    # Keep the media catalog in sync with files added outside the app
+    start_media_reconciler_thread()
+    
+    # Pick up syncs/downloads interrupted by the last shutdown
+    resume_interrupted_jobs()
+    
     print("TrackUI starting...")
     print(f"Downloads will be saved to: {os.path.abspath(DOWNLOADS_PATH)}")
     
@@ -0,0 +1,81 @@
+import random
+import time
+import itertools
+
+from feed_interleave import interleave_feed
+
+ITEMS = 500_000
+CREATORS = 1_000
+LEGACY_ITEMS = 20_000  # the old loop is quadratic; time it on a smaller catalog
+
+def make_catalog(items, creators, seed=1):
+    """Per-creator lists of (id, weight) with a long-tail distribution of catalog sizes."""
+    rng = random.Random(seed)
+    sizes = [1 / (rank + 1) for rank in range(creators)]
+    scale = items / sum(sizes)
+    user_media = {}
+    next_id = 0
+    for rank, share in enumerate(sizes):
+        count = max(1, int(share * scale))
+        user_media[f"creator{rank}"] = [(next_id + i, rng.choice((1.0, 1.5, 3.0))) for i in range(count)]
+        next_id += count
+    return user_media
+
+def legacy_interleave(user_media, rng):
+    """The per-item list-comprehension shuffle the feed used before."""
+    total = sum(len(items) for items in user_media.values())
+    shuffled_media = []
+    user_indices = {username: 0 for username in user_media}
+    last_username = None
+    while len(shuffled_media) < total:
+        available_users = [u for u in user_media if user_indices[u] < len(user_media[u])]
+        if not available_users:
+            break
+        if last_username and last_username in available_users and len(available_users) > 1:
+            available_users = [u for u in available_users if u != last_username]
+        username = rng.choice(available_users)
+        shuffled_media.append(user_media[username][user_indices[username]])
+        user_indices[username] += 1
+        last_username = username
+    return shuffled_media
+
+def count_repeats(order, owner):
+    return sum(1 for a, b in zip(order, order[1:]) if owner[a[0]] == owner[b[0]])
+
+def bench_interleave():
+    user_media = make_catalog(ITEMS, CREATORS)
+    owner = {item[0]: username for username, items in user_media.items() for item in items}
+    total = len(owner)
+    print(f"Catalog: {total} items across {len(user_media)} creators")
+
+    started = time.perf_counter()
+    first_page = list(itertools.islice(interleave_feed(user_media, random.Random(1)), 20))
+    print(f"⏱️  First page (20 items, lazy):     {(time.perf_counter() - started) * 1000:8.1f} ms")
+
+    started = time.perf_counter()
+    order = list(interleave_feed(user_media, random.Random(1)))
+    elapsed = time.perf_counter() - started
+    print(f"⏱️  Full order, unweighted:          {elapsed * 1000:8.1f} ms ({total / elapsed:,.0f} items/s)")
+    assert len(order) == total and order[:20] == first_page
+
+    started = time.perf_counter()
+    weighted = list(interleave_feed(user_media, random.Random(1), weight=lambda item: item[1]))
+    elapsed = time.perf_counter() - started
+    print(f"⏱️  Full order, weighted:            {elapsed * 1000:8.1f} ms ({total / elapsed:,.0f} items/s)")
+    assert len(weighted) == total
+
+    print(f"Consecutive same-creator items: {count_repeats(order, owner)} unweighted, {count_repeats(weighted, owner)} weighted")
+
+    small = make_catalog(LEGACY_ITEMS, CREATORS)
+    small_total = sum(len(items) for items in small.values())
+    started = time.perf_counter()
+    list(interleave_feed(small, random.Random(1)))
+    heap_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    legacy_interleave(small, random.Random(1))
+    legacy_elapsed = time.perf_counter() - started
+    print(f"⏱️  {small_total} items: heap {heap_elapsed * 1000:.1f} ms vs legacy loop {legacy_elapsed * 1000:.1f} ms "
+          f"({legacy_elapsed / heap_elapsed:.0f}x)")
+
+if __name__ == "__main__":
+    bench_interleave()
@@ -0,0 +1,37 @@
+"""Feed interleaving, kept free of app.py's database and thread setup so it can
+be imported on its own (see bench_feed_interleave.py).
+"""
+import heapq
+import itertools
+
+def interleave_feed(user_media, rng, weight=None):
+    """Lazily merge per-user lists so the same user never appears twice in a row where avoidable.
+    Every user's next item fires after an exponential delay with rate
+    `weight(item)` (1 without weights) and the earliest fires first, which is a
+    weighted random choice among users with items left. A heap keeps this
+    O(log users) per item.
+    """
+    heap = []
+    tiebreak = itertools.count()
+    for username, items in user_media.items():
+        items = iter(items)
+        for item in items:
+            delay = rng.expovariate(weight(item) if weight else 1.0)
+            heap.append((delay, next(tiebreak), username, item, items))
+            break
+    heapq.heapify(heap)
+
+    last_username = None
+    while heap:
+        if heap[0][2] == last_username and len(heap) > 1:
+            # Let the runner-up go first; the repeated user stays queued
+            entry = heapq.heapreplace(heap, heapq.heappop(heap))
+        else:
+            entry = heapq.heappop(heap)
+        fired_at, _, username, item, items = entry
+        yield item
+        last_username = username
+        for next_item in items:
+            delay = rng.expovariate(weight(next_item) if weight else 1.0)
+            heapq.heappush(heap, (fired_at + delay, next(tiebreak), username, next_item, items))
+            break
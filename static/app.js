@@ -357,6 +357,11 @@ function closeProgressModal() {
 function startProgressPolling(username) {
     if (progressPollingInterval) {
         clearInterval(progressPollingInterval);
+        progressPollingInterval = null;
+    }
+    if (downloadStreamConnected) {
+        // Progress arrives over the download event stream
+        return;
     }
 
     progressPollingInterval = setInterval(() => {
@@ -658,7 +663,9 @@ let downloadsPollingInterval = null;
 function showDownloadsModal() {
     showModalWithId('downloadsModal');
     loadDownloadsList();
-    startDownloadsPolling();
+    if (!downloadStreamConnected) {
+        startDownloadsPolling();
+    }
 }
 
 function closeDownloadsModal() {
@@ -688,6 +695,19 @@ function updateDownloadsStats(data) {
     document.getElementById('activeDownloads').textContent = data.active_downloads;
     document.getElementById('completedDownloads').textContent = data.completed_downloads;
     document.getElementById('failedDownloads').textContent = data.failed_downloads;
+    if (data.processes) {
+        renderProcessSlots(data.processes);
+    }
+}
+
+function renderProcessSlots(processes) {
+    const item = document.getElementById('processSlotsItem');
+    const value = document.getElementById('processSlots');
+    if (!item || !value) return;
+    const waiting = processes.waiting || [];
+    item.style.display = 'flex';
+    value.textContent = `${processes.running}/${processes.limit}` + (waiting.length ? ` (+${waiting.length} waiting)` : '');
+    item.title = waiting.length ? `Waiting: ${waiting.join(', ')}` : '';
 }
 
 function renderDownloadsList(downloads) {
@@ -708,7 +728,7 @@ function renderDownloadsList(downloads) {
         const startTime = new Date(download.start_time * 1000);
         const statusClass = download.status === 'downloading' ? 'active' : download.status;
         const progress = download.progress || 0;
-        const canPause = download.status === 'downloading';
+        const canPause = download.status === 'downloading' || download.status === 'stalled';
         const canResume = download.status === 'paused';
 
         html += `
@@ -736,6 +756,7 @@ function renderDownloadsList(downloads) {
                     <div class="download-actions-row">
                         ${canPause ? `<button class="btn btn-sm btn-secondary download-action-btn" onclick="pauseDownload('${download.username}')" title="Pause Download">⏸️</button>` : ''}
                         ${canResume ? `<button class="btn btn-sm btn-primary download-action-btn" onclick="resumeDownload('${download.username}')" title="Resume Download">▶️</button>` : ''}
+                        ${download.logs && download.logs.length ? `<a class="btn btn-sm btn-secondary download-action-btn" href="/api/downloads/${encodeURIComponent(download.id)}/log" target="_blank" title="View Log">📄</a>` : ''}
                     </div>
                 </div>
             </div>
@@ -998,109 +1019,225 @@ function runSyncNow() {
         .catch(() => showToast('Failed to start sync', 'error'));
 }
 
-// Update global download indicator and sync status
+// Update global download indicator and sync status (polling fallback for the event stream)
 function updateGlobalDownloadIndicator() {
     Promise.all([
         fetch('/api/downloads/status').then(r => r.json()),
         fetch('/api/sync_status').then(r => r.json())
     ])
-        .then(([downloadData, syncData]) => {
-            const indicator = document.getElementById('downloadIndicator');
-            const badge = document.getElementById('downloadBadge');
-            const progressFill = document.getElementById('globalProgressFill');
-            const downloadCount = document.getElementById('downloadCount');
-            const statusText = document.getElementById('statusText');
-            const statusIndicator = document.getElementById('statusIndicator');
-            const syncBtn = document.getElementById('syncAllBtn');
-
-            // --- Handle Downloads UI (Always update badge/indicator hidden state) ---
-            if (indicator && badge && progressFill && downloadCount) {
-                if (downloadData.active_downloads > 0) {
-                    indicator.style.display = 'flex';
-                    badge.style.display = 'inline';
-                    badge.textContent = downloadData.active_downloads;
-
-                    // Calculate overall progress
-                    const activeDownloads = downloadData.downloads.filter(d => d.status === 'downloading' || d.status === 'running');
-                    if (activeDownloads.length > 0) {
-                        const totalProgress = activeDownloads.reduce((sum, d) => sum + (d.progress || 0), 0);
-                        const averageProgress = totalProgress / activeDownloads.length;
-                        progressFill.style.width = `${averageProgress}%`;
-                        downloadCount.textContent = downloadData.active_downloads;
-                    }
-                } else {
-                    indicator.style.display = 'none';
-                    if (downloadData.total_downloads === 0) {
-                        badge.style.display = 'none';
-                    } else {
-                        badge.style.display = 'inline';
-                        badge.textContent = downloadData.completed_downloads;
-                        badge.style.background = 'var(--accent-success)';
-                    }
-                }
+        .then(([downloadData, syncData]) => renderGlobalDownloadIndicator(downloadData, syncData))
+        .catch(error => {
+            console.error('Error updating global indicator:', error);
+        });
+}
+
+function renderGlobalDownloadIndicator(downloadData, syncData) {
+    const indicator = document.getElementById('downloadIndicator');
+    const badge = document.getElementById('downloadBadge');
+    const progressFill = document.getElementById('globalProgressFill');
+    const downloadCount = document.getElementById('downloadCount');
+    const statusText = document.getElementById('statusText');
+    const statusIndicator = document.getElementById('statusIndicator');
+    const syncBtn = document.getElementById('syncAllBtn');
+
+    // --- Handle Downloads UI (Always update badge/indicator hidden state) ---
+    if (indicator && badge && progressFill && downloadCount) {
+        if (downloadData.active_downloads > 0) {
+            indicator.style.display = 'flex';
+            badge.style.display = 'inline';
+            badge.textContent = downloadData.active_downloads;
+
+            // Calculate overall progress
+            const activeDownloads = downloadData.downloads.filter(d => ['downloading', 'running', 'stalled'].includes(d.status));
+            if (activeDownloads.length > 0) {
+                const totalProgress = activeDownloads.reduce((sum, d) => sum + (d.progress || 0), 0);
+                const averageProgress = totalProgress / activeDownloads.length;
+                progressFill.style.width = `${averageProgress}%`;
+                downloadCount.textContent = downloadData.active_downloads;
+            }
+        } else {
+            indicator.style.display = 'none';
+            if (downloadData.total_downloads === 0) {
+                badge.style.display = 'none';
+            } else {
+                badge.style.display = 'inline';
+                badge.textContent = downloadData.completed_downloads;
+                badge.style.background = 'var(--accent-success)';
             }
+        }
+    }
 
-            // --- Handle Main Status Text & Sync Button ---
-            if (statusText && statusIndicator && syncBtn) {
-                // Priority 1: Syncing
-                if (syncData.running) {
-                    if (syncData.current_timeout) {
-                        statusIndicator.className = 'status-indicator timeout';
-                        statusText.textContent = `⏱️ Timeout: ${syncData.current_user || 'unknown'}`;
-                        syncBtn.innerHTML = '<span class="btn-icon">⏱️</span>Syncing (Timeout)...';
-                    } else {
-                        statusIndicator.className = 'status-indicator running';
-                        statusText.textContent = `Syncing ${syncData.current_user || '...'}`;
-                        syncBtn.innerHTML = '<span class="btn-icon">⏳</span>Syncing...';
-                    }
-                    syncBtn.disabled = true;
-
-                    // Show immediate timeout notification
-                    if (syncData.current_timeout && syncData.current_user) {
-                        const timeoutMsg = `⏱️ ${syncData.current_user} is taking longer than expected`;
-                        if (!document.querySelector('.toast')?.textContent.includes(syncData.current_user)) {
-                            showToast(timeoutMsg, 'warning', 8000);
-                        }
-                    }
-                    return; // Exit, Sync takes priority for text
+    // --- Handle Main Status Text & Sync Button ---
+    if (statusText && statusIndicator && syncBtn) {
+        // Priority 1: Syncing
+        if (syncData.running) {
+            if (syncData.current_timeout) {
+                statusIndicator.className = 'status-indicator timeout';
+                statusText.textContent = `⏱️ Timeout: ${syncData.current_user || 'unknown'}`;
+                syncBtn.innerHTML = '<span class="btn-icon">⏱️</span>Syncing (Timeout)...';
+            } else {
+                statusIndicator.className = 'status-indicator running';
+                const busyWorkers = (syncData.workers || []).filter(w => w.user);
+                statusText.textContent = busyWorkers.length > 1
+                    ? `Syncing ${busyWorkers.length} users (${busyWorkers.map(w => w.user).join(', ')})`
+                    : `Syncing ${syncData.current_user || '...'}`;
+                syncBtn.innerHTML = '<span class="btn-icon">⏳</span>Syncing...';
+            }
+            syncBtn.disabled = true;
+
+            // Show immediate timeout notification
+            if (syncData.current_timeout && syncData.current_user) {
+                const timeoutMsg = `⏱️ ${syncData.current_user} is taking longer than expected`;
+                if (!document.querySelector('.toast')?.textContent.includes(syncData.current_user)) {
+                    showToast(timeoutMsg, 'warning', 8000);
                 }
+            }
+            return; // Exit, Sync takes priority for text
+        }
 
-                // Sync not running, enable button
-                syncBtn.disabled = false;
-                syncBtn.innerHTML = '<span class="btn-icon">🔄</span>Sync All';
+        // Sync not running, enable button
+        syncBtn.disabled = false;
+        syncBtn.innerHTML = '<span class="btn-icon">🔄</span>Sync All';
 
-                // Priority 2: Active Downloads (including Avatar Refresh)
-                if (downloadData.active_downloads > 0) {
-                    statusIndicator.className = 'status-indicator active';
-                    statusIndicator.style.background = 'var(--accent-primary)';
+        // Priority 2: Active Downloads (including Avatar Refresh)
+        if (downloadData.active_downloads > 0) {
+            statusIndicator.className = 'status-indicator active';
+            statusIndicator.style.background = 'var(--accent-primary)';
 
-                    const activeDownloads = downloadData.downloads.filter(d => d.status === 'downloading' || d.status === 'running');
-                    const refreshTask = activeDownloads.find(d => d.username === 'Refresh Avatars');
+            const activeDownloads = downloadData.downloads.filter(d => ['downloading', 'running', 'stalled'].includes(d.status));
+            const refreshTask = activeDownloads.find(d => d.username === 'Refresh Avatars');
 
-                    if (refreshTask) {
-                        statusText.textContent = `Refreshing Avatars (${refreshTask.progress}%)`;
-                    } else {
-                        statusText.textContent = `Downloading (${downloadData.active_downloads})...`;
-                    }
-                    return;
-                }
+            if (refreshTask) {
+                statusText.textContent = `Refreshing Avatars (${refreshTask.progress}%)`;
+            } else {
+                statusText.textContent = `Downloading (${downloadData.active_downloads})...`;
+            }
+            return;
+        }
 
-                // Priority 3: Ready / Idle
-                statusIndicator.className = 'status-indicator ready';
-                statusIndicator.style.background = 'var(--accent-success)'; // Ensure green
+        // Priority 3: Ready / Idle
+        statusIndicator.className = 'status-indicator ready';
+        statusIndicator.style.background = 'var(--accent-success)'; // Ensure green
 
-                if (syncData.timeout_users && syncData.timeout_users.length > 0) {
-                    statusText.textContent = `Ready (${syncData.timeout_users.length} timeouts)`;
-                    statusText.title = `Timed out users: ${syncData.timeout_users.join(', ')}`;
-                } else {
-                    statusText.textContent = 'Ready';
-                    statusText.title = '';
-                }
-            }
-        })
-        .catch(error => {
-            console.error('Error updating global indicator:', error);
-        });
+        if (syncData.timeout_users && syncData.timeout_users.length > 0) {
+            statusText.textContent = `Ready (${syncData.timeout_users.length} timeouts)`;
+            statusText.title = `Timed out users: ${syncData.timeout_users.join(', ')}`;
+        } else {
+            statusText.textContent = 'Ready';
+            statusText.title = '';
+        }
+    }
+}
+
+// Download event stream: the server pushes queue deltas and sync status over
+// /api/downloads/stream; polling is only used while the stream is unavailable.
+let downloadEventSource = null;
+let downloadStreamConnected = false;
+let downloadStatusPollingInterval = null;
+let downloadRenderPending = false;
+const downloadStreamState = { entries: new Map(), sync: null, processes: null };
+
+function connectDownloadEvents() {
+    if (!window.EventSource) {
+        startDownloadStatusPolling();
+        return;
+    }
+
+    downloadEventSource = new EventSource('/api/downloads/stream');
+    downloadEventSource.onopen = () => {
+        downloadStreamConnected = true;
+        stopDownloadStatusPolling();
+    };
+    downloadEventSource.onerror = () => {
+        // EventSource reconnects on its own; poll in the meantime
+        downloadStreamConnected = false;
+        startDownloadStatusPolling();
+    };
+
+    downloadEventSource.addEventListener('snapshot', e => {
+        const data = JSON.parse(e.data);
+        downloadStreamState.entries = new Map(data.downloads.map(d => [d.id, d]));
+        downloadStreamState.processes = data.processes || null;
+        scheduleDownloadRender();
+    });
+    downloadEventSource.addEventListener('update', e => {
+        const delta = JSON.parse(e.data);
+        const entry = downloadStreamState.entries.get(delta.id) || {};
+        downloadStreamState.entries.set(delta.id, Object.assign(entry, delta));
+        scheduleDownloadRender();
+    });
+    downloadEventSource.addEventListener('remove', e => {
+        JSON.parse(e.data).ids.forEach(id => downloadStreamState.entries.delete(id));
+        scheduleDownloadRender();
+    });
+    downloadEventSource.addEventListener('processes', e => {
+        downloadStreamState.processes = JSON.parse(e.data);
+        scheduleDownloadRender();
+    });
+    downloadEventSource.addEventListener('sync', e => {
+        downloadStreamState.sync = JSON.parse(e.data);
+        scheduleDownloadRender();
+    });
+}
+
+function startDownloadStatusPolling() {
+    if (downloadStatusPollingInterval) return;
+    updateGlobalDownloadIndicator();
+    downloadStatusPollingInterval = setInterval(updateGlobalDownloadIndicator, 2000);
+}
+
+function stopDownloadStatusPolling() {
+    if (downloadStatusPollingInterval) {
+        clearInterval(downloadStatusPollingInterval);
+        downloadStatusPollingInterval = null;
+    }
+    if (downloadsPollingInterval) {
+        clearInterval(downloadsPollingInterval);
+        downloadsPollingInterval = null;
+    }
+    if (progressPollingInterval) {
+        clearInterval(progressPollingInterval);
+        progressPollingInterval = null;
+    }
+}
+
+// Same shape as /api/downloads/status
+function summarizeDownloads(downloads) {
+    return {
+        total_downloads: downloads.length,
+        active_downloads: downloads.filter(d => ['downloading', 'running', 'stalled'].includes(d.status)).length,
+        completed_downloads: downloads.filter(d => d.status === 'completed').length,
+        failed_downloads: downloads.filter(d => d.status === 'failed').length,
+        downloads: downloads.sort((a, b) => b.start_time - a.start_time)
+    };
+}
+
+function scheduleDownloadRender() {
+    if (downloadRenderPending) return;
+    downloadRenderPending = true;
+    requestAnimationFrame(() => {
+        downloadRenderPending = false;
+        renderDownloadStreamState();
+    });
+}
+
+function renderDownloadStreamState() {
+    const downloadData = summarizeDownloads([...downloadStreamState.entries.values()]);
+    downloadData.processes = downloadStreamState.processes;
+    if (downloadStreamState.sync) {
+        renderGlobalDownloadIndicator(downloadData, downloadStreamState.sync);
+    }
+
+    const downloadsModal = document.getElementById('downloadsModal');
+    if (downloadsModal && downloadsModal.style.display === 'flex') {
+        updateDownloadsStats(downloadData);
+        renderDownloadsList(downloadData.downloads);
+    }
+
+    if (currentProgressUsername) {
+        const entry = downloadData.downloads.find(d => d.username === currentProgressUsername);
+        if (entry) updateProgressDisplay(entry);
+    }
 }
 
 // Tag Assignment Functions
@@ -1408,11 +1545,8 @@ document.addEventListener('DOMContentLoaded', function () {
         }, 1000);
     }
 
-    // Start auto-refresh for sync status and download indicator
-    setInterval(() => {
-        updateGlobalDownloadIndicator();
-    }, 2000);
-    updateGlobalDownloadIndicator(); // Initial call
+    // Subscribe to download/sync updates (falls back to polling if the stream is unavailable)
+    connectDownloadEvents();
 
     // Load settings and reflect in UI
     loadSettings();
@@ -2099,6 +2233,38 @@ function exportDatabase() {
     window.location.href = '/api/settings/export';
 }
 
+function rescanMediaLibrary(event) {
+    const rescanBtn = document.getElementById('rescanMediaBtn');
+    if (rescanBtn.disabled) return;
+
+    const full = !!(event && event.shiftKey);
+    const originalText = rescanBtn.innerHTML;
+    rescanBtn.disabled = true;
+    rescanBtn.innerHTML = '<span class="btn-icon">⏳</span> Starting...';
+
+    fetch('/api/media/rescan', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ full: full })
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                showToast(data.message || 'Media rescan started', 'info');
+            } else {
+                showToast(data.error || 'Failed to start media rescan', 'error');
+            }
+        })
+        .catch(error => {
+            console.error('Error starting media rescan:', error);
+            showToast('Error starting media rescan', 'error');
+        })
+        .finally(() => {
+            rescanBtn.disabled = false;
+            rescanBtn.innerHTML = originalText;
+        });
+}
+
 function triggerImportDatabase() {
     document.getElementById('importDatabaseFile').click();
 }